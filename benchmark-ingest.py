@@ -0,0 +1,591 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time every stage of the ingest hot path on (synthetic) catalogs:
+
+    fits_open, SourceTable.from_hdu, cutout_subtable + algo construction,
+    Assumptions.apply, DBTable/DbImage.transform, TSV encoding,
+    COPY into the DB, and index / primary key builds,
+
+plus Wcs.pixeltosky and the WcsJacobian conversions.
+Results are appended to a JSON-lines file tagged with the git commit,
+so that runs at different commits can be compared with --compare.
+Stages that cannot run (no DB server, missing module) are recorded as skipped.
+"""
+
+import glob
+import io
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy
+import psycopg2
+
+import lib.benchmark
+import lib.common
+import lib.config
+import lib.dbimage
+import lib.fits
+import lib.synthetic
+from lib.assumptions import Assumptions
+from lib.forcedsource_finder import ForcedSourceFinder
+from lib.libwcs import Wcs
+from lib.sourcetable import SourceTable
+
+if lib.config.MULTICORE:
+    from lib import pipe_printf
+
+
+def main():
+    import argparse
+    cmdline = ' '.join(sys.argv)
+    print('Invocation: ' + cmdline)
+
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Benchmark the stages of the ingest scripts.')
+
+    parser.add_argument('--data-dir',
+                        help="Directory written by generate-synthetic-catalogs.py "
+                             "(containing rerun/ and forced/). "
+                             "If omitted, synthetic catalogs are generated in a temporary directory")
+    parser.add_argument('--patches', type=int, default=3,
+                        help="Patches per side of the generated tract")
+    parser.add_argument('--objects', type=int, default=2000,
+                        help="Objects per generated patch")
+    parser.add_argument('--visits', type=int, default=2,
+                        help="Generated visits of forced sources")
+    parser.add_argument('--rafts', type=int, default=3,
+                        help="Rafts per generated visit")
+    parser.add_argument('--sources', type=int, default=2000,
+                        help="Forced sources per generated sensor")
+    parser.add_argument('--wcs-points', type=int, default=1000000,
+                        help="Number of points in the WCS benchmark")
+    parser.add_argument('--lightcurves', type=int, default=200,
+                        help="Number of light curves (objects) fetched in the "
+                             "light-curve benchmark")
+    parser.add_argument('--assumptions', default='test/assumptions.yaml',
+                        help="Assumptions file for the forced sources")
+    parser.add_argument('--schema', default='bench_ingest',
+                        help="DB schema to (re)create for the DB stages")
+    parser.add_argument("--db-server", metavar="key=value", nargs="+", action="append",
+                        help="DB connect parms.")
+    parser.add_argument('--no-db', action='store_true',
+                        help="Skip the stages requiring a DB server")
+    parser.add_argument('--index-strategies', nargs='*', default=["btree", "brin"],
+                        choices=["btree", "brin", "both"],
+                        help="Index strategies of the object tables to compare")
+    parser.add_argument('--label', default='ingest',
+                        help="Label under which to record the run")
+    parser.add_argument('--results', default='benchmark-results.jsonl',
+                        help="JSON-lines file to which to append the results")
+    parser.add_argument('--compare', nargs='*', metavar='COMMIT',
+                        help="Do not run; compare recorded results (of the given commits, or all)")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        lib.benchmark.compare(args.results, label=args.label, commits=args.compare)
+        return
+
+    if args.db_server:
+        lib.config.dbServer.update(keyvalue.split('=', 1) for keyvalue in itertools.chain.from_iterable(args.db_server))
+
+    lib.config.tableSpace = ""
+    lib.config.indexSpace = ""
+
+    tempDir = None
+    dataDir = args.data_dir
+    if dataDir is None:
+        tempDir = dataDir = tempfile.mkdtemp()
+        lib.synthetic.generate_object_catalog(
+            os.path.join(dataDir, "rerun"), [4850], nPatch=args.patches,
+            nObjects=args.objects)
+        lib.synthetic.generate_forcedsource(
+            os.path.join(dataDir, "forced"), list(range(159479, 159479 + args.visits)),
+            [4850], nPatch=args.patches, nObjects=args.objects,
+            nRafts=args.rafts, nSources=args.sources)
+
+    bench = lib.benchmark.Benchmark(label=args.label)
+
+    db = None
+    if args.no_db:
+        dbError = "--no-db"
+    else:
+        try:
+            db = lib.common.new_db_connection()
+            dbError = None
+        except psycopg2.Error as e:
+            dbError = "cannot connect to DB: {}".format(str(e).strip().splitlines()[0])
+
+    try:
+        if db is not None:
+            with db.cursor() as cursor:
+                cursor.execute('DROP SCHEMA IF EXISTS "{}" CASCADE'.format(args.schema))
+                cursor.execute('CREATE SCHEMA "{}"'.format(args.schema))
+            db.commit()
+
+        bench_forcedsource(bench, os.path.join(dataDir, "forced"),
+                           args.assumptions, db, dbError, args.schema,
+                           args.lightcurves)
+        bench_object(bench, os.path.join(dataDir, "rerun"), db, dbError, args.schema)
+        bench_index_strategies(bench, os.path.join(dataDir, "rerun"), db, dbError, args.schema,
+                               args.index_strategies)
+        bench_wcs(bench, args.wcs_points)
+
+        if db is not None:
+            with db.cursor() as cursor:
+                cursor.execute('DROP SCHEMA IF EXISTS "{}" CASCADE'.format(args.schema))
+            db.commit()
+    finally:
+        if db is not None:
+            db.close()
+        if tempDir is not None:
+            shutil.rmtree(tempDir)
+
+    bench.report()
+    bench.save(args.results)
+
+
+def bench_forcedsource(bench, forcedDir, assumptionsPath, db, dbError, schemaName,
+                       nLightcurves=200):
+    """
+    Time the stages of ingest-forcedsource.py
+    @param bench
+        lib.benchmark.Benchmark
+    @param forcedDir
+        Directory of forced-source catalogs
+    @param assumptionsPath
+        Path to the assumptions yaml
+    @param db
+        DB connection, or None
+    @param dbError
+        Reason why db is None
+    @param schemaName
+        DB schema for the DB stages
+    @param nLightcurves
+        Number of objects whose light curves are fetched
+        before and after the table is clustered by objectId
+    """
+    finder = ForcedSourceFinder(forcedDir)
+    assumptions = Assumptions(assumptionsPath)
+    assumptions.parse()
+
+    encoded = []
+    # Partitions (of partitioned tables) into which the files go:
+    # (table name, suffix) -> determiners
+    partitions = {}
+    for visit in finder.get_visits():
+        for path in finder.get_visit_files(visit):
+            determiners = finder.get_determiner_dict(path)
+
+            with bench.time("forced.fits_open", nBytes=os.stat(path).st_size):
+                hdus = lib.fits.fits_open(path)
+
+            with bench.time("forced.from_hdu"):
+                raw_table = SourceTable.from_hdu(hdus[1])
+            nRows = len(next(iter(raw_table.fields.values())).data)
+            bench.stage("forced.fits_open").rows += nRows
+            bench.stage("forced.from_hdu").rows += nRows
+
+            with bench.time("forced.assumptions", nRows=nRows):
+                dbimages = assumptions.apply(raw_table, schemaName, **determiners)
+
+            for dbimage in dbimages.values():
+                with bench.time("forced.transform", nRows=nRows):
+                    dbimage.transform()
+                if dbimage.partition:
+                    suffix, bound = lib.dbimage.get_partition_bound(dbimage.partition, determiners)
+                    partitions.setdefault((dbimage.name, suffix), determiners)
+
+                fieldNames, format, columns = _field_data([(dbimage, "")])
+                tsv = _encode(bench, "forced", format, columns, nRows)
+                encoded.append((dbimage, fieldNames, tsv, nRows))
+
+    if db is None:
+        bench.skip("forced.copy_from", dbError)
+        bench.skip("forced.primary_key", dbError)
+        bench.skip("forced.lightcurve", dbError)
+        bench.skip("forced.cluster", dbError)
+        bench.skip("forced.lightcurve_sorted", dbError)
+        return
+
+    with db.cursor() as cursor:
+        created = set()
+        for dbimage, fieldNames, tsv, nRows in encoded:
+            if dbimage.name not in created:
+                dbimage.create(cursor, schemaName)
+                created.add(dbimage.name)
+                for (name, suffix), determiners in sorted(partitions.items()):
+                    if name == dbimage.name:
+                        lib.dbimage.create_partition(cursor, schemaName, name,
+                                                     dbimage.partition, determiners)
+            with bench.time("forced.copy_from", nRows=nRows, nBytes=len(tsv)):
+                cursor.copy_from(io.BytesIO(tsv), '"{}"."{}"'.format(schemaName, dbimage.name),
+                                 sep='\t', size=-1, columns=fieldNames)
+        db.commit()
+
+        nRows = sum(n for _, _, _, n in encoded)
+        done = set()
+        for dbimage, _, _, _ in encoded:
+            if dbimage.name in done:
+                continue
+            done.add(dbimage.name)
+            with bench.time("forced.primary_key", nRows=nRows):
+                for table in _get_physical_tables(cursor, schemaName, dbimage):
+                    dbimage.create_primary(cursor, table)
+                db.commit()
+
+        # Light curves of random objects, in the order of insertion
+        # (by visit) and after clustering by objectId
+        objectIds = numpy.unique(numpy.concatenate([
+            dbimage.fields["objectId"].data for dbimage, _, _, _ in encoded]))
+        objectIds = numpy.random.RandomState(0).choice(
+            objectIds, min(nLightcurves, len(objectIds)), replace=False)
+        dbimages = dict((dbimage.name, dbimage) for dbimage, _, _, _ in encoded)
+        for name, dbimage in dbimages.items():
+            table = '"{}"."{}"'.format(schemaName, name)
+            _fetch_lightcurves(bench, "forced.lightcurve", cursor, table, objectIds)
+            with bench.time("forced.cluster", nRows=nRows):
+                for physicalTable in _get_physical_tables(cursor, schemaName, dbimage):
+                    for statement in dbimage.get_cluster_statements(physicalTable):
+                        cursor.execute(statement)
+                db.commit()
+            _fetch_lightcurves(bench, "forced.lightcurve_sorted", cursor, table, objectIds)
+
+
+def _get_physical_tables(cursor, schemaName, dbimage):
+    """
+    @return list of the names of the tables holding the rows of dbimage:
+            the table itself, or each of its partitions if it is partitioned
+    """
+    if dbimage.partition:
+        return lib.dbimage.get_partitions(cursor, schemaName, dbimage.name)
+    return [dbimage.name]
+
+
+def _fetch_lightcurves(bench, stage, cursor, table, objectIds):
+    """
+    Time fetching the light curves (all rows) of objects one by one,
+    and print the mean number of heap pages that hold a light curve.
+    """
+    pages = 0
+    for objectId in objectIds:
+        with bench.time(stage) as record:
+            cursor.execute("SELECT * FROM {} WHERE objectId = %s".format(table),
+                           (int(objectId),))
+            record.rows += len(cursor.fetchall())
+        cursor.execute(
+            "SELECT count(DISTINCT (ctid::text::point)[0]) FROM {} WHERE objectId = %s".format(table),
+            (int(objectId),))
+        pages += cursor.fetchone()[0]
+    print("{}: {:.1f} ms per light curve, {:.2f} pages per light curve".format(
+        stage, 1e3 * bench.stage(stage).seconds / max(1, len(objectIds)),
+        pages / max(1, len(objectIds))))
+
+
+def bench_object(bench, rerunDir, db, dbError, schemaName):
+    """
+    Time the stages of ingest-object-catalog.py
+    @param bench
+        lib.benchmark.Benchmark
+    @param rerunDir
+        Rerun directory of the object catalog
+    @param db
+        DB connection, or None
+    @param dbError
+        Reason why db is None
+    @param schemaName
+        DB schema for the DB stages
+    """
+    paths = sorted(glob.glob(os.path.join(rerunDir, "deepCoadd-results", "*", "*", "*,*", "*.fits")))
+    for path in paths:
+        with bench.time("object.fits_open", nBytes=os.stat(path).st_size):
+            hdus = lib.fits.fits_open(path)
+        with bench.time("object.from_hdu"):
+            table = SourceTable.from_hdu(hdus[1])
+        nRows = len(table.fields["id"].data)
+        bench.stage("object.fits_open").rows += nRows
+        bench.stage("object.from_hdu").rows += nRows
+
+    stages = ["object.algos", "object.plan", "object.transform", "object.encode_tsv", "object.copy_from", "object.index"]
+    try:
+        ingest = lib.benchmark.load_script("ingest-object-catalog")
+        from lib import forced_algos
+    except ImportError as e:
+        for stage in stages:
+            bench.skip(stage, "cannot import the algorithms: {}".format(e))
+        return
+
+    filters = lib.common.get_existing_filters(rerunDir)
+    encoded = []
+    for tract in lib.common.get_existing_tracts(rerunDir):
+        for patch in ingest.get_existing_patches(rerunDir, tract):
+            refPath = ingest.get_ref_path(rerunDir, tract, patch)
+            catPaths = dict(
+                (filter, ingest.get_catalog_path(rerunDir, tract, patch, filter, hsc=False, schemaName=schemaName))
+                for filter in filters
+            )
+
+            # cutout_subtable + construction of algos, excluding the file reading
+            for path, algoclasses in itertools.chain(
+                [(refPath, forced_algos.ref_algos)],
+                ((path, forced_algos.forced_algos) for path in catPaths.values()),
+            ):
+                table = SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+                nRows = len(table.fields["id"].data)
+                with bench.time("object.algos", nRows=nRows):
+                    table.cutout_subtable("id")
+                    for algoclass in algoclasses.values():
+                        algoclass(table)
+
+            # reading + algos through the compiled ingest plan
+            # (compare with object.fits_open + object.from_hdu + object.algos)
+            with bench.time("object.plan") as record:
+                universals, object_id, coord, dm_schema = ingest.get_ref_tables(refPath)
+                catalogs = dict(
+                    (filter, ingest.get_catalog_tables(catPath, object_id))
+                    for filter, catPath in catPaths.items()
+                )
+            nRows = len(object_id)
+            record.rows += nRows * (1 + len(catPaths))
+
+            with bench.time("object.transform", nRows=nRows):
+                for table in universals.values():
+                    table.transform(rerunDir, tract, patch, "", coord)
+
+            multibands = {}
+            for filter, dbtables in catalogs.items():
+                for table in dbtables.values():
+                    with bench.time("object.transform", nRows=nRows):
+                        table.transform(rerunDir, tract, patch, filter, coord)
+                    multibands.setdefault(table.name, []).append((table, filter))
+
+            for tables in itertools.chain(([(t, "")] for t in universals.values()), multibands.values()):
+                fieldNames, format, columns = _field_data(tables, object_id)
+                tsv = _encode(bench, "object", format, columns, nRows)
+                encoded.append((tables[0][0].name, fieldNames, tsv, nRows))
+
+    if db is None:
+        bench.skip("object.copy_from", dbError)
+        bench.skip("object.index", dbError)
+        return
+
+    try:
+        with db.cursor() as cursor:
+            ingest.create_mastertable(cursor, rerunDir, schemaName, None, filters, None)
+        db.commit()
+    except psycopg2.Error as e:
+        db.rollback()
+        reason = "cannot create tables (run preparation.sql?): {}".format(str(e).strip().splitlines()[0])
+        bench.skip("object.copy_from", reason)
+        bench.skip("object.index", reason)
+        return
+
+    with db.cursor() as cursor:
+        for name, fieldNames, tsv, nRows in encoded:
+            with bench.time("object.copy_from", nRows=nRows, nBytes=len(tsv)):
+                cursor.copy_from(io.BytesIO(tsv), '"{}"."{}"'.format(schemaName, name),
+                                 sep='\t', size=-1, columns=fieldNames)
+    db.commit()
+
+    nRows = sum(n for name, _, _, n in encoded if name == "position")
+    with bench.time("object.index", nRows=nRows):
+        ingest.create_index_on_mastertable(rerunDir, schemaName, filters)
+
+
+def bench_index_strategies(bench, rerunDir, db, dbError, schemaName, strategies, nRepeat=20):
+    """
+    Compare --index-strategy of ingest-object-catalog.py on the tables
+    loaded by bench_object(): the time to build the indexes, their size,
+    and the latency of tract, patch and field (range of tracts) searches.
+    Stages are "index.STRATEGY.build", "index.STRATEGY.size" (whose
+    "bytes" is the total size of the indexes), and "index.STRATEGY.QUERY".
+    @param strategies
+        List of strategies ("btree", "brin", "both")
+    @param nRepeat
+        Number of times each query is executed
+    """
+    if db is None:
+        for strategy in strategies:
+            bench.skip("index.{}.build".format(strategy), dbError)
+        return
+
+    try:
+        ingest = lib.benchmark.load_script("ingest-object-catalog")
+    except ImportError as e:
+        for strategy in strategies:
+            bench.skip("index.{}.build".format(strategy), "cannot import the algorithms: {}".format(e))
+        return
+
+    filters = lib.common.get_existing_filters(rerunDir)
+    with db.cursor() as cursor:
+        try:
+            cursor.execute('SELECT object_id FROM "{}"."position" ORDER BY object_id LIMIT 1'.format(schemaName))
+            row = cursor.fetchone()
+        except psycopg2.Error as e:
+            db.rollback()
+            row = None
+    if row is None:
+        for strategy in strategies:
+            bench.skip("index.{}.build".format(strategy), "no object tables (see object.copy_from)")
+        return
+
+    objectId = row[0]
+    tract = objectId >> 42
+    queries = [
+        ("tract_query", "tractSearch(object_id, {})".format(tract)),
+        ("patch_query", "public.skymap_from_object_id(object_id) = public.skymap_from_object_id({})".format(objectId)),
+        ("field_query", "tractSearch(object_id, {}, {})".format(tract, tract + 1)),
+    ]
+
+    strategy0 = lib.config.indexStrategy
+    try:
+        for strategy in strategies:
+            ingest.drop_index_from_mastertable(rerunDir, schemaName, filters)
+            lib.config.indexStrategy = strategy
+            with bench.time("index.{}.build".format(strategy)):
+                ingest.create_index_on_mastertable(rerunDir, schemaName, filters)
+
+            with db.cursor() as cursor:
+                cursor.execute("""
+                SELECT count(*), sum(pg_relation_size(indexrelid))
+                FROM pg_index JOIN pg_class ON pg_class.oid = indrelid
+                    JOIN pg_namespace ON pg_namespace.oid = relnamespace
+                WHERE nspname = %s
+                """, (schemaName,)
+                )
+                nIndexes, size = cursor.fetchone()
+                record = bench.stage("index.{}.size".format(strategy))
+                record.rows  += nIndexes
+                record.bytes += int(size or 0)
+                record.calls += 1
+
+                cursor.execute('ANALYZE "{}"."position"'.format(schemaName))
+                for name, where in queries:
+                    for i in range(nRepeat):
+                        with bench.time("index.{}.{}".format(strategy, name)) as record:
+                            cursor.execute('SELECT count(*) FROM "{}"."position" WHERE {}'.format(schemaName, where))
+                            record.rows += cursor.fetchone()[0]
+            db.commit()
+    except psycopg2.Error as e:
+        db.rollback()
+        bench.skip("index.{}.build".format(lib.config.indexStrategy), str(e).strip().splitlines()[0])
+    finally:
+        lib.config.indexStrategy = strategy0
+
+
+def bench_wcs(bench, nPoints):
+    """
+    Time Wcs.pixeltosky and the conversions by WcsJacobian
+    @param bench
+        lib.benchmark.Benchmark
+    @param nPoints
+        Number of points to convert
+    """
+    ra0, dec0 = lib.synthetic.patch_center(4850, 3, 3)
+    scale = 0.2 / 3600.0
+    wcs = Wcs({
+        "CRPIX1A": 0.0, "CRPIX2A": 0.0, "CRVAL1A": 0.0, "CRVAL2A": 0.0,
+        "CRPIX1": 2000.0, "CRPIX2": 2000.0, "CRVAL1": ra0, "CRVAL2": dec0,
+        "CD1_1": -scale, "CD1_2": 0.0, "CD2_1": 0.0, "CD2_2": scale,
+    })
+
+    rng = numpy.random.default_rng(0)
+    x = rng.uniform(0, 4000, size=nPoints)
+    y = rng.uniform(0, 4000, size=nPoints)
+    a = rng.uniform(1, 10, size=nPoints)
+    b = rng.uniform(1, 10, size=nPoints)
+    c = rng.uniform(-1, 1, size=nPoints)
+
+    with bench.time("wcs.pixeltosky", nRows=nPoints):
+        ra, dec = wcs.pixeltosky(x, y)
+    with bench.time("wcs.jacobian", nRows=nPoints):
+        jacobian = wcs.pixeltosky_get_jacobian(ra, dec)
+    with bench.time("wcs.err", nRows=nPoints):
+        jacobian.pixeltosky_err(a, c, b)
+    with bench.time("wcs.shape", nRows=nPoints):
+        jacobian.pixeltosky_shape(a, b, c)
+    with bench.time("wcs.shape_err", nRows=nPoints):
+        jacobian.pixeltosky_shape_err(a, c, b, c, c, a)
+    with bench.time("wcs.ecc", nRows=nPoints):
+        jacobian.pixeltosky_ecc(c * 0.5, c * 0.3)
+
+    single0 = lib.config.wcsSinglePrecision
+    try:
+        lib.config.wcsSinglePrecision = True
+        jacobian = wcs.pixeltosky_get_jacobian(ra, dec)
+        with bench.time("wcs.shape_err_single", nRows=nPoints):
+            jacobian.pixeltosky_shape_err(a, c, b, c, c, a)
+    finally:
+        lib.config.wcsSinglePrecision = single0
+
+
+def _field_data(tables, object_id=None):
+    """
+    Assemble field names, a row format and columns
+    in the way the ingest scripts do before COPY.
+    @param tables
+        List of (table: DBTable or DbImage, filter: str)
+    @param object_id
+        If not None, prepended as the "object_id" column
+    @return (fieldNames, format: bytes, columns)
+    """
+    if object_id is not None:
+        columns = [object_id]
+        fieldNames = ["object_id"]
+        fmts = ["%ld"]
+    else:
+        columns = []
+        fieldNames = []
+        fmts = []
+
+    for table, filter in tables:
+        for name, fmt, cols in table.get_backend_field_data(filter):
+            columns.extend(cols)
+            fieldNames.append(name)
+            fmts.append(fmt)
+
+    format = ("\t".join(fmts) + "\n").encode("utf-8")
+    return fieldNames, format, columns
+
+
+def _encode(bench, prefix, format, columns, nRows):
+    """
+    Time TSV encoding, in memory and (if MULTICORE) through pipe_printf.
+    @return encoded bytes
+    """
+    with bench.time(prefix + ".encode_tsv", nRows=nRows):
+        tsv = b''.join(format % tpl for tpl in zip(*columns))
+    bench.add_bytes(prefix + ".encode_tsv", len(tsv))
+
+    if lib.config.MULTICORE:
+        with bench.time(prefix + ".encode_pipe", nRows=nRows, nBytes=len(tsv)):
+            fin = pipe_printf.open(format, *columns)
+            with fin:
+                while fin.read(1 << 20):
+                    pass
+
+    return tsv
+
+
+if __name__ == "__main__":
+    main()
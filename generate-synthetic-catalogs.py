@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Write synthetic DC2-shaped catalogs for load testing:
+    {outDir}/rerun   object catalog (ref-*.fits, forced-*.fits);
+                     give it to ingest-object-catalog.py as rerunDir
+    {outDir}/forced  forced-source catalog;
+                     give it to ingest-forcedsource.py as forceddir
+"""
+
+import os
+import sys
+
+import lib.synthetic
+
+
+def main():
+    import argparse
+    cmdline = ' '.join(sys.argv)
+    print('Invocation: ' + cmdline)
+
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Write synthetic object and forced-source catalogs.')
+
+    parser.add_argument('outDir',
+                        help="Directory in which to write rerun/ and forced/")
+    parser.add_argument('--tracts', type=int, nargs='+', default=[4850],
+                        help="Tract numbers to generate")
+    parser.add_argument('--patches', type=int, default=7,
+                        help="Patches per side of a tract")
+    parser.add_argument('--objects', type=int, default=1000,
+                        help="Objects per patch")
+    parser.add_argument('--filters', nargs='+', default=lib.synthetic.FILTERS,
+                        help="Filters of the forced catalogs")
+    parser.add_argument('--visits', type=int, default=0,
+                        help="Number of visits of forced sources to generate")
+    parser.add_argument('--first-visit', type=int, default=159479,
+                        help="Visit number of the first visit")
+    parser.add_argument('--rafts', type=int, default=len(lib.synthetic.RAFTS),
+                        help="Rafts per visit (max 21)")
+    parser.add_argument('--sources', type=int, default=500,
+                        help="Forced sources per (non-empty) sensor")
+    parser.add_argument('--empty-fraction', type=float, default=0.1,
+                        help="Fraction of sensor files with no rows")
+    parser.add_argument('--no-object', action='store_true',
+                        help="Do not generate the object catalog")
+    parser.add_argument('--afw-table-version', type=int, default=3,
+                        help="Value of AFW_TABLE_VERSION in the headers")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Random seed")
+    args = parser.parse_args()
+
+    if not args.no_object:
+        rerunDir = os.path.join(args.outDir, "rerun")
+        patches = lib.synthetic.generate_object_catalog(
+            rerunDir, args.tracts, nPatch=args.patches, filters=args.filters,
+            nObjects=args.objects, seed=args.seed,
+            afwTableVersion=args.afw_table_version)
+        print("Wrote {} patches x {} filters to {}".format(
+            len(patches), len(args.filters), rerunDir))
+
+    if args.visits > 0:
+        forcedDir = os.path.join(args.outDir, "forced")
+        visits = list(range(args.first_visit, args.first_visit + args.visits))
+        paths = lib.synthetic.generate_forcedsource(
+            forcedDir, visits, args.tracts, nPatch=args.patches,
+            nObjects=args.objects, nRafts=args.rafts, nSources=args.sources,
+            emptyFraction=args.empty_fraction, filters=args.filters,
+            seed=args.seed, afwTableVersion=args.afw_table_version)
+        print("Wrote {} sensor files to {}".format(len(paths), forcedDir))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,9 +22,13 @@ import numpy
 import psycopg2
 import sys
 
+import lib.benchmark
 import lib.fits
+import lib.memory_budget
 import lib.misc
+import lib.dbimage
 import lib.dbtable
+import lib.index_builder
 import lib.sourcetable
 import lib.common
 import lib.config
@@ -40,8 +44,11 @@ import glob
 import io
 import itertools
 import os
+import queue
 import re
 import textwrap
+import threading
+import time
 
 def main():
     import argparse
@@ -64,7 +71,14 @@ def main():
                         action="append", 
                         help="DB connect parms. Must come after reqd args.")
     parser.add_argument('--create-keys',  action='store_true',
-       help="Create index, foreign keys (only; don't insert data)")
+       help="""Create index, foreign keys (only; don't insert data).
+       With --jobs, keys of partitions are created concurrently""")
+
+    parser.add_argument('--cluster', action='store_true',
+       help="""Rewrite the tables (each partition) in the order of their
+       primary keys (objectId, ccdVisitId), in --jobs sessions at a time,
+       so that light curves are stored together. Requires the keys
+       (--create-keys). Don't insert data""")
 
     parser.add_argument('--dry-run', dest='dryrun', action='store_true',
                         help="Do not write to db. Ignored for create-index", 
@@ -75,8 +89,51 @@ def main():
     parser.add_argument('--visits', dest='visits', type=int, nargs='+', 
                         help="Ingest data for specified visits only if present. Else ingest all")
     parser.add_argument('--assumptions', default='forced_source_assumptions.yaml', help="Path to description of prior assumptions about data schema")
+    parser.add_argument('--catch-up', action='store_true',
+                        help="""Find all visits (or those of --visits), compare
+                        their files with the bookkeeping in the db, and ingest
+                        only the files not yet inserted. With --dry-run,
+                        list those files""")
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help="""Number of units of work (see --unit) to
+                        ingest concurrently, each worker with its own DB
+                        session. Not used with --dry-run or --benchmark""")
+    parser.add_argument('--unit', choices=["visit", "raft"], default="visit",
+                        help="""Unit of work of --jobs, committed as a
+                        whole. Default: visit""")
+    parser.add_argument('--ordered', action='store_true',
+                        help="""With --jobs, insert the units in the order of
+                        (visit, raft, sensor) so that the physical order
+                        of rows does not depend on timing. Units are still
+                        read in parallel""")
+    parser.add_argument('--finder-index', metavar='PATH',
+                        help="""Keep an index of the forced-source directory
+                        tree in this file. Later runs rescan only the
+                        directories modified since""")
+    parser.add_argument('--staging', type=int, default=0, metavar='N',
+                        help="""COPY into a private unlogged staging table
+                        per worker, and every N units move the rows into
+                        the target table with one INSERT ... SELECT sorted
+                        by the primary key. Default: COPY into the target""")
+    parser.add_argument('--memory-budget', metavar='SIZE',
+                        help="""Memory to be used (e.g. 64G). Files whose
+                        estimated footprint exceeds it are processed in row
+                        slices, and units run concurrently only while the
+                        sum of their estimates fits. The footprint is a
+                        static estimate from the FITS headers (4 times the
+                        table size), not measured memory. Default: unlimited""")
+    parser.add_argument('--benchmark', nargs='?', const=os.devnull,
+                        metavar='SINK',
+                        help="""Read, transform and encode all data as for
+                        insertion, but write the COPY data to file SINK
+                        (default: null device) instead of the db. Then report
+                        the throughput. Nothing is written to the db.""")
+    parser.add_argument('--benchmark-results', metavar='PATH',
+                        help="Append --benchmark results to this JSON-lines file")
 
     args = parser.parse_args()
+    if args.staging and args.ordered:
+        parser.error("--staging cannot be used with --ordered")
 
     if args.visits is not None:
         print("Processing the following visits:")
@@ -87,12 +144,35 @@ def main():
 
     lib.config.tableSpace = ""
     lib.config.indexSpace = ""
+    if args.memory_budget:
+        lib.config.memoryBudget = lib.memory_budget.parse_size(args.memory_budget)
 
     assumptions = Assumptions(args.assumptions)
-    finder = ForcedSourceFinder(args.forceddir)
+    finder = ForcedSourceFinder(args.forceddir, index_path=args.finder_index)
+
+    if args.benchmark:
+        visits = args.visits if args.visits is not None else finder.get_visits()
+        bench = lib.benchmark.Benchmark(label="ingest-forcedsource")
+        sink = lib.benchmark.SinkConnection(args.benchmark, bench)
+        with bench.time("total"):
+            for v in visits:
+                insert_visit(args.schemaname, finder, assumptions, v, False,
+                             sink=sink)
+        sink.close()
+        bench.stage("total").rows  = bench.stage("sink").rows
+        bench.stage("total").bytes = bench.stage("sink").bytes
+        bench.report()
+        if args.benchmark_results:
+            bench.save(args.benchmark_results)
+        return
 
-    if (args.create_keys):
-        create_keys(args.schemaname, finder, assumptions, args.dryrun)
+    if (args.create_keys or args.cluster):
+        if args.create_keys:
+            create_keys(args.schemaname, finder, assumptions, args.dryrun,
+                        args.jobs)
+        if args.cluster:
+            cluster_tables(args.schemaname, finder, assumptions, args.dryrun,
+                           args.jobs)
         exit(0)
     
     something = create_table(args.schemaname, finder, assumptions, 
@@ -101,12 +181,43 @@ def main():
 
     if args.no_insert: return
 
-    for v in args.visits:
+    visits = args.visits if args.visits is not None else finder.get_visits()
+    if args.catch_up:
+        files = get_missing_files(args.schemaname, finder, visits, args.dryrun)
+        if args.dryrun:
+            for v in sorted(files):
+                for vf in files[v]:
+                    print(vf)
+            return
+        create_partitions(args.schemaname, finder, assumptions,
+                          itertools.chain.from_iterable(files.values()))
+        insert_visits_parallel(args.schemaname, finder, assumptions,
+                               sorted(files), args.jobs, args.unit,
+                               args.ordered, files=files, stage=args.staging)
+        return
+
+    create_partitions(args.schemaname, finder, assumptions,
+                      itertools.chain.from_iterable(
+                          finder.get_visit_files(v) for v in visits),
+                      args.dryrun)
+
+    if (args.jobs > 1 or args.staging) and not args.dryrun:
+        insert_visits_parallel(args.schemaname, finder, assumptions, visits,
+                               args.jobs, args.unit, args.ordered,
+                               stage=args.staging)
+        return
+
+    for v in visits:
         insert_visit(args.schemaname, finder, assumptions, v, args.dryrun)
 
-def create_keys(schema, finder, assumptions, dryrun=True):
+def create_keys(schema, finder, assumptions, dryrun=True, nJobs=1):
     """
-    Creates foreign keys and primary keys as described in assumptions
+    Creates foreign keys and primary keys as described in assumptions.
+    Keys of a partitioned table are created on each partition.
+    The indexes of the primary keys of the tables (partitions) are built
+    concurrently in nJobs sessions, largest first. The foreign keys are
+    then added NOT VALID and validated concurrently, one job per
+    table and key. Each job is printed with its duration as it finishes.
 
     Parameters
     ----------
@@ -118,25 +229,114 @@ def create_keys(schema, finder, assumptions, dryrun=True):
       includes db constraint definitions among other things
     dryrun :  boolean
       determines whether we just write out SQL or execute it
+    nJobs : int
+      number of concurrent DB sessions
     """
     dbimages = _get_dbimages(schema, finder, assumptions)
 
 
     if (dryrun):
         # print the list
-        for key,d in dbimages.items():
-            d.create_foreign(None)
-            d.create_primary(None)
+        for d, table in _get_dryrun_tables(finder, dbimages):
+            for statement in d.get_primary_index_statements(table):
+                print(statement)
+            for statement in d.get_foreign_statements(table, valid=False):
+                print(statement)
+            for name, statement in d.get_validate_statements(table):
+                print(statement)
         return True
-    else:
-        db = lib.common.new_db_connection()
-        with db.cursor() as cursor:
-            for key,d in dbimages.items():
-                d.create_foreign(cursor)
-                d.create_primary(cursor)
-        db.commit()
+
+    tables = _get_physical_tables(schema, dbimages)
+
+    # One job per table: the unique index of the primary key, and then
+    # quick statements: the primary key using it, and the foreign keys
+    # created NOT VALID (without checking rows)
+    print("Primary keys:")
+    jobs = []
+    for d, table in tables:
+        statements = (d.get_primary_index_statements(table)
+                      + d.get_foreign_statements(table, valid=False))
+        if statements:
+            jobs.append(('"{}"."{}"'.format(schema, table), table, statements))
+    lib.index_builder.build_indexes(jobs, nJobs)
+
+    # The checks of rows, concurrently
+    print("Validation of foreign keys:")
+    jobs = [('"{}"."{}"'.format(schema, table), name, [statement])
+            for d, table in tables
+            for name, statement in d.get_validate_statements(table)]
+    lib.index_builder.build_indexes(jobs, nJobs)
+    return True
+
+def cluster_tables(schema, finder, assumptions, dryrun=True, nJobs=1):
+    """
+    Rewrite the tables (each partition of partitioned tables) in the
+    order of their primary keys with CLUSTER, concurrently in nJobs
+    sessions, largest first. Rows of an object are then stored together.
+    A table is locked while it is rewritten.
+
+    Parameters
+    ----------
+    schema : str
+      schema name
+    finder : Finder object
+      used to find the data to which assumptions are applied
+    assumptions : Assumptions object
+      includes db constraint definitions among other things
+    dryrun :  boolean
+      determines whether we just write out SQL or execute it
+    nJobs : int
+      number of concurrent DB sessions
+    """
+    dbimages = _get_dbimages(schema, finder, assumptions)
+
+    if dryrun:
+        for d, table in _get_dryrun_tables(finder, dbimages):
+            for statement in d.get_cluster_statements(table):
+                print(statement)
+        return True
+
+    jobs = []
+    for d, table in _get_physical_tables(schema, dbimages):
+        statements = d.get_cluster_statements(table)
+        if statements:
+            # CLUSTER and then ANALYZE, both in the concurrent session
+            jobs.append(('"{}"."{}"'.format(schema, table), table, [statements]))
+    lib.index_builder.build_indexes(jobs, nJobs)
     return True
 
+def _get_physical_tables(schema, dbimages):
+    """
+    @return list of (DbImage, name of a table holding its rows): the table
+            itself, or each of its partitions if it is partitioned
+    """
+    db = lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        tables = []
+        for key,d in dbimages.items():
+            if d.partition:
+                tables.extend((d, p) for p in lib.dbimage.get_partitions(cursor, schema, d.name))
+            else:
+                tables.append((d, d.name))
+    db.close()
+    return tables
+
+def _get_dryrun_tables(finder, dbimages):
+    """
+    @return list of (DbImage, name of a table holding its rows) to show
+            in dry runs: the table itself, or the partition into which
+            the first input file goes if it is partitioned
+    """
+    tables = []
+    for key,d in dbimages.items():
+        if d.partition:
+            path, determiners = finder.get_some_file()
+            suffix, bound = lib.dbimage.get_partition_bound(d.partition, determiners)
+            tables.append((d, "{}_{}".format(d.name, suffix)))
+        else:
+            tables.append((d, d.name))
+    return tables
+
 def drop_keys(schema, finder, assumptions, dryrun=True):
     """
     Drop foreign keys and primary keys as described in assumptions
@@ -294,7 +494,7 @@ def create_view(cursor, schema, dm_schema=3):
         print(vs)
 
 
-def insert_visit(schema, finder, assumptions, visit, dryrun=True):
+def insert_visit(schema, finder, assumptions, visit, dryrun=True, sink=None):
     """
     @param  schema       (Postgres) schema name
     @param  finder       Instance of class which knows how to find schema 
@@ -304,153 +504,596 @@ def insert_visit(schema, finder, assumptions, visit, dryrun=True):
     @param  visit        integer visit number
     @param  dryrun       If true only print out sql.  If false, insert
                          data for the visit 
+    @param  sink         If not None, lib.benchmark.SinkConnection to be
+                         used instead of a db connection
     """
 
     # Find all data files belonging to the visit.   Many may be of
     # the minimum size which indicates they have no data.  Make a
     # list of the rest.
-    visit_files = finder.get_visit_files(visit) 
+    visit_files = sorted(finder.get_visit_files(visit))
 
-    use_cursor = None
-    db = lib.common.new_db_connection()
+    if dryrun:
+        # Print a piece of the data of the first few files
+        for vf in visit_files[:3]:
+            determiners = finder.get_determiner_dict(vf)
+            remaining_tables = read_bit(vf, schema, assumptions,
+                                        **determiners)
+            print("Bit raft={raft}, sensor={sensor}, visit={visit}".format(**determiners))
+            for name in remaining_tables:
+                print_bit(schema, remaining_tables[name])
+        return
+
+    db = sink if sink is not None else lib.common.new_db_connection()
     with db.cursor() as cursor:
-        if not dryrun:
-            use_cursor = cursor
+        # All files of the visit go to the db in one COPY per table
+        insert_files(cursor, schema, finder, assumptions, visit_files)
+        db.commit()
 
-        print('using cursor ', str(use_cursor))
-        ifile = 0             #   DEBUG
-        for vf in visit_files:
-            ifile += 1           # DEBUG
-            if dryrun and  ifile > 3: return
-            determiners = finder.get_determiner_dict(vf)
+def insert_visits_parallel(schema, finder, assumptions, visits, nJobs,
+                           unit="visit", ordered=False, files=None, stage=0):
+    """
+    Insert data for visits with several workers, each with its own
+    DB connection. Each unit of work (a visit, or the sensors of a raft
+    in a visit) is committed as a whole together with its bookkeeping
+    in "_temp:forced_bit", so an interrupted ingest can be resumed
+    by running it again.
 
-            # Call routine which looks in temp table (creating if need be)
-            # to see if this bit of data has already been processed
-            # Includes cursor argument.  If it is None, routine is no-op
+    @param  schema       (Postgres) schema name
+    @param  finder       Instance of class which knows how to find the data
+    @param  assumptions  Instance of class describing columns to be
+                         included and excluded, among other things
+    @param  visits       List of visit numbers
+    @param  nJobs        Number of workers
+    @param  unit         "visit" or "raft"
+    @param  ordered      If True, units are inserted in the order of
+                         get_units() (they are still read concurrently).
+                         Each unit is then read whole before insertion.
+    @param  files        If not None, dict mapping visit -> [file paths]
+                         to be inserted instead of all files of the visits
+    @param  stage        If nonzero, each worker COPYs into its own staging
+                         tables (see create_staging_tables()) and moves
+                         the rows into the target tables, committing them,
+                         every "stage" units and at the end.
+    """
+    units = get_units(finder, visits, unit, files)
+    nJobs = max(1, min(nJobs, len(units)))
 
-            # Go through essentially same 
-            # procedure as for create_table to determine what columns we're 
-            # looking for and store the column data
-            #
-            hdus = lib.fits.fits_open(vf)  
+    db = lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        create_bit_table(cursor, schema)
+    db.commit()
+    db.close()
+
+    todo = queue.Queue()
+    for i, (label, files) in enumerate(units):
+        todo.put((i, label, files))
+
+    budget = lib.memory_budget.MemoryBudget(lib.config.memoryBudget)
+    # With "ordered", units are also admitted to the memory budget in order,
+    # lest a unit waiting for its turn hold memory that an earlier unit needs
+    turn = {"insert": 0, "admit": 0}
+    condition = threading.Condition()
+    errors = []
+
+    def wait_turn(i, key="insert"):
+        with condition:
+            while turn[key] != i:
+                condition.wait()
+
+    def end_turn(i, key="insert"):
+        wait_turn(i, key)
+        with condition:
+            turn[key] = i + 1
+            condition.notify_all()
+
+    tableNames = assumptions.get_tables()
+    copySchema = "pg_temp" if stage else schema
+
+    def process(cursor, i, files):
+        insert_files(cursor, schema, finder, assumptions, files,
+                     wait=(lambda: wait_turn(i)) if ordered else None,
+                     copy_schema=copySchema)
+
+    def flush(db, cursor, pending):
+        # Move the staged units into the target tables.
+        # Return False if the session is no longer usable.
+        start = time.perf_counter()
+        try:
+            move_staged_rows(cursor, schema, assumptions, tableNames)
+            db.commit()
+        except Exception as e:
+            errors.extend((label, str(e).strip()) for label in pending)
+            del pending[:]
+            try:
+                db.rollback()
+            except Exception:
+                return False
+        else:
+            print("moved {} units {:10.1f} sec".format(
+                len(pending), time.perf_counter() - start), flush=True)
+            del pending[:]
+        return True
 
-            #Read fields into a SourceTable
-            raw_table = lib.sourcetable.SourceTable.from_hdu(hdus[1])
+    def worker():
+        db = lib.common.new_db_connection()
+        # Labels of units staged but not yet moved
+        pending = []
+        try:
+            with db.cursor() as cursor:
+                if stage:
+                    create_staging_tables(cursor, schema, tableNames)
+                    db.commit()
+                while True:
+                    try:
+                        i, label, files = todo.get_nowait()
+                    except queue.Empty:
+                        break
+                    start = time.perf_counter()
+                    admitted = False
+                    try:
+                        if stage:
+                            cursor.execute("SAVEPOINT unit")
+                        # Reading the headers may fail, which must not
+                        # skip the end of the turns below
+                        footprint = lib.memory_budget.estimate_footprint(files)[0] if budget.total else 0
+                        if ordered:
+                            wait_turn(i, "admit")
+                        with budget.reserve(footprint):
+                            if ordered:
+                                end_turn(i, "admit")
+                                admitted = True
+                            process(cursor, i, files)
+                        if stage:
+                            cursor.execute("RELEASE SAVEPOINT unit")
+                        else:
+                            db.commit()
+                    except Exception as e:
+                        errors.append((label, str(e).strip()))
+                        try:
+                            if stage:
+                                cursor.execute("ROLLBACK TO SAVEPOINT unit")
+                            else:
+                                db.rollback()
+                        except Exception as e:
+                            # The session (with the units staged in it)
+                            # is lost. Other workers go on with the rest.
+                            errors.extend(
+                                (pendingLabel, "lost with the session: " + str(e).strip())
+                                for pendingLabel in pending)
+                            del pending[:]
+                            break
+                        continue
+                    finally:
+                        if ordered:
+                            if not admitted:
+                                end_turn(i, "admit")
+                            end_turn(i)
+                    print("unit {:24} {:4} files {:10.1f} sec".format(
+                        label, len(files), time.perf_counter() - start), flush=True)
+                    if stage:
+                        pending.append(label)
+                        if len(pending) >= stage and not flush(db, cursor, pending):
+                            break
+                if pending:
+                    flush(db, cursor, pending)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=worker) for i in range(nJobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Units left over if all workers have stopped on errors
+    while not todo.empty():
+        i, label, files = todo.get_nowait()
+        errors.append((label, "not processed"))
+
+    if budget.total:
+        print("peak resident memory {:.0f} MB (--memory-budget {:.0f} MB)".format(
+            budget.peak / 2**20, budget.total / 2**20), flush=True)
+
+    if errors:
+        raise RuntimeError("Failed to insert units (run again to resume):\n" + "\n".join(
+            "{}: {}".format(label, error) for label, error in errors))
+
+def get_units(finder, visits, unit="visit", visit_files=None):
+    """
+    Divide the data into units of work.
+    @param  finder  Instance of class which knows how to find the data
+    @param  visits  List of visit numbers
+    @param  unit    "visit" or "raft"
+    @param  visit_files  If not None, dict mapping visit -> [file paths]
+                    to be used instead of all files of the visits
+    @return List of (label, [file paths]) sorted by visit, raft and sensor
+    """
+    units = []
+    for visit in sorted(visits):
+        if visit_files is not None:
+            files = sorted(visit_files.get(visit, []))
+        else:
+            files = sorted(finder.get_visit_files(visit))
+        if not files:
+            continue
+        if unit == "raft":
+            for raftDir, group in itertools.groupby(files, key=os.path.dirname):
+                units.append(("{} {}".format(visit, os.path.basename(raftDir)),
+                              list(group)))
+        else:
+            units.append((str(visit), files))
+    return units
 
-            #  Assumptions class applies 'ignores' to cut it down to what we need
-            #  Maybe also subdivide into multiple tables if so described in yaml
-            remaining_tables = assumptions.apply(raw_table, schema, 
-                                                 **determiners)
+def insert_files(use_cursor, schema, finder, assumptions, files, wait=None,
+                 copy_schema=None):
+    """
+    Insert the data of input files that are not yet registered in
+    "_temp:forced_bit", and register them, within the caller's transaction.
+    The files are read in batches (all files, or as many as fit
+    in --memory-budget) and each batch is sent in one COPY per table.
+    The bookkeeping rows are inserted with one INSERT.
 
+    @param  use_cursor   db cursor
+    @param  schema       (Postgres) schema name
+    @param  finder       Instance of class which knows how to find the data
+    @param  assumptions  Instance of class describing columns to be
+                         included and excluded, among other things
+    @param  files        List of paths to input files
+    @param  wait         If not None, function called before the first COPY.
+                         All batches are then read before it is called.
+    @param  copy_schema  Schema of the tables into which to COPY
+                         (e.g. "pg_temp" for staging tables). Default: schema
+    @return Number of files inserted
+    """
+    create_bit_table(use_cursor, schema)
+
+    determiners = dict((vf, finder.get_determiner_dict(vf)) for vf in files)
+    inserted = get_inserted_bits(use_cursor, schema,
+                                 set(d["visit"] for d in determiners.values()))
+    files = [vf for vf in files if get_bit_key(**determiners[vf]) not in inserted]
+    if not files:
+        return 0
+
+    def read(batch):
+        # Map table name -> [DbImage] in the order of files
+        tables = {}
+        for vf, rowRange in batch:
+            remaining_tables = read_bit(vf, schema, assumptions, rowRange,
+                                        **determiners[vf])
             for name in remaining_tables:
-                remaining_tables[name].transform()
-                insert_bit(use_cursor, schema, remaining_tables[name],
-                           **determiners)
-
-            #
-            # The guts of of the insert for object catalog is in 
-            # insert_patch_into_multibandtable.   It
-            #    * assembles a list of column names (called `fieldNames`) an 
-            #      arrays of column data (called `columns`) and generates format
-            #      string (called `format`).   This information all comes from
-            #      the dbtable, plus insertion of tab character between fields
-            #    * If multicore, use pipe_printf.   Write to a pipe, using zip
-            #      to output column-oriented inputs as rows:
-            #           for tpl in zip(*columns):
-            #               fout.write(format % tpl)
-            #       and meanwhile start copying from the pipe to db use copy_from
-            #    * otherwise write the whole thing to an in-memory byte stream,
-            #      then use copy_from on that.
-
-            #   transform
-
-            #   insert
-
-        # End for-loop over files in visit
-        if not dryrun:
-            db.commit()
+                tables.setdefault(name, []).append(remaining_tables[name])
+        return tables
+
+    batches = get_batches(files)
+    if wait is not None:
+        batches = [read(batch) for batch in batches]
+        wait()
+    else:
+        batches = (read(batch) for batch in batches)
+
+    if copy_schema is None: copy_schema = schema
+    for tables in batches:
+        for name, dbimages in tables.items():
+            insert_bits(use_cursor, copy_schema, dbimages)
+
+    register_bits(use_cursor, schema, [determiners[vf] for vf in files])
+    return len(files)
 
-def insert_bit(use_cursor, schema_name, dbimage, **determiners):
+def get_batches(files):
     """
-    Insert data corresponding to one input file into Postgres
-    
-    @param   use_cursor   db cursor or None (for dryrun)
-    @param   schema_name
-    @dbimage DbImage instance
+    Group input files into batches to be sent in one COPY each.
+    Without --memory-budget, all files make one batch. Otherwise
+    consecutive files are grouped as long as their estimated footprint
+    fits in the budget; a file exceeding it alone is split in row slices,
+    one batch each.
+
+    @param  files  List of paths to input files
+    @return List of batches, each a list of (path, rowRange)
+    """
+    budget = lib.config.memoryBudget
+    if not budget:
+        return [[(vf, None) for vf in files]]
+
+    batches = []
+    batch = []
+    used = 0
+    for vf in files:
+        footprint, nRows = lib.memory_budget.estimate_footprint([vf])
+        if footprint > budget:
+            batches.extend([(vf, rowRange)] for rowRange in lib.memory_budget.get_row_ranges([vf]))
+            continue
+        if batch and used + footprint > budget:
+            batches.append(batch)
+            batch = []
+            used = 0
+        batch.append((vf, None))
+        used += footprint
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+def get_missing_files(schema, finder, visits, dryrun=False):
+    """
+    Compare the input files of visits with "_temp:forced_bit",
+    which is read in one query, and return the files not yet inserted.
+    Only those files are checked for emptiness, so that the cost of
+    a catch-up run mostly depends on the amount of new data.
+
+    @param  schema   (Postgres) schema name
+    @param  finder   Instance of class which knows how to find the data
+    @param  visits   List of visit numbers
+    @param  dryrun   If true, do not create "_temp:forced_bit"
+                     if it does not exist (all files are then missing)
+    @return dict mapping visit -> [file paths], for visits with missing files
+    """
+    db = lib.common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            if dryrun:
+                cursor.execute("""
+                SELECT to_regclass('"{schema}"."_temp:forced_bit"')
+                """.format(**locals())
+                )
+                exists = cursor.fetchone()[0] is not None
+            else:
+                create_bit_table(cursor, schema)
+                exists = True
+            inserted = get_inserted_bits(cursor, schema) if exists else set()
+        db.commit()
+    finally:
+        db.close()
+
+    missing = {}
+    nInserted = 0
+    for visit in sorted(visits):
+        files = []
+        for vf in finder.get_visit_files(visit, nonempty=False):
+            if get_bit_key(**finder.get_determiner_dict(vf)) in inserted:
+                nInserted += 1
+            elif not finder.is_empty(vf):
+                files.append(vf)
+        if files:
+            missing[visit] = files
+
+    print("{} files already inserted; {} files in {} visits to be inserted".format(
+        nInserted, sum(len(files) for files in missing.values()), len(missing)))
+    return missing
+
+def read_bit(vf, schema, assumptions, rowRange=None, **determiners):
+    """
+    Read one input file (or a row slice of it) and transform it
+    for insertion.
+
+    @param   vf           path to the input file
+    @param   schema       (Postgres) schema name
+    @param   assumptions  Instance of class describing columns to be
+                          included and excluded, among other things
+    @param   rowRange     (start, stop) to read only these rows; None to read all
     @determiners  Uniquely determines this part of the data
+    @return  dict mapping table name -> DbImage
     """
+    hdus = lib.fits.fits_open(vf, rowRange=rowRange)
 
-    columns = []
-    field_names = []
-    format = ""
-    # For convenience stuff schema_name into determiners
-    determiners['schema_name'] = schema_name
-    dryrun = (use_cursor is None)
-    if not dryrun:
-        # create table to keep track of ingest if it doesn't already exist
+    #Read fields into a SourceTable
+    raw_table = lib.sourcetable.SourceTable.from_hdu(hdus[1])
+
+    #  Assumptions class applies 'ignores' to cut it down to what we need
+    #  Maybe also subdivide into multiple tables if so described in yaml
+    remaining_tables = assumptions.apply(raw_table, schema, **determiners)
+
+    for name in remaining_tables:
+        remaining_tables[name].transform()
+
+    return remaining_tables
+
+def print_bit(schema_name, dbimage, nChars=600):
+    """
+    Print the first characters of the COPY data of one input file,
+    as insert_bits() would send it (for dryrun)
+
+    @param   schema_name
+    @param   dbimage      DbImage instance
+    @param   nChars       Number of characters to print
+    """
+    fout = io.BytesIO()
+    sink = lib.benchmark.SinkConnection(fout, lib.benchmark.Benchmark())
+    insert_bits(sink.cursor(), schema_name, [dbimage])
+
+    field_names = [name for name, fmt, cols in dbimage.get_backend_field_data("")]
+    print('Table: ', dbimage.name)
+    print('All fields: ', ' '.join(field_names))
+    print('Printing tsv[:{}]'.format(nChars))
+    print(fout.getvalue()[:nChars].decode("utf-8", errors="replace"))
+
+def insert_bits(use_cursor, schema_name, dbimages):
+    """
+    Insert data of several input files (or row slices) into one table
+    with a single COPY, the rows of one following those of the previous.
+    Each is printed with its own format, in which the values of constant
+    columns (see lib.sourcetable.Field_constant) are written literally.
+    Consecutive DbImages with different columns (which should not happen)
+    are sent in separate COPYs.
+
+    @param   use_cursor   db cursor
+    @param   schema_name
+    @param   dbimages     List of DbImage of the same table
+    """
+    bits = []
+    for dbimage in dbimages:
+        field_names = []
+        formats = []
+        columns = []
+        for name, fmt, cols in dbimage.get_backend_field_data(""):
+            field_names.append(name)
+            formats.append(fmt)
+            columns.extend(cols)
+        format = ("\t".join(formats) + "\n").encode("utf-8")
+        bits.append((tuple(field_names), (format, columns)))
+
+    table = '"{}"."{}"'.format(schema_name, dbimages[0].name)
+    for field_names, group in itertools.groupby(bits, key=lambda bit: bit[0]):
+        chunks = [chunk for key, chunk in group]
+
+        if lib.config.MULTICORE:
+            fin = pipe_printf.open_chunks(chunks)
+            use_cursor.copy_from(fin, table, sep='\t', columns=field_names)
+        else:
+            tsv = b''.join(format % tpl
+                           for format, columns in chunks
+                           for tpl in zip(*columns))
+            fin = io.BytesIO(tsv)
+            use_cursor.copy_from(fin, table, sep='\t', size=-1, columns=field_names)
+
+def create_bit_table(use_cursor, schema_name):
+    """
+    Create the table to keep track of ingest if it doesn't already exist.
+
+    @param   use_cursor   db cursor
+    @param   schema_name
+    """
+    use_cursor.execute("""
+    CREATE TABLE IF NOT EXISTS "{schema_name}"."_temp:forced_bit" (
+      visit   Bigint, 
+      raft int, 
+      sensor int, 
+      unique (visit, raft, sensor)
+    )
+    """.format(**locals())
+    )
+
+def create_staging_tables(use_cursor, schema_name, table_names):
+    """
+    Create staging tables for this session: temporary tables (which are
+    private and not WAL-logged) named as, and with the columns of, the
+    target tables. Their rows are deleted at every commit.
+
+    @param   use_cursor   db cursor
+    @param   schema_name  schema of the target tables
+    @param   table_names  names of the target tables
+    """
+    for name in table_names:
         use_cursor.execute("""
-        CREATE TABLE IF NOT EXISTS "{schema_name}"."_temp:forced_bit" (
-          visit   Bigint, 
-          raft int, 
-          sensor int, 
-          unique (visit, raft, sensor)
+        CREATE TEMP TABLE IF NOT EXISTS "{name}"
+        (LIKE "{schema_name}"."{name}")
+        ON COMMIT DELETE ROWS
+        """.format(**locals())
         )
+
+def move_staged_rows(use_cursor, schema_name, assumptions, table_names):
+    """
+    Move the rows of the staging tables into the target tables
+    with one INSERT ... SELECT each, sorted by the primary key
+    so that rows of an object are stored together.
+    The staging tables are emptied by the caller's commit.
+
+    @param   use_cursor   db cursor
+    @param   schema_name  schema of the target tables
+    @param   assumptions  Assumptions (to get primary keys)
+    @param   table_names  names of the target tables
+    """
+    for name in table_names:
+        pkey = assumptions.get_primary_key(name)
+        order = "ORDER BY " + ", ".join(pkey) if pkey else ""
+        use_cursor.execute("""
+        INSERT INTO "{schema_name}"."{name}"
+        SELECT * FROM pg_temp."{name}"
+        {order}
         """.format(**locals())
         )
 
-        # check if our entry is already there
-        select_q = """
-        SELECT visit FROM "{schema_name}"."_temp:forced_bit" WHERE
-        visit={visit} and raft={raft} and sensor={sensor}
-        """.format(**determiners)
-        use_cursor.execute(select_q)
-        if use_cursor.fetchone() is not None:  # bit is already there
-            return
-        
-    first = True
-    for name, fmt, cols in dbimage.get_backend_field_data(""):
-        columns.extend(cols)
-        field_names.append(name)
-        if first:
-            format = fmt
-            first = False
-        else:
-            format += "\t" + fmt
-
-    if dryrun:    # print a piece of the data and exit
-        print("Bit raft={raft}, sensor={sensor}, visit={visit}".format(**determiners))
-        #print("field names: ")
-        all_fields = ' '.join(field_names)
-        print('All fields: ', all_fields)
-
-        print('Format is: \n', format)
-        tsv = ''.join(format % tpl for tpl in zip(*columns))
-        print('Printing tsv[:600]')
-        print(tsv[:600])
-        
-        return
+def get_bit_key(visit, raft, sensor):
+    """
+    @return (visit, raft, sensor) as integers, as in "_temp:forced_bit"
+    """
+    return int(visit), int(raft), int(sensor)
 
-    format += "\n"
-    format = format.encode("utf-8")
+def get_inserted_bits(use_cursor, schema_name, visits=None):
+    """
+    Get the input files already inserted, in one query.
 
-    if lib.config.MULTICORE:
-        fin = pipe_printf.open(format, *columns)
-        if use_cursor is not None:
-            use_cursor.copy_from(fin,'"{}"."{}"'.format(schema_name,dbimage.name), 
-                                 sep='\t', columns=field_names)
-    else:
-        tsv = b''.join(format % tpl for tpl in zip(*columns))
-        fin = io.BytesIO(tsv)
-        if use_cursor is not None:
-            use_cursor.copy_from(fin, '"{}"."{}"'.format(schema_name,dbimage.name), 
-                                 sep='\t', size=-1, columns=field_names)
-
-    # Update bookkeeping table
-    insert_q = """
+    @param   use_cursor   db cursor
+    @param   schema_name
+    @param   visits       Iterable of visit numbers; None for all visits
+    @return  set of (visit, raft, sensor) (see get_bit_key())
+    """
+    if visits is None:
+        use_cursor.execute("""
+        SELECT visit, raft, sensor FROM "{schema_name}"."_temp:forced_bit"
+        """.format(**locals())
+        )
+        return set(get_bit_key(*row) for row in use_cursor.fetchall())
+
+    visits = sorted(set(int(visit) for visit in visits))
+    if not visits:
+        return set()
+
+    use_cursor.execute("""
+    SELECT visit, raft, sensor FROM "{schema_name}"."_temp:forced_bit"
+    WHERE visit = ANY(%s)
+    """.format(**locals()), (visits,)
+    )
+    return set(get_bit_key(*row) for row in use_cursor.fetchall())
+
+def register_bits(use_cursor, schema_name, determiners_list):
+    """
+    Record in the bookkeeping table that data of input files
+    have been inserted, with one INSERT.
+
+    @param   use_cursor        db cursor
+    @param   schema_name
+    @param   determiners_list  List of dicts of determiners
+    """
+    if not determiners_list:
+        return
+    values = ",".join(
+        "({}, {}, {})".format(*get_bit_key(**determiners))
+        for determiners in determiners_list
+    )
+    use_cursor.execute("""
         INSERT INTO "{schema_name}"."_temp:forced_bit"
-        (visit, raft, sensor) values({visit}, {raft}, {sensor})
-        """.format(**determiners)
-    use_cursor.execute(insert_q)
+        (visit, raft, sensor) VALUES {values}
+        """.format(**locals())
+    )
+
+def create_partitions(schema, finder, assumptions, files, dryrun=False):
+    """
+    Create the partitions into which input files go, for the tables
+    that are partitioned (see 'partition' in the assumptions yaml).
+    This is done in a transaction of its own before insertion,
+    lest workers inserting different units wait for one another's locks.
+
+    @param  schema       (Postgres) schema name
+    @param  finder       Instance of class which knows how to find the data
+    @param  assumptions  Instance of class describing the tables
+    @param  files        Iterable of paths to input files
+    @param  dryrun       If true only print out sql
+    """
+    partitioned = [(name, assumptions.get_partition(name))
+                   for name in assumptions.get_tables()]
+    partitioned = [(name, p) for name, p in partitioned if p is not None]
+    if not partitioned:
+        return
+
+    # Map (table, suffix) -> determiners of one of the files
+    needed = {}
+    for vf in files:
+        determiners = finder.get_determiner_dict(vf)
+        for name, partition in partitioned:
+            suffix, bound = lib.dbimage.get_partition_bound(partition, determiners)
+            needed.setdefault((name, suffix), determiners)
+
+    db = None if dryrun else lib.common.new_db_connection()
+    cursor = None if dryrun else db.cursor()
+    for (name, suffix), determiners in sorted(needed.items()):
+        lib.dbimage.create_partition(cursor, schema, name,
+                                     assumptions.get_partition(name),
+                                     determiners)
+    if db is not None:
+        db.commit()
+        db.close()
+    print("{} partitions".format(len(needed)))
 
 def _get_dbimages(schema, finder, assumptions):
     """
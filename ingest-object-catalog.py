@@ -23,9 +23,16 @@
 import numpy
 import psycopg2
 import sys
+import yaml
 
+import lib.benchmark
 import lib.fits
+import lib.index_builder
+import lib.ingest_plan
+import lib.memory_budget
 import lib.misc
+import lib.spatial_sort
+import lib.table_split
 import lib.forced_algos
 import lib.dbtable
 import lib.sourcetable
@@ -37,6 +44,7 @@ from lib.dpdd import DpddView
 if lib.config.MULTICORE:
     from lib import pipe_printf
 
+import concurrent.futures
 import glob
 import io
 import itertools
@@ -86,6 +94,79 @@ def main():
                         help="Ingest data for specified tracts only if present. Else ingest all")
     parser.add_argument('--imageRerunDir', default=None, 
                         help="Root dir for finding images; defaults to rerunDir")
+    parser.add_argument('--memory-budget', metavar='SIZE',
+                        help="""Memory to be used (e.g. 64G). Patches whose
+                        estimated footprint exceeds it are processed in row
+                        slices. The footprint is a static estimate from the
+                        FITS headers (4 times the table size), not measured
+                        memory. Default: unlimited""")
+    parser.add_argument('--partition-by-tract', action='store_true',
+                        help="""Create tables partitioned by tract (range of
+                        object_id). Partitions are created as tracts are
+                        inserted. Effective only when tables are created""")
+    parser.add_argument('--incremental', action='store_true',
+                        help="""Do not drop indexes before loading. Each tract
+                        is loaded into a new table, which is then attached
+                        to the tables partitioned by --partition-by-tract
+                        and indexed alone""")
+    parser.add_argument('--spatial-sort', action='store_true',
+                        help="""Insert the rows of each patch in the order
+                        along a Hilbert curve on the sky instead of the
+                        order in the files""")
+    parser.add_argument('--wcs-single-precision', action='store_true',
+                        help="""Write the conversions of errors and shapes
+                        to the sky directly in single precision (they are
+                        still computed in double precision), which saves
+                        memory and some time. The values stored as Real
+                        are the same""")
+    parser.add_argument('--index-strategy', choices=["btree", "brin", "both"],
+                        default="btree",
+                        help="""Index type for object_id and skymap_id lookups
+                        (with --create-index). BRIN indexes are much smaller
+                        and faster to build than B-trees on tables loaded in
+                        tract/patch order; with "brin", object_id is not
+                        made a primary key except in "position", which
+                        foreign keys of forced sources reference""")
+    parser.add_argument('--max-tuple-size', type=int, default=0,
+                        metavar='BYTES',
+                        help="""Assign the algorithms that are not in the
+                        dpdd view to tables (misc_ref*, forced*) so that
+                        rows are at most BYTES bytes (e.g. 2032, the TOAST
+                        threshold) instead of using the fixed layout. Must
+                        be the same for creation and insertion""")
+    parser.add_argument('--write-layout', metavar='PATH',
+                        help="""Write the layout of tables (algorithms,
+                        columns and bytes per row) to PATH as YAML
+                        for review, and exit""")
+    parser.add_argument('--pack-flags', action='store_true',
+                        help="""Store the Boolean flags of each algorithm with
+                        at least {} flags as bits of Bigint columns
+                        ("<algorithm>_flagbits<k>") instead of one column
+                        each. The view decodes them. Effective only when
+                        tables are created; pass it also when inserting
+                        into such tables""".format(lib.config.packFlagsMin))
+    parser.add_argument('--index-jobs', type=int, default=1, metavar='N',
+                        help="""Number of DB sessions with which to create
+                        indexes concurrently (with --create-index)""")
+    parser.add_argument('--index-memory', metavar='SIZE',
+                        help="""Total maintenance_work_mem (e.g. 16G) to be
+                        divided among the --index-jobs sessions.
+                        Default: the server's setting""")
+    parser.add_argument('--index-parallel-workers', type=int, metavar='N',
+                        help="""max_parallel_maintenance_workers of each
+                        session (PostgreSQL >= 11). Default: the server's
+                        setting""")
+    parser.add_argument('--band-threads', type=int, default=0, metavar='N',
+                        help="""Threads with which to read and transform the
+                        per-band catalogs of a patch. Default: one per band""")
+    parser.add_argument('--benchmark', nargs='?', const=os.devnull,
+                        metavar='SINK',
+                        help="""Read, transform and encode all data as for
+                        insertion, but write the COPY data to file SINK
+                        (default: null device) instead of the db. Then report
+                        the throughput. Nothing is written to the db.""")
+    parser.add_argument('--benchmark-results', metavar='PATH',
+                        help="Append --benchmark results to this JSON-lines file")
     args = parser.parse_args()
 
     if args.tracts is not None:
@@ -98,9 +179,39 @@ def main():
     lib.config.tableSpace = args.table_space
     lib.config.indexSpace = args.index_space
     lib.config.withSkymapWcs = args.with_skymap_wcs
+    if args.memory_budget:
+        lib.config.memoryBudget = lib.memory_budget.parse_size(args.memory_budget)
+    lib.config.bandThreads = args.band_threads
+    lib.config.partitionByTract = args.partition_by_tract
+    lib.config.incremental = args.incremental
+    lib.config.spatialSort = args.spatial_sort
+    lib.config.wcsSinglePrecision = args.wcs_single_precision
+    lib.config.packFlags = args.pack_flags
+    lib.config.indexJobs = args.index_jobs
+    lib.config.indexStrategy = args.index_strategy
+    if args.index_memory:
+        lib.config.indexMemory = lib.memory_budget.parse_size(args.index_memory)
+    lib.config.indexParallelWorkers = args.index_parallel_workers
 
     filters = lib.common.get_existing_filters(args.rerunDir, hsc=False)
-    if args.create_index:
+    lib.config.maxTupleSize = args.max_tuple_size
+    lib.config.splitBands = len(filters)
+    if args.write_layout:
+        write_layout(args.rerunDir, args.schemaName, filters, args.write_layout)
+    elif args.benchmark:
+        bench = lib.benchmark.Benchmark(label="ingest-object-catalog")
+        sink = lib.benchmark.SinkConnection(args.benchmark, bench)
+        with bench.time("total"):
+            insert_into_mastertable(args.rerunDir, args.schemaName,
+                                    args.table_name, filters, False,
+                                    args.tracts, sink=sink)
+        sink.close()
+        bench.stage("total").rows  = bench.stage("sink").rows
+        bench.stage("total").bytes = bench.stage("sink").bytes
+        bench.report()
+        if args.benchmark_results:
+            bench.save(args.benchmark_results)
+    elif args.create_index:
         create_index_on_mastertable(args.rerunDir, args.schemaName, filters)
     else:
         print("Invoking create_mastertable_if_not_exists")
@@ -166,7 +277,8 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
                 dm_schema = create_mastertable(cursor, rerunDir, schemaName, 
                                                masterTableName, filters,
                                                imageRerunDir)
-                create_view(cursor, schemaName, dm_schema)
+                create_view(cursor, schemaName, dm_schema,
+                            get_view_column_map(rerunDir, schemaName, filters))
             db.commit()
         else:
             if bNeedView:
@@ -179,11 +291,13 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
                     return
 
                 with db.cursor() as cursor:
-                    create_view(cursor, schemaName, dm_schema)
+                    create_view(cursor, schemaName, dm_schema,
+                                get_view_column_map(rerunDir, schemaName, filters))
                 db.commit()
             else:
                 db.close()
-                drop_index_from_mastertable(rerunDir, schemaName, filters)
+                if not lib.config.incremental:
+                    drop_index_from_mastertable(rerunDir, schemaName, filters)
     else:
         if bNeedCreating:
             print("Would execute: ")
@@ -192,7 +306,8 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
             dm_schema = create_mastertable(cursor, rerunDir, schemaName, 
                                            masterTableName, filters, 
                                            imageRerunDir)
-            create_view(cursor, schemaName, dm_schema)
+            create_view(cursor, schemaName, dm_schema,
+                        get_view_column_map(rerunDir, schemaName, filters))
         else:
             print("Master table already exists")
             print("pretend create anyway:")
@@ -201,7 +316,8 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
             dm_schema = create_mastertable(cursor, rerunDir, schemaName, 
                                            masterTableName, filters, 
                                            imageRerunDir)
-            create_view(cursor, schemaName, dm_schema)
+            create_view(cursor, schemaName, dm_schema,
+                        get_view_column_map(rerunDir, schemaName, filters))
 def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters,
                        imageRerunDir):
     """
@@ -248,7 +364,77 @@ def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters,
     #  OMIT old view code,including table comment. We have no old-style views
 
 
-def create_view(cursor, schemaName, dm_schema):
+def get_view_column_map(rerunDir, schemaName, filters):
+    """
+    Get the expressions with which the view reads flags
+    packed into bitmasks (--pack-flags).
+    @param rerunDir
+        Path to the rerun directory
+    @param schemaName
+        Name of the schema
+    @param filters
+        List of filter names
+    @return
+        dict mapping native column name (lower case) -> SQL expression.
+        Empty if flags are not packed.
+    """
+    if not lib.config.packFlags:
+        return {}
+
+    tract, patch, filter = get_an_existing_catalog_id(rerunDir, schemaName)
+    catPath = get_catalog_path(rerunDir, tract, patch, filter, hsc=False,
+                               schemaName=schemaName)
+    refPath = get_ref_path   (rerunDir, tract, patch)
+
+    universals,object_id,coord,dm_schema = get_ref_schema_from_file(refPath)
+    multibands = get_catalog_schema_from_file(catPath, object_id)
+
+    column_map = {}
+    for table in itertools.chain(universals.values(), multibands.values()):
+        table.set_filters(filters)
+        column_map.update(table.get_flag_decoders())
+
+    return column_map
+
+
+def write_layout(rerunDir, schemaName, filters, path):
+    """
+    Write the layout of the tables as YAML, for review.
+    @param rerunDir
+        Path to the rerun directory
+    @param schemaName
+        Name of the schema
+    @param filters
+        List of filter names
+    @param path
+        Path to the output file
+    """
+    tract, patch, filter = get_an_existing_catalog_id(rerunDir, schemaName)
+    catPath = get_catalog_path(rerunDir, tract, patch, filter, hsc=False,
+                               schemaName=schemaName)
+    refPath = get_ref_path   (rerunDir, tract, patch)
+
+    universals,object_id,coord,dm_schema = get_ref_schema_from_file(refPath)
+    multibands = get_catalog_schema_from_file(catPath, object_id)
+
+    for table in itertools.chain(universals.values(), multibands.values()):
+        table.set_filters(filters)
+
+    layout = {
+        "max_tuple_size": lib.config.maxTupleSize,
+        "bands": len(filters),
+        "tables": lib.table_split.describe(universals, 1)
+                + lib.table_split.describe(multibands, len(filters)),
+    }
+    with open(path, "w") as f:
+        yaml.safe_dump(layout, f, default_flow_style=False, sort_keys=False)
+
+    for table in layout["tables"]:
+        print("{:16} {:6} columns {:6} bytes/row".format(
+            table["table"], table["columns"], table["row_bytes"]))
+
+
+def create_view(cursor, schemaName, dm_schema, column_map=None):
     """
     Creates dpdd view.
     @param cursor
@@ -258,6 +444,9 @@ def create_view(cursor, schemaName, dm_schema):
     @param dm_schema
        dm table schema version used to produce the data.  Naming conventions
        for native quantities vary somewhat depending on this version
+    @param column_map
+       dict mapping native column name (lower case) -> SQL expression
+       to be used instead, e.g. for flags packed into bitmasks.
 
     """
     yaml_path = os.path.join(os.getenv('DPDD_YAML'),'nativeobject_to_dpddview.yaml')
@@ -265,7 +454,8 @@ def create_view(cursor, schemaName, dm_schema):
                                  'nativeobject_to_dpddview_postgres.yaml')
     view_builder = DpddView(schemaName, yaml_path=yaml_path,
                             yaml_override=yaml_override,
-                            dm_schema_version=int(dm_schema))
+                            dm_schema_version=int(dm_schema),
+                            column_map=column_map)
     vs = view_builder.view_string()
     if cursor:
         cursor.execute(vs)
@@ -275,7 +465,7 @@ def create_view(cursor, schemaName, dm_schema):
 
 
 def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters,
-                            dryrun, tracts):
+                            dryrun, tracts, sink=None):
     """
     Insert data into tables.
     @param rerunDir
@@ -291,6 +481,9 @@ def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters,
     @param tracts
         If present (not None) insert data only from specified tracts. Else
         insert data from all tracts
+    @param sink
+        If present (not None) lib.benchmark.SinkConnection to be used
+        instead of a db connection
     """
     all_tracts = lib.common.get_existing_tracts(rerunDir)
     our_tracts = []
@@ -301,10 +494,75 @@ def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters,
             if t in all_tracts: our_tracts.append(t)
 
     for tract in our_tracts:
+        partitions = create_tract_partitions(schemaName, tract, dryrun, sink)
         for patch in get_existing_patches(rerunDir, tract):
-            insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch, dryrun)
+            insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch, dryrun, sink, partitions)
+        if lib.config.incremental:
+            attach_tract_partitions(schemaName, tract, partitions, dryrun, sink)
+
+def create_tract_partitions(schemaName, tract, dryrun, sink=None):
+    """
+    Create partitions for a tract in the tables that are partitioned
+    (see --partition-by-tract). Nothing is done for tables not partitioned.
+    With --incremental, the partitions are created unattached
+    (see attach_tract_partitions()).
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param tract
+        Tract number.
+    @param dryrun
+        If True just print commands rather than executing
+    @param sink
+        If present (not None) lib.benchmark.SinkConnection to be used
+        instead of a db connection
+    @return
+        dict mapping table name -> name of the partition into which to
+        load the tract.
+    """
+    partitions = {}
+    if dryrun:
+        return partitions
+
+    db = sink if sink is not None else lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        for table in lib.dbtable.get_partitioned_tables(cursor, schemaName, "object_id"):
+            if lib.config.incremental:
+                partitions[table] = lib.dbtable.create_tract_staging(cursor, schemaName, table, tract)
+            else:
+                partitions[table] = lib.dbtable.create_tract_partition(cursor, schemaName, table, tract)
+    db.commit()
+
+    if lib.config.incremental and not partitions and sink is None:
+        lib.misc.warning("--incremental: tables are not partitioned; loading with indexes in place")
 
-def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch, dryrun):
+    return partitions
+
+def attach_tract_partitions(schemaName, tract, partitions, dryrun, sink=None):
+    """
+    Attach the partitions created by create_tract_partitions()
+    with --incremental, building indexes on them.
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param tract
+        Tract number.
+    @param partitions
+        Return value of create_tract_partitions()
+    @param dryrun
+        If True just print commands rather than executing
+    @param sink
+        If present (not None) lib.benchmark.SinkConnection to be used
+        instead of a db connection
+    """
+    if dryrun or not partitions:
+        return
+
+    db = sink if sink is not None else lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        for table in partitions:
+            lib.dbtable.attach_tract_partition(cursor, schemaName, table, tract)
+            db.commit()
+
+def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch, dryrun, sink=None, partitions=None):
     """
     Insert a specific patch into the master table.
     The data will actually flow not into the master table but into its children.
@@ -322,7 +580,16 @@ def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters
         Patch number (x*100 + y)
     @param dryrun
         If True just print commands rather than executing
+    @param sink
+        If present (not None) lib.benchmark.SinkConnection to be used
+        instead of a db connection
+    @param partitions
+        dict mapping table name -> name of the table into which to insert
+        rows instead (see create_tract_partitions())
     """
+    if partitions is None:
+        partitions = {}
+
     catPaths = {}
 
     for filter in filters:
@@ -331,7 +598,7 @@ def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters
         if lib.common.path_exists(catPath):
             catPaths[filter] = catPath
 
-    db = lib.common.new_db_connection()
+    db = sink if sink is not None else lib.common.new_db_connection()
     with db.cursor() as cursor:
         if not dryrun:
             use_cursor = cursor
@@ -342,32 +609,71 @@ def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters
             use_cursor = None
 
         refPath = get_ref_path(rerunDir, tract, patch)
-        universals,object_id,coord,dm_schema = get_ref_schema_from_file(refPath)
-
-        for table in itertools.chain(universals.values()):
-            table.transform(rerunDir, tract, patch, "", coord)
-
-        multibands = {}
-        for filter, catPath in catPaths.items():
-            for table in get_catalog_schema_from_file(catPath, object_id).values():
-                table.transform(rerunDir, tract, patch, filter, coord)
 
-                if table.name not in multibands:
-                    multibands[table.name] = []
-                multibands[table.name].append((table, filter))
+        # Patches too large for --memory-budget are read in row slices
+        rowRanges = lib.memory_budget.get_row_ranges([refPath] + list(catPaths.values()))
+        for rowRange in rowRanges:
+            universals,object_id,coord,dm_schema = get_ref_tables(refPath, rowRange)
+
+            for table in itertools.chain(universals.values()):
+                table.transform(rerunDir, tract, patch, "", coord)
+
+            # Bands are loaded concurrently, but merged in the order of
+            # "filters" so that the inserted rows do not depend on timing
+            nThreads = lib.config.bandThreads or max(1, len(catPaths))
+            with concurrent.futures.ThreadPoolExecutor(nThreads) as pool:
+                futures = [
+                    (filter, pool.submit(load_catalog_tables, rerunDir, tract, patch,
+                                         filter, catPath, object_id, coord, rowRange))
+                    for filter, catPath in catPaths.items()
+                ]
+
+                multibands = {}
+                for filter, future in futures:
+                    for table in future.result().values():
+                        if table.name not in multibands:
+                            multibands[table.name] = []
+                        multibands[table.name].append((table, filter))
+
+            # The same order for all tables, so that they stay aligned
+            if lib.config.spatialSort:
+                order = lib.spatial_sort.get_order(coord["ra"], coord["dec"])
+            else:
+                order = None
 
-        for table in universals.values():
-            insert_patch_into_universaltable(use_cursor, schemaName, table, 
-                                             object_id)
-        for tables in multibands.values():
-            insert_patch_into_multibandtable(use_cursor, schemaName, tables, 
-                                             object_id)
+            for table in universals.values():
+                insert_patch_into_universaltable(use_cursor, schemaName, table, 
+                                                 object_id, partitions.get(table.name), order)
+            for tables in multibands.values():
+                insert_patch_into_multibandtable(use_cursor, schemaName, tables, 
+                                                 object_id, partitions.get(tables[0][0].name), order)
 
     if not dryrun:
         db.commit()
 
 
-def insert_patch_into_universaltable(cursor, schemaName, table, object_id):
+def load_catalog_tables(rerunDir, tract, patch, filter, catPath, object_id, coord, rowRange=None):
+    """
+    Read a per-band catalog, check its object_id, and transform its tables.
+    This function is run in worker threads, one call per band.
+    @param catPath
+        Path to the "forced-*.fits" file of the band "filter".
+    @param object_id
+        numpy.array of object ID read from the ref catalog.
+    @param coord
+        Coordinates returned by get_ref_tables().
+    @param rowRange
+        (start, stop) of rows to read, or None for all rows.
+    @return
+        PoppingOrderedDict mapping name: str -> table: DBTable
+    """
+    dbtables = get_catalog_tables(catPath, object_id, rowRange)
+    for table in dbtables.values():
+        table.transform(rerunDir, tract, patch, filter, coord)
+    return dbtables
+
+
+def insert_patch_into_universaltable(cursor, schemaName, table, object_id, targetName=None, order=None):
     """
     Insert a patch into a universal table.
     'Universal' means 'Its contents are universal to all bands.'
@@ -379,10 +685,15 @@ def insert_patch_into_universaltable(cursor, schemaName, table, object_id):
         DBTable_BandIndependent object
     @param object_id
         numpy.array of object ID. This is used as the primary key.
+    @param targetName
+        Name of the table into which to insert rows, if not table.name
+        (e.g. a partition of it)
+    @param order
+        If not None, numpy.array of indices in the order of which to insert rows
     """
-    return insert_patch_into_multibandtable(cursor, schemaName, [(table, "")], object_id)
+    return insert_patch_into_multibandtable(cursor, schemaName, [(table, "")], object_id, targetName, order)
 
-def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
+def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id, targetName=None, order=None):
     """
     Insert a patch into a multiband table.
     @param cursor
@@ -395,6 +706,11 @@ def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
         with different colors.
     @param object_id
         numpy.array of object ID. This is used as the primary key.
+    @param targetName
+        Name of the table into which to insert rows, if not table.name
+        (e.g. a partition of it)
+    @param order
+        If not None, numpy.array of indices in the order of which to insert rows
     """
     columns = [ object_id ]
     fieldNames = [ "object_id" ]
@@ -409,16 +725,22 @@ def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
     format += "\n"
     format = format.encode("utf-8")
 
+    if targetName is None:
+        targetName = table.name
+
+    if order is not None:
+        columns = [column[order] for column in columns]
+
     if lib.config.MULTICORE:
         fin = pipe_printf.open(format, *columns)
         if cursor is not None:
-            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), 
+            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, targetName), 
                              sep='\t', columns=fieldNames)
     else:
         tsv = b''.join(format % tpl for tpl in zip(*columns))
         fin = io.BytesIO(tsv)
         if cursor is not None:
-            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), 
+            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, targetName), 
                              sep='\t', size=-1, columns=fieldNames)
 
 
@@ -444,17 +766,16 @@ def create_index_on_mastertable(rerunDir, schemaName, filters):
     for table in itertools.chain(universals.values(), multibands.values()):
         table.set_filters(filters)
 
+    jobs = []
     db = lib.common.new_db_connection()
     with db.cursor() as cursor:
         for table in itertools.chain(universals.values(), multibands.values()):
-            if ('position' in table.name):
-                table.set_dbconnection(db)
-                table.create_index(cursor, schemaName)
-                table.set_dbconnection(None)
-            else:
-                table.create_index(cursor, schemaName)
-                db.commit()
-    #db.commit()
+            qualifiedName = '"{}"."{}"'.format(schemaName, table.name)
+            for name, statements in table.get_index_jobs(cursor, schemaName):
+                jobs.append((qualifiedName, name, statements))
+    db.close()
+
+    lib.index_builder.build_indexes(jobs)
 
 
 def drop_index_from_mastertable(rerunDir, schemaName, filters):
@@ -485,13 +806,15 @@ def drop_index_from_mastertable(rerunDir, schemaName, filters):
             table.drop_index(cursor, schemaName)
     db.commit()
 
-def get_ref_schema_from_file(path):
+def get_ref_schema_from_file(path, rowRange=None):
     """
     Get fields in a "ref-*.fits" file. Assign a list of algos (hence
     fields handled by those algos) to each of the db tables to be
     created
     @param path
         Path to a "ref-*.fits" file
+    @param rowRange
+        (start, stop) to read only these rows; None to read all
     @return (dbtables, object_id, coord)
         * "dbtables" is PoppingOrderedDict mapping name: str -> table: DBTable,
         * "object_id" is a numpy.array of object_id,
@@ -499,24 +822,60 @@ def get_ref_schema_from_file(path):
             in which angles are in degrees.
         * "dm_schema_version" Value of 'AFW_TABLE_VERSION' keyword
     """
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path, rowRange=rowRange)[1])
 
     dm_schema_version = table.dm_schema_version()
+    object_id = table.fields["id"].data
+
+    dbtables = get_ref_schema_from_table(table, lib.forced_algos.ref_algos, path)
+    coord = dbtables["position"].algos["ref_coord"].coord
 
+    return dbtables, object_id, coord, dm_schema_version
+
+def get_ref_tables(path, rowRange=None):
+    """
+    Same as get_ref_schema_from_file(), but the file is read by
+    a compiled lib.ingest_plan.IngestPlan, so the column -> table mapping
+    is derived only once per schema.
+    """
+    header, data, nRows = lib.fits.fits_open_raw(path, rowRange)
+    plan = lib.ingest_plan.get_plan(path, header, get_ref_schema_from_table,
+                                    lib.forced_algos.ref_algos)
+    if plan is None:
+        return get_ref_schema_from_file(path, rowRange)
+
+    dbtables, (object_id,) = plan.execute(data, nRows, ["id"])
+    coord = dbtables["position"].algos["ref_coord"].coord
+
+    return dbtables, object_id, coord, plan.dm_schema_version()
+
+def get_ref_schema_from_table(table, algoclasses, path):
+    """
+    Assign a list of algos (hence fields handled by those algos)
+    to each of the db tables to be created.
+    @param table
+        SourceTable read from a "ref-*.fits" file.
+        Its fields are consumed by the algos.
+    @param algoclasses
+        PoppingOrderedDict mapping algo name -> Algo class,
+        usually lib.forced_algos.ref_algos
+    @param path
+        Path to the file, used in messages
+    @return
+        PoppingOrderedDict mapping name: str -> table: DBTable
+    """
     # All fields starting with 'id' are removed from source table 'table'
     # and put in a new table.  In practice this table has a single column
     # named 'object_id'
-    object_id = table.cutout_subtable("id").fields["id"].data
+    table.cutout_subtable("id")
 
-    # Form  PoppingOrderedDict from forced_algos.ref_algos, applying each
+    # Form  PoppingOrderedDict from algoclasses, applying each
     # algo to sourcetable obtained by reading fits file 
     algos = PoppingOrderedDict(
         (name, algoclass(table))
-        for name, algoclass in lib.forced_algos.ref_algos.items()
+        for name, algoclass in algoclasses.items()
     )
 
-    coord = algos["ref_coord"].coord
-
     # To suppress warnings "Ignored field: ...",
     # ignore the fields explicitly.
     def ignore(prefix):
@@ -547,13 +906,28 @@ def get_ref_schema_from_file(path):
     #       forced5
     #   view dpdd will come from position join dpdd_ref join dpdd_forced
 
-    add("position", [
-        "ref_coord", "detect", "merge"
-    ], dbtable_class=DBTable_Position)
-    add("dpdd_ref",
-        ["base_SdssCentroid", "base_PsfFlux","base_ClassificationExtendedness",
-         "base_Blendedness","base_PixelFlags", "ext_shapeHSM", 
-         "base_SdssShape", "modelfit_CModel", "deblend", ])
+    # Tables used in the view
+    hot = [
+        ("position", ["ref_coord", "detect", "merge"]),
+        ("dpdd_ref",
+            ["base_SdssCentroid", "base_PsfFlux","base_ClassificationExtendedness",
+             "base_Blendedness","base_PixelFlags", "ext_shapeHSM", 
+             "base_SdssShape", "modelfit_CModel", "deblend", ]),
+    ]
+
+    if lib.config.maxTupleSize:
+        # misc_ref, misc_ref2, misc_ref3, ...
+        layout = lib.table_split.split(algos, hot,
+            lambda k: "misc_ref{}".format(k+1 if k else ""), 1)
+        for name, sourcenames in layout:
+            if name == "position":
+                add(name, sourcenames, dbtable_class=DBTable_Position)
+            else:
+                add(name, sourcenames)
+        return dbtables
+
+    add("position", hot[0][1], dbtable_class=DBTable_Position)
+    add("dpdd_ref", hot[1][1])
     add("misc_ref",
         ["base_CircularApertureFlux",
          "base_FootprintArea",
@@ -575,10 +949,13 @@ def get_ref_schema_from_file(path):
         for k in algos: print(str(k))
         raise RuntimeError("Algorithms remain unused; see above ")
 
-    return dbtables, object_id, coord, dm_schema_version
+    return dbtables
 
 # Changes to accommodate leaving field 'parent' as is (no change to 'parent_id')
 class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
+    # Forced sources reference position(object_id)
+    isReferenced = True
+
     def __init__(self, name, algos):
         super().__init__(name, algos)
         self.dbconn = None
@@ -588,10 +965,16 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
 
     # The position table is special in that extra indexes are created for it
     def create_index(self, cursor, schemaName):
-        lib.dbtable.DBTable_BandIndependent.create_index(self, cursor, schemaName)
+        for name, statements in self.get_index_jobs(cursor, schemaName):
+            for statement in statements:
+                cursor.execute(statement)
+            if (self.dbconn): self.dbconn.commit()
+
+    def get_index_jobs(self, cursor, schemaName):
+        jobs = lib.dbtable.DBTable_BandIndependent.get_index_jobs(self, cursor, schemaName)
         indexSpace = lib.config.get_index_space()
 
-        cursor.execute("""
+        jobs.append(("{self.name}_parent_id_idx".format(**locals()), ["""
         CREATE INDEX IF NOT EXISTS
             "{self.name}_parent_id_idx"
         ON
@@ -600,20 +983,32 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
             )
         {indexSpace}
         """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
-        cursor.execute("""
-        CREATE INDEX IF NOT EXISTS
-            "{self.name}_skymap_id_idx"
-        ON
-            "{schemaName}"."{self.name}"
-            ( public.skymap_from_object_id(object_id)
-            )
-        {indexSpace}
-        """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
-        cursor.execute("""
+        ]))
+        if lib.config.indexStrategy in ("btree", "both"):
+            jobs.append(("{self.name}_skymap_id_idx".format(**locals()), ["""
+            CREATE INDEX IF NOT EXISTS
+                "{self.name}_skymap_id_idx"
+            ON
+                "{schemaName}"."{self.name}"
+                ( public.skymap_from_object_id(object_id)
+                )
+            {indexSpace}
+            """.format(**locals())
+            ]))
+        if lib.config.indexStrategy in ("brin", "both"):
+            jobs.append(("{self.name}_skymap_id_brin".format(**locals()), ["""
+            CREATE INDEX IF NOT EXISTS
+                "{self.name}_skymap_id_brin"
+            ON
+                "{schemaName}"."{self.name}"
+            USING BRIN
+                ( public.skymap_from_object_id(object_id)
+                )
+            {brinParams}
+            {indexSpace}
+            """.format(brinParams=lib.dbtable.get_brin_params(), **locals())
+            ]))
+        jobs.append(("{self.name}_coord_idx".format(**locals()), ["""
         CREATE INDEX IF NOT EXISTS
             "{self.name}_coord_idx"
         ON
@@ -625,11 +1020,10 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         WHERE
             coord IS NOT NULL
         """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
+        ]))
 
         # indices WHERE detect_isprimary = True
-        cursor.execute("""
+        jobs.append(("{self.name}_object_id_primary_idx".format(**locals()), ["""
         CREATE UNIQUE INDEX IF NOT EXISTS
             "{self.name}_object_id_primary_idx"
         ON
@@ -640,22 +1034,21 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         WHERE
           detect_isprimary
         """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
-        cursor.execute("""
-        CREATE INDEX IF NOT EXISTS
-            "{self.name}_skymap_id_primary_idx"
-        ON
-            "{schemaName}"."{self.name}"
-            ( public.skymap_from_object_id(object_id)
-            )
-        {indexSpace}
-        WHERE
-          detect_isprimary
-        """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
-        cursor.execute("""
+        ]))
+        if lib.config.indexStrategy in ("btree", "both"):
+            jobs.append(("{self.name}_skymap_id_primary_idx".format(**locals()), ["""
+            CREATE INDEX IF NOT EXISTS
+                "{self.name}_skymap_id_primary_idx"
+            ON
+                "{schemaName}"."{self.name}"
+                ( public.skymap_from_object_id(object_id)
+                )
+            {indexSpace}
+            WHERE
+              detect_isprimary
+            """.format(**locals())
+            ]))
+        jobs.append(("{self.name}_coord_primary_idx".format(**locals()), ["""
         CREATE INDEX IF NOT EXISTS
             "{self.name}_coord_primary_idx"
         ON
@@ -668,8 +1061,9 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
             coord IS NOT NULL
             AND detect_isprimary
         """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
+        ]))
+
+        return jobs
 
     def drop_index(self, cursor, schemaName):
         lib.dbtable.DBTable_BandIndependent.drop_index(self, cursor, schemaName)
@@ -685,6 +1079,11 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         """.format(**locals())
         )
         cursor.execute("""
+        DROP INDEX IF EXISTS
+            "{schemaName}"."{self.name}_skymap_id_brin"
+        """.format(**locals())
+        )
+        cursor.execute("""
         DROP INDEX IF EXISTS
             "{schemaName}"."{self.name}_coord_idx"
         """.format(**locals())
@@ -708,27 +1107,68 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         """.format(**locals())
         )
 
-def get_catalog_schema_from_file(path, object_id):
+def get_catalog_schema_from_file(path, object_id, rowRange=None):
     """
     Get fields in a "forced_src-*.fits" file.
     @param path
         Path to a "forced-*.fits" file
     @param object_id
         numpy.array of object ID from the corresponding "ref-*.fits" file.
+    @param rowRange
+        (start, stop) to read only these rows; None to read all.
+        Must be the same as that given to get_ref_schema_from_file().
     @return
         PoppingOrderedDict mapping name: str -> table: DBTable.
     """
 
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path, rowRange=rowRange)[1])
+
+    these_object_id = table.fields["id"].data
+
+    if not numpy.all(these_object_id == object_id):
+        raise RuntimeError("object_id in forced_src doesn't agree with ref " + path)
+
+    return get_catalog_schema_from_table(table, lib.forced_algos.forced_algos, path)
 
-    these_object_id = table.cutout_subtable("id").fields["id"].data
+def get_catalog_tables(path, object_id, rowRange=None):
+    """
+    Same as get_catalog_schema_from_file(), but the file is read by
+    a compiled lib.ingest_plan.IngestPlan, so the column -> table mapping
+    is derived only once per schema.
+    """
+    header, data, nRows = lib.fits.fits_open_raw(path, rowRange)
+    plan = lib.ingest_plan.get_plan(path, header, get_catalog_schema_from_table,
+                                    lib.forced_algos.forced_algos)
+    if plan is None:
+        return get_catalog_schema_from_file(path, object_id, rowRange)
+
+    dbtables, (these_object_id,) = plan.execute(data, nRows, ["id"])
 
     if not numpy.all(these_object_id == object_id):
         raise RuntimeError("object_id in forced_src doesn't agree with ref " + path)
 
+    return dbtables
+
+def get_catalog_schema_from_table(table, algoclasses, path):
+    """
+    Assign a list of algos (hence fields handled by those algos)
+    to each of the db tables to be created.
+    @param table
+        SourceTable read from a "forced-*.fits" file.
+        Its fields are consumed by the algos.
+    @param algoclasses
+        PoppingOrderedDict mapping algo name -> Algo class,
+        usually lib.forced_algos.forced_algos
+    @param path
+        Path to the file, used in messages
+    @return
+        PoppingOrderedDict mapping name: str -> table: DBTable
+    """
+    table.cutout_subtable("id")
+
     algos = PoppingOrderedDict(
         (name, algoclass(table))
-        for name, algoclass in lib.forced_algos.forced_algos.items()
+        for name, algoclass in algoclasses.items()
     )
 
     # To suppress warnings "Ignored field: ...",
@@ -746,7 +1186,8 @@ def get_catalog_schema_from_file(path, object_id):
     def add(name, sourcenames, dbtable_class=lib.dbtable.DBTable):
         dbtables[name] = dbtable_class(name, algos.pop_many(sourcenames))
 
-    add("dpdd_forced", [
+    # Table used in the view
+    hot = ("dpdd_forced", [
         "base_PixelFlags",
         "base_InputCount",
         "base_Variance",
@@ -758,6 +1199,16 @@ def get_catalog_schema_from_file(path, object_id):
         "base_PsfFlux",
     ])
 
+    if lib.config.maxTupleSize:
+        # forced2, forced3, ...
+        layout = lib.table_split.split(algos, [hot],
+            lambda k: "forced{}".format(k+2), lib.config.splitBands)
+        for name, sourcenames in layout:
+            add(name, sourcenames)
+        return dbtables
+
+    add(*hot)
+
     add("forced2", [
         "base_GaussianFlux",
         "ext_photometryKron_KronFlux",   # not in lsst 1.1 data
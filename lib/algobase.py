@@ -19,9 +19,11 @@
 
 from . import libwcs
 from . import common
+from . import flagbits
 from .misc import PoppingOrderedDict
 from . import sourcetable
 
+import copy
 import numpy
 
 import re
@@ -214,6 +216,25 @@ class Algo(object):
     doubleprecisions = []
     renamerules = []
 
+    @classmethod
+    def from_static(cls, sourceTable):
+        """
+        Construct an algo from a table that has exactly the fields
+        the constructor would cut out of a whole catalog.
+        This is how lib/ingest_plan.py constructs "static" algos
+        without building the fields of the whole catalog.
+        @param sourceTable (SourceTable)
+        @return (Algo)
+            Constructed by the constructor of the class.
+        @exception ValueError
+            The constructor did not take exactly the fields of sourceTable.
+        """
+        keys = list(sourceTable.fields.keys())
+        algo = cls(sourceTable)
+        if sourceTable.fields or list(algo.sourceTable.fields.keys()) != keys:
+            raise ValueError("{}: fields are not those the constructor takes".format(cls.__name__))
+        return algo
+
     def set_filters(self, filters):
         """
         This member must be called before creating tables
@@ -258,9 +279,8 @@ class Algo(object):
             The sqltype is "big integer", "double precision", etc, for example.
         """
         ret = []
-        for field in self.sourceTable.fields.values():
-            for f in field.explode():
-                ret.append((prefix + f.name, f.get_sqltype()))
+        for f in self._get_backend_scalars()[0]:
+            ret.append((prefix + f.name, f.get_sqltype()))
 
         return ret
 
@@ -276,12 +296,72 @@ class Algo(object):
             in which x and y are numpy.array.
         """
         ret = []
-        for field in self.sourceTable.fields.values():
-            for f in field.explode():
-                ret.append((prefix + f.name, f.get_print_format(), f.get_columns()))
+        for f in self._get_backend_scalars()[0]:
+            ret.append((prefix + f.name, f.get_print_format(), f.get_columns()))
 
         return ret
 
+    def predict_backend_fields(self, prefix):
+        """
+        Same as get_backend_fields(), but the sqltypes are those that
+        the fields will have after transform(), which need not have been called.
+        """
+        fields = PoppingOrderedDict(
+            (key, field._replace(data=field.data[:0]))
+            for key, field in self.sourceTable.fields.items()
+        )
+        shadow = copy.copy(self)
+        shadow.sourceTable = sourcetable.SourceTable(
+            fields, self.sourceTable.slots, self.sourceTable.fitsheader)
+        shadow.transform(None, None, None, None, None)
+        return shadow.get_backend_fields(prefix)
+
+    def _get_backend_scalars(self):
+        """
+        Get the scalar fields stored in the backend table.
+        If config.packFlags, Boolean flags are replaced by bitmasks
+        (see lib/flagbits.py) placed where the first flag was.
+        @return (fields, packed)
+            "fields" is a list of Field.
+            "packed" is a dict mapping flag name -> (column name, bit).
+        """
+        fields = []
+        for field in self.sourceTable.fields.values():
+            fields.extend(field.explode())
+
+        names = flagbits.select_flags(fields)
+        if not names:
+            return fields, {}
+
+        family = self.get_flag_family()
+        packedNames = set(names)
+        bitmasks = [field for field, _ in flagbits.pack(
+            family, [f for f in fields if f.name in packedNames])]
+
+        ret = []
+        for f in fields:
+            if f.name not in packedNames:
+                ret.append(f)
+            elif bitmasks:
+                ret.extend(bitmasks)
+                bitmasks = []
+
+        return ret, flagbits.get_bit_positions(family, names)
+
+    def get_packed_flags(self):
+        """
+        Get the flags packed into bitmasks (config.packFlags).
+        @return dict mapping flag name -> (bitmask column name, bit).
+        """
+        return self._get_backend_scalars()[1]
+
+    @classmethod
+    def get_flag_family(cls):
+        """
+        Name of the family of flags of this algo, e.g. "base_PixelFlags"
+        """
+        return re.sub(r"^Algo_", "", cls.__name__)
+
     def get_frontend_fields(self, prefix):
         """
         Get field data for the frontend view.
@@ -293,6 +373,7 @@ class Algo(object):
                 {definition} AS {fieldname}.
         """
         members = []
+        packed = self.get_packed_flags()
 
         fluxes = {desc["flux"]: desc for desc in self.fluxes}
         fluxerrs = {desc["fluxerr"]: desc for desc in self.fluxerrs}
@@ -320,7 +401,11 @@ class Algo(object):
             else:
                 for f in field.explode():
                     member = prefix + f.name
-                    members.append((member, member, f.unit, f.doc))
+                    if f.name in packed:
+                        column, bit = packed[f.name]
+                        members.append((member, flagbits.decode_expression(prefix + column, bit), f.unit, f.doc))
+                    else:
+                        members.append((member, member, f.unit, f.doc))
 
         return members
 
@@ -19,7 +19,7 @@ from yaml import FullLoader
 import re
 from .misc import PoppingOrderedDict
 from .misc import warning
-from .sourcetable import Field
+from .sourcetable import Field_constant
 from .dbimage import DbImage
 from .expressions import rpn_eval
 import numpy as np
@@ -48,6 +48,10 @@ class Assumptions(object):
         self.inf = infile        # string or  file pointer to yaml text file
         self.parsed = None
         self.ignores = None            # store compiled
+        # Plans of how to apply assumptions, keyed by list of input fields
+        self._plans = {}
+        # Values of compute expressions, keyed by substituted RPN list
+        self._computed = {}
         # will be dict of table info.  One entry per table. Value is
         # a dict of fields,  key =  name, but without data
         self.finals = None 
@@ -85,6 +89,13 @@ class Assumptions(object):
                 for t_name, t_elt in parsed['tables'].items():
                     if type(t_elt) != type({}):
                         raise TypeException("Improper table definition")
+                    partition = t_elt.get('partition')
+                    if partition is not None:
+                        if partition.get('method') not in ['range', 'list']:
+                            raise ValueError("Partition method of {} must be 'range' or 'list'".format(t_name))
+                        for k in ['key', 'value']:
+                            if k not in partition:
+                                raise ValueError("Partition of {} has no '{}'".format(t_name, k))
 
                     #for field in t_elt['table']:
                     #    print('key: ',str(field),' value: ', str(t_elt['table'][field]) )
@@ -108,110 +119,161 @@ class Assumptions(object):
         For now only handle case where everything goes in a single DbImage
 
         """
-        print('assumptions.apply kw arguments: ')
-        for k in kw:
-            print('key is ', k, ' value is ', kw[k])
+        plan = self._get_plan(tuple(raw.fields.keys()))
 
-        # apply ignores
-        self._compile_ignores()
-        if self.ignores != None:
-            remaining = PoppingOrderedDict()
-            for key, f in raw.fields.items():
-                matched = False
-                for p in self.ignores:
-                    if p.fullmatch(key):
-                        matched = True
-                        break;
-                if not matched: remaining[key] = f
+        fields = PoppingOrderedDict()
+        for key in plan['keep']:
+            fields[key] = raw.fields[key]
+
+        for d, tokens, fieldtype, dtype in plan['computes']:
+            val = self._eval_compute(tokens, kw)
+            fields[d['name']] = Field_constant.from_value(
+                d['name'], val, dtype, d['doc'], d['compute'], fieldtype)
+
+        table_name = plan['table_name']
+        dbimage = DbImage(table_name, fields, schema_name)
+        dbimage.set_filters([""])
+        dbimage.accept_foreign(plan['foreign'])
+        dbimage.accept_indexes(plan['indexes'])
+        dbimage.accept_partition(self.get_partition(table_name))
 
+        # If we know about double precision fields which should stay
+        # double precision, this would be the place to call
+        # dbimage.append_doubles(list-of-names)
 
+        self.finals = PoppingOrderedDict()    
+        self.finals[table_name] = dbimage
+        
+        return self.finals
 
-        #  The dict `remaining` now contains only fields we expect to use.
-        #  field name is used for dict key, as in SourceTable.fields
+    def _get_plan(self, field_names):
+        """
+        Get the plan of how to make a DbImage from input with the given
+        fields. The plan is computed once for each distinct list of fields
+        (normally once per run) and cached.
 
-        #  Compute data length from the first field, needed for compute fields
-        for k in remaining:
-            data_len = len(remaining[k].data)
-            break
+        Parameters
+        ----------
+        field_names : tuple of str
+            Names of the fields of the input, in order
+
+        Returns
+        -------
+        dict with keys
+            'table_name'  name of the table
+            'keep'        names of input fields to be kept, in order
+            'computes'    list of (column dict, parsed compute expression,
+                          field type, numpy dtype) for columns computed
+                          from determiners
+            'foreign'     list of foreign key constraints
+            'indexes'     list of other constraints
+        """
+        plan = self._plans.get(field_names)
+        if plan is not None:
+            return plan
+
+        if not self.parsed: self.parse()
+        self._compile_ignores()
 
-        fields = PoppingOrderedDict()
         table_name = list(self.parsed['tables'].keys())[0]
         table_def = self.parsed['tables'][table_name]
-
         column_dicts, column_group_dicts = self._get_names(table_def)
 
-        for key, f in remaining.items():
+        # name -> column dict
+        columns = PoppingOrderedDict((d['name'], d) for d in column_dicts)
+        if column_group_dicts:
+            group_re = re.compile('|'.join(
+                '(?:{})'.format(c['name_re']) for c in column_group_dicts))
+        else:
+            group_re = None
+
+        keep = []
+        for key in field_names:
+            if self.ignores is not None and self.ignores.fullmatch(key):
+                continue
             # check each one matches a column name or column group in our table
             # (For now assume we have only one table)
-            matched = False
-            for i in range(len(column_dicts)):
-                if column_dicts[i]['name'] == key:
-                    matched = True
-                    fields[key] = f
-                    del(column_dicts[i])
-                    break
-            if matched: continue
-            for c in column_group_dicts:
-                if re.fullmatch(c['name_re'], key):
-                    matched = True
-                    fields[key] = f
-                    break
-            if not matched:
-                print("Column ", key, " unknown to Assumptions file")
-                # and maybe raise exception?
-
-
-        # If there are any entries left in column_dicts they better have
+            if key in columns:
+                del columns[key]
+                keep.append(key)
+            elif group_re is not None and group_re.fullmatch(key):
+                keep.append(key)
+            else:
+                warning("Column", key, "unknown to Assumptions file")
+
+        # If there are any entries left in columns they better have
         # the compute attribute
-        for d in column_dicts:
+        computes = []
+        for name, d in columns.items():
             if 'compute' in d:
-                c_list = d['compute']
-                cf_list = []
-                for i in range(len(c_list)):
-                    cf_list.append(str(c_list[i]).format(**kw))
-
-                s_val = rpn_eval([], cf_list)
-                print('computed value ', s_val)
-                val = s_val
-                if 'int' in d['dtype']: 
-                    val = int(s_val)
-                    #print('int val ', val)
-                if 'float' in d['dtype']: 
-                    val = int(s_val)
-                    #print('float val ', val)
-                dat = np.full([data_len], int(val), np.int64)
-
-
-                field = Field(d['name'], d['type'], None, dat, d['doc'], 
-                              d['compute'])
-                fields[d['name']] = field
+                # A computed value is a single number
+                fieldtype = d.get('type', 'Scalar')
+                if fieldtype not in ('Scalar', 'Angle'):
+                    raise ValueError("Computed column {} must be of type Scalar or Angle, not {}".format(name, fieldtype))
+                dtype = np.dtype(d.get('dtype', 'int64'))
+                computes.append((d, self._parse_compute(d['compute']), fieldtype, dtype))
             else:
-                print("Field ", key, 
-                      ", known to Assumptions, not found in input")
+                warning("Field", name, "known to Assumptions, not found in input")
 
-
-        dbimage = DbImage(table_name, fields, schema_name)
-        dbimage.set_filters([""])
-        constraints = self._get_constraints(table_name)
         foreign_list = []
         index_list = []
-        for c in constraints:
+        for c in self._get_constraints(table_name):
             if c['constraint_type'] == 'fk':
                 foreign_list.append(c)
             else:
                 index_list.append(c)
 
-        dbimage.accept_foreign(foreign_list)
-        dbimage.accept_indexes(index_list)
+        plan = {
+            'table_name': table_name,
+            'keep': keep,
+            'computes': computes,
+            'foreign': foreign_list,
+            'indexes': index_list,
+        }
+        self._plans[field_names] = plan
+        return plan
+
+    @staticmethod
+    def _parse_compute(c_list):
+        """
+        Parameters
+        ----------
+        c_list : list
+            RPN list of a compute column, whose elements may be
+            substitutions like '{visit}'
 
-        # If we know about double precision fields which should stay
-        # double precision, this would be the place to call
-        # dbimage.append_doubles(list-of-names)
+        Returns
+        -------
+        list of (key, token) where key is the name of the keyword argument
+        to be substituted (token is then None), or None if token is
+        to be used as it is
+        """
+        tokens = []
+        for elt in c_list:
+            m = re.fullmatch(r'\{([a-zA-Z_]*)\}', str(elt))
+            if m:
+                tokens.append((m.group(1), None))
+            else:
+                tokens.append((None, str(elt)))
+        return tokens
 
-        self.finals = PoppingOrderedDict()    
-        self.finals[table_name] = dbimage
-        
-        return self.finals
+    def _eval_compute(self, tokens, kw):
+        """
+        Evaluate a compute expression parsed by _parse_compute()
+        for the given keyword arguments (determiners).
+
+        Returns
+        -------
+        int
+        """
+        cf_list = [token if key is None else str(kw[key])
+                   for key, token in tokens]
+        key = tuple(cf_list)
+        val = self._computed.get(key)
+        if val is None:
+            val = int(rpn_eval([], cf_list))
+            self._computed[key] = val
+        return val
         
     def _get_names(self, assump_table):
         """
@@ -240,11 +302,13 @@ class Assumptions(object):
         return None
 
     def _compile_ignores(self):
+        """
+        Compile all ignore patterns into one regular expression
+        """
+        if self.ignores is not None: return
         igs = self._get_ignores()
-        if igs == None: return
-        self.ignores = []
-        for ig in igs:
-            self.ignores.append(re.compile(ig))
+        if not igs: return
+        self.ignores = re.compile('|'.join('(?:{})'.format(ig) for ig in igs))
 
     def get_tables(self):
         """
@@ -267,7 +331,23 @@ class Assumptions(object):
 
         return None
 
-    #### Probably don't need either of get_foreign_keys or get_indexes
+    def get_partition(self, table_name):
+        """
+        Parameters
+        ----------
+        table_name : str
+
+        Returns
+        -------
+        dict describing how the table is partitioned (see
+        lib.dbimage.get_partition_bound), or None if it is not partitioned.
+        The constraints of a partitioned table go only on its partitions
+        (DbImage refuses to make them for the partitioned table), so the
+        key need not be in the primary key and may be an expression.
+        """
+        if not self.parsed: self.parse()
+        return self.parsed['tables'].get(table_name, {}).get('partition')
+
     def get_foreign_keys(self, table_name):
         """
         Parameters
@@ -278,7 +358,7 @@ class Assumptions(object):
         _______
         A list of foreign key definitions
         """
-        constraints = _get_constraints(table_name)
+        constraints = self._get_constraints(table_name)
         if constraints is None: return []
         foreign = []
         for c in constraints:
@@ -297,4 +377,21 @@ class Assumptions(object):
         -------
         A list of index definitions 
         """
-        return []                #   **** TO-DO ****
+        constraints = self._get_constraints(table_name)
+        if constraints is None: return []
+        return [c for c in constraints if c['constraint_type'] != 'fk']
+
+    def get_primary_key(self, table_name):
+        """
+        Parameters
+        ----------
+        table_name : str
+
+        Returns
+        -------
+        list of column names of the primary key, or None
+        """
+        for i in self.get_indexes(table_name):
+            if i.get('property') == 'primary':
+                return i['columns']
+        return None
@@ -0,0 +1,295 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Timing and bookkeeping of ingest benchmarks.
+Results are appended as JSON lines, one record per stage per run,
+tagged with the git commit, so that runs can be compared across commits.
+"""
+
+import collections
+import contextlib
+import datetime
+import importlib.util
+import json
+import os
+import subprocess
+import time
+
+_topDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_commit():
+    """
+    @return (str) Abbreviated commit of the working tree, with "-dirty"
+        appended if there are uncommitted changes. "unknown" outside git.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=_topDir, stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_script(name):
+    """
+    Import one of the top-level scripts (e.g. "ingest-object-catalog"),
+    whose names are not valid module names.
+    @return module object
+    """
+    path = os.path.join(_topDir, name + ".py")
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class StageRecord(object):
+    """
+    Accumulated measurement of a stage.
+    """
+    __slots__ = ["seconds", "rows", "bytes", "calls", "skipped", "failed"]
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.rows    = 0
+        self.bytes   = 0
+        self.calls   = 0
+        self.skipped = None
+        self.failed  = None
+
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def mb_per_sec(self):
+        return self.bytes / self.seconds / 1e6 if self.seconds > 0 else 0.0
+
+
+class Benchmark(object):
+    """
+    Collects per-stage timings of one benchmark run.
+
+    Usage:
+        bench = Benchmark(label="ingest")
+        with bench.time("fits_open", nBytes=size):
+            hdus = lib.fits.fits_open(path)
+        bench.report()
+        bench.save("benchmark-results.jsonl")
+    """
+
+    def __init__(self, label=""):
+        self.label  = label
+        self.commit = git_commit()
+        self.date   = datetime.datetime.now().isoformat(timespec="seconds")
+        self.stages = collections.OrderedDict()
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageRecord()
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def time(self, name, nRows=0, nBytes=0):
+        """
+        Time the enclosed block and add it to stage "name".
+        If the block raises, its time is still added,
+        and the stage is marked as failed.
+        @param nRows (int)
+            Number of rows processed in the block.
+        @param nBytes (int)
+            Number of bytes processed (read or produced) in the block.
+        """
+        record = self.stage(name)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record.failed = "{}: {}".format(type(e).__name__, e)
+            raise
+        else:
+            record.rows  += nRows
+            record.bytes += nBytes
+        finally:
+            record.seconds += time.perf_counter() - start
+            record.calls += 1
+
+    def add_bytes(self, name, nBytes):
+        """
+        Add bytes to a stage when they are known only after timing it.
+        """
+        self.stage(name).bytes += nBytes
+
+    def skip(self, name, reason):
+        """
+        Record that stage "name" could not be run.
+        """
+        self.stage(name).skipped = str(reason)
+
+    def report(self, out=None):
+        """
+        Print a table of the stages.
+        """
+        print("benchmark {} at {} ({})".format(self.label, self.commit, self.date), file=out)
+        print("{:24} {:>10} {:>12} {:>14} {:>10}".format(
+            "stage", "seconds", "rows", "rows/sec", "MB/sec"), file=out)
+        for name, r in self.stages.items():
+            if r.skipped is not None:
+                print("{:24} skipped: {}".format(name, r.skipped), file=out)
+            else:
+                print("{:24} {:10.3f} {:12d} {:14.1f} {:10.2f}".format(
+                    name, r.seconds, r.rows, r.rows_per_sec(), r.mb_per_sec()), file=out)
+                if r.failed is not None:
+                    print("{:24} failed: {}".format("", r.failed), file=out)
+
+    def save(self, path):
+        """
+        Append the records of this run to a JSON-lines file.
+        """
+        with open(path, "a") as fout:
+            for name, r in self.stages.items():
+                fout.write(json.dumps({
+                    "commit" : self.commit,
+                    "date"   : self.date,
+                    "label"  : self.label,
+                    "stage"  : name,
+                    "seconds": r.seconds,
+                    "rows"   : r.rows,
+                    "bytes"  : r.bytes,
+                    "calls"  : r.calls,
+                    "skipped": r.skipped,
+                    "failed" : r.failed,
+                }) + "\n")
+
+
+def load_results(path):
+    """
+    @return list of dicts as written by Benchmark.save()
+    """
+    with open(path) as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+
+def compare(path, label=None, commits=None, out=None):
+    """
+    Print rows/sec of every stage for each commit found in "path".
+    When a commit has several runs, the last one is used.
+    @param label (str)
+        If given, only runs with this label are compared.
+    @param commits (list of str)
+        If given, only these commits are compared, in this order.
+    """
+    table = collections.OrderedDict()
+    order = []
+    for rec in load_results(path):
+        if label is not None and rec["label"] != label:
+            continue
+        if rec["commit"] not in order:
+            order.append(rec["commit"])
+        if rec["skipped"] is not None or rec.get("failed") is not None or rec["seconds"] <= 0:
+            value = None
+        else:
+            value = rec["rows"] / rec["seconds"]
+        table.setdefault(rec["stage"], {})[rec["commit"]] = value
+
+    if commits:
+        order = [c for c in commits if c in order]
+
+    print("rows/sec", file=out)
+    print("{:24}".format("stage") + "".join(" {:>16}".format(c[:16]) for c in order), file=out)
+    for stage, values in table.items():
+        cells = []
+        for c in order:
+            v = values.get(c)
+            cells.append(" {:>16}".format("-" if v is None else "{:.1f}".format(v)))
+        print("{:24}".format(stage) + "".join(cells), file=out)
+
+
+class SinkConnection(object):
+    """
+    Stand-in for a DB connection, for benchmarking the client side of ingest.
+    COPY data sent through its cursors is written to a file (e.g. /dev/null)
+    and timed; other statements are discarded.
+    """
+
+    def __init__(self, path, bench, stage="sink"):
+        """
+        @param path (str or binary file object)
+            File to which to write COPY data.
+        @param bench (Benchmark)
+            Where to record the time spent writing and the rows/bytes written.
+        @param stage (str)
+            Stage name under which to record them.
+        """
+        self.fout  = open(path, "wb") if isinstance(path, str) else path
+        self.bench = bench
+        self.stage = stage
+
+    def cursor(self):
+        return SinkCursor(self)
+
+    def commit(self):
+        self.fout.flush()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.fout.close()
+
+
+class SinkCursor(object):
+    """
+    Cursor of SinkConnection.
+    Queries return no rows, so "already inserted" checks always fail.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __iter__(self):
+        return iter(())
+
+    def execute(self, query, vars=None):
+        pass
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def copy_from(self, file, table, sep='\t', null='\\N', size=8192, columns=None):
+        nRows = 0
+        nBytes = 0
+        with self.conn.bench.time(self.conn.stage) as record:
+            while True:
+                data = file.read(1 << 20)
+                if not data:
+                    break
+                nRows += data.count(b"\n")
+                nBytes += len(data)
+                self.conn.fout.write(data)
+            file.close()
+        record.rows  += nRows
+        record.bytes += nBytes
@@ -26,6 +26,56 @@ withSkymapWcs = ""
 tableSpace = ""
 indexSpace = ""
 
+# Memory (bytes) for ingest to use. 0 means unlimited.
+memoryBudget = 0
+
+# Threads to load the per-band catalogs of a patch. 0 means one per band.
+bandThreads = 0
+
+# Create object catalog tables partitioned by tract (range of object_id)
+partitionByTract = False
+
+# Keep indexes in place, loading each tract into a table that is
+# attached to the partitioned tables (and so indexed) after the load
+incremental = False
+
+# Insert rows of a patch sorted along a Hilbert curve on the sky
+spatialSort = False
+
+# Store the flags of an algo in Bigint bitmasks (see lib/flagbits.py)
+# if it has at least packFlagsMin flags
+packFlags = False
+packFlagsMin = 4
+
+# Return the conversions of errors and shapes to the sky (lib/libwcs.py)
+# in single precision, rounded once from double-precision arithmetic.
+# Their results are stored as Real anyway.
+wcsSinglePrecision = False
+
+# Create the columns of a table ordered by alignment (8, 4, 2, 1 bytes,
+# variable length) to save padding. COPY and views refer to columns by name.
+alignColumns = True
+
+# Maximum size (bytes) of a row of object catalog tables whose algos are
+# assigned by lib/table_split.py. 0 means the fixed layout in
+# ingest-object-catalog.py. 2032 is PostgreSQL's TOAST threshold (8kB pages).
+maxTupleSize = 0
+# Number of bands with which the widths of band-dependent tables are computed
+splitBands = 6
+
+# Concurrent DB sessions with which to create indexes
+indexJobs = 1
+# Total maintenance_work_mem (bytes) of the sessions. 0 means server default.
+indexMemory = 0
+# max_parallel_maintenance_workers per session. None means server default.
+indexParallelWorkers = None
+# Index type of object_id range lookups (primary key, skymap_id):
+# "btree", "brin" or "both". With "brin", object_id is not a primary key
+# (except in tables referenced by foreign keys: DBTable.isReferenced).
+indexStrategy = "btree"
+# pages_per_range of BRIN indexes
+brinPagesPerRange = 32
+
 dbServer = {
     'dbname': os.environ.get("USER", "postgres"),
 }
@@ -17,9 +17,92 @@
 # Adapted from dbtable.py
 from . import common
 from . import config
+from . import table_split
 
 from .sourcetable import Field
 import numpy as np
+import re
+
+
+def get_partition_bound(partition, determiners):
+    """
+    Get the partition into which the data of an input file go.
+    @param partition (dict)
+        Partitioning spec of a table in the assumptions yaml, with keys
+        'method' ('range' or 'list'), 'key', 'value' (format string to
+        which determiners are given, e.g. '{visit}'), 'width' (for range;
+        default 1) and 'name' (prefix of the partition suffix; default 'p').
+    @param determiners (dict)
+        Determiners of the input file (visit, raft, sensor).
+    @return (suffix, bound)
+        "suffix" is appended to the table name to name the partition.
+        "bound" is the FOR VALUES clause of the partition.
+    """
+    value = str(partition['value']).format(**determiners)
+    prefix = partition.get('name', 'p')
+    if partition['method'] == 'range':
+        width = int(partition.get('width', 1))
+        lower = int(value) // width * width
+        upper = lower + width
+        suffix = "{prefix}{lower}".format(**locals())
+        bound = "FOR VALUES FROM ({lower}) TO ({upper})".format(**locals())
+    else:
+        try:
+            literal = str(int(value))
+        except ValueError:
+            literal = "'" + value.replace("'", "''") + "'"
+        suffix = prefix + re.sub(r'\W', '_', value)
+        bound = "FOR VALUES IN ({literal})".format(**locals())
+    return suffix, bound
+
+
+def create_partition(cursor, schemaName, tableName, partition, determiners):
+    """
+    Create the partition of a table (partitioned by DbImage.create())
+    into which the data of an input file go, if it does not exist.
+    @param cursor
+        DB connection's cursor object
+        If None don't actually write to db; just to stdout
+    @param partition (dict)
+        Partitioning spec (see get_partition_bound())
+    @param determiners (dict)
+        Determiners of the input file (visit, raft, sensor).
+    @return (str)
+        Name of the partition.
+    """
+    suffix, bound = get_partition_bound(partition, determiners)
+    partitionName = "{tableName}_{suffix}".format(**locals())
+    tableSpace = config.get_table_space()
+
+    create_string = """
+    CREATE TABLE IF NOT EXISTS "{schemaName}"."{partitionName}"
+    PARTITION OF "{schemaName}"."{tableName}"
+    {bound}
+    {tableSpace}
+    """.format(**locals())
+
+    if cursor is not None:
+        cursor.execute(create_string)
+    else:
+        print(create_string)
+
+    return partitionName
+
+
+def get_partitions(cursor, schemaName, tableName):
+    """
+    @return (list of str)
+        Names of the partitions of a table, sorted.
+    """
+    cursor.execute("""
+    SELECT c.relname
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = '"{schemaName}"."{tableName}"'::regclass
+    ORDER BY c.relname
+    """.format(**locals())
+    )
+    return [name for name, in cursor.fetchall()]
+
 
 class DbImage(object):
     """
@@ -49,7 +132,7 @@ class DbImage(object):
            ** add data for 'compute' columns
     """
     __slots__ = ["name", "filters", "fields", "schema_name", "doubles",
-                 "foreign", "index"]
+                 "foreign", "index", "partition"]
 
     def __init__(self, name,  fields, schema_name, doubles=[],
                  foreign=None, index=None):
@@ -64,6 +147,7 @@ class DbImage(object):
         self.filters = None
         self.foreign = None
         self.index = None
+        self.partition = None
 
     def set_filters(self, filters):
         """
@@ -108,6 +192,17 @@ class DbImage(object):
         """
         self.index = indexes
 
+    def accept_partition(self, partition):
+        """
+        Store the partitioning spec of this table
+
+        Parameters
+        ----------
+        partition  : dict or None
+           See get_partition_bound(). None if the table is not partitioned
+        """
+        self.partition = partition
+
     def transform(self):
         """
         most of the arguments in the original dbtable version were there
@@ -153,19 +248,28 @@ class DbImage(object):
         """
         ### members = ['object_id Bigint']  Don't always have this
         print('In DbImage.create( )')
-        members = []
+        columns = []
         for filter in self.filters:
             #filt = common.filterToShortName[filter] + "_" if filter else ""
             filt = filter + "_" if filter else ""
             #for algo in self.algos.values():
             #for name, type in algo.get_backend_fields(filt):
-            for name, type in self._get_backend_fields(filt):
-                    members.append("{name}  {type}".format(**locals()))
+            columns.extend(self._get_backend_fields(filt))
 
+        columns, saved = table_split.align_columns(columns)
+        if saved:
+            print("{}: column order saves {} bytes/row".format(self.name, saved))
+
+        members = ["{name}  {type}".format(**locals()) for name, type in columns]
         members = """,
         """.join(members)
 
-        tableSpace = config.get_table_space()
+        if self.partition:
+            # The table space is given to each partition instead
+            tableSpace = "PARTITION BY {} ({})".format(
+                self.partition['method'].upper(), self.partition['key'])
+        else:
+            tableSpace = config.get_table_space()
 
         create_string = """
         CREATE TABLE "{schema_name}"."{self.name}" (
@@ -179,35 +283,108 @@ class DbImage(object):
         else:
             print(create_string)
 
-    def create_primary(self, cursor):
+    def _get_key_table(self, table):
+        """
+        @param table
+            Table (e.g. a partition) on which to create keys, or None
+        @return "table", or the name of this table if it is None
+        @exception ValueError
+            This table is partitioned and "table" is None. Keys of
+            a partitioned table are created on each partition, because
+            those of the partitioned table itself would have to include
+            the partition key, which may be an expression.
+        """
+        if table is not None:
+            return table
+        if self.partition:
+            raise ValueError("Keys of partitioned table {} must be created on its partitions".format(self.name))
+        return self.name
+
+    def get_primary_statement(self, table=None):
+        """
+        @param table
+            Table (e.g. a partition) on which to create the primary key.
+            Default: this table
+        @return SQL to create the primary key, or None if there is none
+        """
         create_pkey_str = """
         ALTER TABLE {fulltable} ADD CONSTRAINT "{table}_pkey" PRIMARY KEY ({cols}) 
         """
+        table = self._get_key_table(table)
         for i in self.index:
             if 'property' in i:
                 if i['property'] == 'primary':
-                    table = self.name 
                     fulltable = '"' + self.schema_name + '"."' + table + '"'
                     cols = ','.join(i['columns'])
-                    create_pkey_q = create_pkey_str.format(**locals())
-                    if cursor is None:
-                        print(create_pkey_q)
-                    else:
-                        cursor.execute(create_pkey_q)
-                    return    # can only have one primary key
+                    return create_pkey_str.format(**locals())
+        return None
+
+    def get_primary_index_statements(self, table=None):
+        """
+        Get the statements that create the primary key through a unique
+        index. Unlike ADD PRIMARY KEY, the index is built CONCURRENTLY,
+        which blocks neither readers nor writers of the table; only the
+        quick second statement locks it. The first statement cannot run
+        in a transaction block (lib.index_builder runs it in autocommit).
+        @param table
+            Table (e.g. a partition) on which to create the primary key.
+            Default: this table
+        @return list of SQL statements, empty if there is no primary key
+        """
+        table = self._get_key_table(table)
+        fulltable = '"' + self.schema_name + '"."' + table + '"'
+        indexSpace = config.get_index_space()
+        for i in self.index:
+            if i.get('property') == 'primary':
+                cols = ','.join(i['columns'])
+                return ["""
+        CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "{table}_pkey" ON {fulltable} ({cols})
+        {indexSpace}
+        """.format(**locals()), """
+        ALTER TABLE {fulltable} ADD CONSTRAINT "{table}_pkey" PRIMARY KEY USING INDEX "{table}_pkey"
+        """.format(**locals())]
+        return []
+
+    def get_cluster_statements(self, table=None):
+        """
+        Get the statements that rewrite a table in the order of its
+        primary key (objectId first), so that the rows of an object,
+        i.e. its light curve, are in few pages. The primary key must exist.
+        @param table
+            Table (e.g. a partition) to rewrite. Default: this table
+        @return list of SQL statements, empty if there is no primary key
+        """
+        table = self._get_key_table(table)
+        fulltable = '"' + self.schema_name + '"."' + table + '"'
+        for i in self.index:
+            if i.get('property') == 'primary':
+                return [
+                    'CLUSTER {fulltable} USING "{table}_pkey"'.format(**locals()),
+                    'ANALYZE {fulltable}'.format(**locals()),
+                ]
+        return []
+
+    def create_primary(self, cursor, table=None):
+        create_pkey_q = self.get_primary_statement(table)
+        if create_pkey_q is None:
+            return
+        if cursor is None:
+            print(create_pkey_q)
+        else:
+            cursor.execute(create_pkey_q)
                 
-    def drop_primary(self, cursor):
+    def drop_primary(self, cursor, table=None):
         """
         
         """
         drop_pkey_str = """
         ALTER TABLE {fulltable} DROP CONSTRAINT IF EXISTS "{table}_pkey"
         """
+        if table is None: table = self.name
         for i in self.index:
             if 'property' in i:
                 if i['property'] == 'primary':
-                    table = '"' + self.name + '"'
-                    fulltable = '"' + self.schema_name + '"."' + self.name + '"'
+                    fulltable = '"' + self.schema_name + '"."' + table + '"'
                     drop_pkey_q = drop_pkey_str.format(**locals())
                     if cursor is None:
                         print(drop_pkey_q)
@@ -217,22 +394,55 @@ class DbImage(object):
             # produce drop.. string
             # if cursor not None exexute; else print
 
-    def create_foreign(self, cursor):
+    def get_foreign_statements(self, table=None, valid=True):
+        """
+        @param table
+            Table (e.g. a partition) on which to create the foreign keys.
+            Default: this table
+        @param valid
+            If False, the foreign keys are created NOT VALID: rows already
+            in the table are not checked until get_validate_statements()
+            are executed.
+        @return list of SQL statements to create the foreign keys
+        """
         create_fk_str = """
         ALTER TABLE {fulltable} ADD CONSTRAINT "{table}_{column}_fk"
         FOREIGN KEY ({column}) REFERENCES {reftable} ({refcolumn})
+        {notValid}
         """ 
-        # can add NOT VALID to end of command above to defer validity
-        # checking on rows already in the db
+        notValid = "" if valid else "NOT VALID"
+        table = self._get_key_table(table)
+        statements = []
         for f in self.foreign:
-            table =  self.name
-            fulltable = '"' + self.schema_name + '"."' +  self.name + '"'
+            fulltable = '"' + self.schema_name + '"."' +  table + '"'
             column = f['column']
             reftable = '"' + self.schema_name + '"."' + f['ref_table'] + '"'
             refcolumn = f['ref_column']
             # produce create.. string
-            create_fk_q = create_fk_str.format(**locals())
+            statements.append(create_fk_str.format(**locals()))
+        return statements
 
+    def get_validate_statements(self, table=None):
+        """
+        Get the statements that validate the foreign keys created NOT VALID.
+        Validation takes locks that block neither readers nor validation
+        of other tables.
+        @param table
+            Table (e.g. a partition) of the foreign keys. Default: this table
+        @return list of (constraint name, SQL statement)
+        """
+        table = self._get_key_table(table)
+        fulltable = '"' + self.schema_name + '"."' +  table + '"'
+        statements = []
+        for f in self.foreign:
+            name = "{}_{}_fk".format(table, f['column'])
+            statements.append((name, """
+        ALTER TABLE {fulltable} VALIDATE CONSTRAINT "{name}"
+        """.format(**locals())))
+        return statements
+
+    def create_foreign(self, cursor, table=None):
+        for create_fk_q in self.get_foreign_statements(table):
             # if cursor not None execute; else print
             if cursor is None:
                 print(create_fk_q)
@@ -240,15 +450,13 @@ class DbImage(object):
                 cursor.execute(create_fk_q)
 
 
-    def drop_foreign(self, cursor):
+    def drop_foreign(self, cursor, table=None):
         drop_fk_str = """
         ALTER TABLE {fulltable} DROP CONSTRAINT IF EXISTS "{table}_{column}_fk" 
         """ 
-        # can add NOT VALID to end of command above to defer validity
-        # checking on rows already in the db
+        if table is None: table = self.name
         for f in self.foreign:
-            table = self.name
-            fulltable = '"' + self.schema_name + '"."' +  self.name + '"'
+            fulltable = '"' + self.schema_name + '"."' +  table + '"'
             column = f['column']
 
             # produce drop.. string
@@ -17,6 +17,180 @@
 
 from . import common
 from . import config
+from . import flagbits
+from . import table_split
+
+# object_id = (tract << 42) | (patch_x << 37) | (patch_y << 32) | (counter)
+# (See tractSearch() in objcatalog.sql.in)
+tractShift = 42
+
+
+def get_tract_range(tract):
+    """
+    @return (lower, upper)
+        Range [lower, upper) of object_id in the tract.
+    """
+    return tract << tractShift, (tract + 1) << tractShift
+
+
+def is_partitioned(cursor, schemaName, tableName):
+    """
+    @return True if the table is a partitioned table.
+    """
+    cursor.execute("""
+    SELECT 0 FROM pg_partitioned_table
+    WHERE partrelid = '"{schemaName}"."{tableName}"'::regclass
+    """.format(**locals())
+    )
+    return cursor.fetchone() is not None
+
+
+def get_partitioned_tables(cursor, schemaName, key):
+    """
+    @param key (str)
+        Name of the column by whose range the tables are partitioned.
+    @return (list of str)
+        Names of the tables in the schema partitioned by range of "key".
+    """
+    cursor.execute("""
+    SELECT c.relname
+    FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0]
+    WHERE n.nspname = %s AND p.partstrat = 'r' AND a.attname = %s
+    ORDER BY c.relname
+    """, (schemaName, key)
+    )
+    return [name for name, in cursor.fetchall()]
+
+
+def get_brin_params():
+    """
+    @return (str) "WITH (...)" clause of CREATE INDEX ... USING BRIN
+    """
+    return "WITH (pages_per_range = {})".format(int(config.brinPagesPerRange))
+
+
+def get_tract_partition_name(tableName, tract):
+    """
+    @return (str) Name of the partition of table "tableName" for "tract".
+    """
+    return "{tableName}_tract{tract}".format(**locals())
+
+
+def is_attached(cursor, schemaName, partitionName):
+    """
+    @return
+        None if the table "partitionName" does not exist,
+        True if it is a partition of some table, False otherwise.
+    """
+    cursor.execute("""
+    SELECT EXISTS (SELECT 0 FROM pg_inherits WHERE inhrelid = c.oid)
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s AND c.relname = %s
+    """, (schemaName, partitionName)
+    )
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def create_tract_partition(cursor, schemaName, tableName, tract):
+    """
+    Create the partition of a table (partitioned by DBTable.create())
+    that holds the objects in a tract, if it does not exist.
+    @param cursor
+        DB connection's cursor object
+        If None don't actually write to db; just to stdout
+    @param tract (int)
+        Tract number.
+    @return (str)
+        Name of the partition.
+    """
+    partitionName = get_tract_partition_name(tableName, tract)
+    lower, upper = get_tract_range(tract)
+    tableSpace = config.get_table_space()
+
+    create_string = """
+    CREATE TABLE IF NOT EXISTS "{schemaName}"."{partitionName}"
+    PARTITION OF "{schemaName}"."{tableName}"
+    FOR VALUES FROM ({lower}) TO ({upper})
+    {tableSpace}
+    """.format(**locals())
+
+    if cursor is not None:
+        cursor.execute(create_string)
+    else:
+        print(create_string)
+
+    return partitionName
+
+
+def create_tract_staging(cursor, schemaName, tableName, tract):
+    """
+    Create a table, not yet attached to the partitioned table "tableName",
+    into which to load a tract before attach_tract_partition() is called.
+    Unlike a partition of an indexed table, it has no indexes to be
+    maintained during the load. If the tract's partition has already been
+    attached, it is used as it is.
+    @param cursor
+        DB connection's cursor object
+    @param tract (int)
+        Tract number.
+    @return (str)
+        Name of the table.
+    """
+    partitionName = get_tract_partition_name(tableName, tract)
+    if is_attached(cursor, schemaName, partitionName):
+        return partitionName
+
+    tableSpace = config.get_table_space()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS "{schemaName}"."{partitionName}" (
+        LIKE "{schemaName}"."{tableName}" INCLUDING DEFAULTS
+    )
+    {tableSpace}
+    """.format(**locals())
+    )
+    return partitionName
+
+
+def attach_tract_partition(cursor, schemaName, tableName, tract):
+    """
+    Attach the table made by create_tract_staging() to "tableName"
+    as the partition for "tract". The indexes of "tableName" are built
+    on the new partition only.
+    @param cursor
+        DB connection's cursor object
+    @param tract (int)
+        Tract number.
+    """
+    partitionName = get_tract_partition_name(tableName, tract)
+    if is_attached(cursor, schemaName, partitionName) is not False:
+        return
+
+    lower, upper = get_tract_range(tract)
+
+    # With a CHECK constraint implying the partition bound,
+    # ATTACH PARTITION does not have to scan the table to validate it.
+    cursor.execute("""
+    ALTER TABLE "{schemaName}"."{partitionName}"
+        ALTER COLUMN object_id SET NOT NULL,
+        ADD CONSTRAINT "{partitionName}_bound"
+            CHECK (object_id >= {lower} AND object_id < {upper})
+    """.format(**locals())
+    )
+    cursor.execute("""
+    ALTER TABLE "{schemaName}"."{tableName}"
+    ATTACH PARTITION "{schemaName}"."{partitionName}"
+    FOR VALUES FROM ({lower}) TO ({upper})
+    """.format(**locals())
+    )
+    cursor.execute("""
+    ALTER TABLE "{schemaName}"."{partitionName}"
+    DROP CONSTRAINT "{partitionName}_bound"
+    """.format(**locals())
+    )
 
 class DBTable(object):
     """
@@ -43,6 +217,11 @@ class DBTable(object):
     """
     __slots__ = ["name", "algos", "filters"]
 
+    # True if other tables have foreign keys referencing object_id
+    # of this table, which then needs its primary key (a unique B-tree)
+    # even with config.indexStrategy == "brin"
+    isReferenced = False
+
     def __init__(self, name, algos):
         """
         @param name (str)
@@ -104,25 +283,36 @@ class DBTable(object):
         Create table in the database.
         A primary key "object_id" will be included
         in addition to the fields in the Algo's.
+        If config.partitionByTract, the table is partitioned by range of
+        object_id; create_tract_partition() must be called for every tract
+        before data are inserted.
         @param cursor
             DB connection's cursor object
             If None don't actually write to db; just to stdout
         @param schemaName
             Name of the schema in which to locate the master table
         """
-        members = ['object_id Bigint']
+        columns = [('object_id', 'Bigint')]
 
         for filter in self.filters:
             #filt = common.filterToShortName[filter] + "_" if filter else ""
             filt = filter + "_" if filter else ""
             for algo in self.algos.values():
-                for name, type in algo.get_backend_fields(filt):
-                    members.append("{name}  {type}".format(**locals()))
+                columns.extend(algo.get_backend_fields(filt))
 
+        columns, saved = table_split.align_columns(columns)
+        if saved:
+            print("{}: column order saves {} bytes/row".format(self.name, saved))
+
+        members = ["{name}  {type}".format(**locals()) for name, type in columns]
         members = """,
         """.join(members)
 
-        tableSpace = config.get_table_space()
+        if config.partitionByTract:
+            # The table space is given to each partition instead
+            tableSpace = "PARTITION BY RANGE (object_id)"
+        else:
+            tableSpace = config.get_table_space()
 
         create_string = """
         CREATE TABLE "{schemaName}"."{self.name}" (
@@ -144,23 +334,72 @@ class DBTable(object):
         @param schemaName
             Name of the schema in which to locate the master table
         """
+        for name, statements in self.get_index_jobs(cursor, schemaName):
+            for statement in statements:
+                cursor.execute(statement)
+
+    def get_index_jobs(self, cursor, schemaName):
+        """
+        Get the statements that create indexes on this table.
+        @param cursor
+            DB connection's cursor object, used to inspect the table.
+        @param schemaName
+            Name of the schema in which to locate the master table
+        @return list of (name, statements)
+            "name" is the name of an index. "statements" is a list of SQL
+            statements to be executed in order: the first one builds the
+            index, and the others (if any) are quick ones using the index.
+            Different items in the list are independent of each other.
+        """
         indexSpace = config.get_index_space()
+        jobs = []
 
-        cursor.execute("""
+        if config.indexStrategy in ("brin", "both"):
+            jobs.append(("{self.name}_object_id_brin".format(**locals()), ["""
+            CREATE INDEX IF NOT EXISTS
+                "{self.name}_object_id_brin"
+            ON
+                "{schemaName}"."{self.name}"
+            USING BRIN
+                ( object_id
+                )
+            {brinParams}
+            {indexSpace}
+            """.format(brinParams=get_brin_params(), **locals())
+            ]))
+
+        if config.indexStrategy == "brin" and not self.isReferenced:
+            return jobs
+
+        if is_partitioned(cursor, schemaName, self.name):
+            # "USING INDEX" is not supported by partitioned tables.
+            # The primary key of the parent is propagated to the partitions.
+            if indexSpace:
+                indexSpace = "USING INDEX " + indexSpace
+            return jobs + [("{self.name}_pkey".format(**locals()), ["""
+            ALTER TABLE
+                "{schemaName}"."{self.name}"
+            ADD CONSTRAINT
+                "{self.name}_pkey"
+            PRIMARY KEY (object_id)
+            {indexSpace}
+            """.format(**locals())
+            ])]
+
+        return jobs + [("{self.name}_pkey".format(**locals()), ["""
         CREATE UNIQUE INDEX
             "{self.name}_pkey"
         ON
             "{schemaName}"."{self.name}" (object_id)
         {indexSpace}
-        """.format(**locals())
-        )
-        cursor.execute("""
+        """.format(**locals()),
+        """
         ALTER TABLE
             "{schemaName}"."{self.name}"
         ADD PRIMARY KEY USING INDEX
           "{self.name}_pkey"
         """.format(**locals())
-        )
+        ])]
 
     def drop_index(self, cursor, schemaName):
         """
@@ -171,12 +410,20 @@ class DBTable(object):
             Name of the schema in which to locate the master table
         """
         cursor.execute("""
+        DROP INDEX IF EXISTS
+            "{schemaName}"."{self.name}_object_id_brin"
+        """.format(**locals())
+        )
+        cursor.execute("""
         ALTER TABLE
             "{schemaName}"."{self.name}"
         DROP CONSTRAINT IF EXISTS
           "{self.name}_pkey"
         """.format(**locals())
         )
+        if is_partitioned(cursor, schemaName, self.name):
+            # The partition key cannot be made nullable
+            return
         cursor.execute("""
         ALTER TABLE
             "{schemaName}"."{self.name}"
@@ -205,6 +452,21 @@ class DBTable(object):
         return members
 
 
+    def get_flag_decoders(self):
+        """
+        Get expressions to read flags packed into bitmasks (config.packFlags).
+        @return dict mapping column name (in lower case) that a flag would
+            have if it were not packed -> SQL expression that decodes it.
+        """
+        ret = {}
+        for filter in self.filters:
+            filt = filter + "_" if filter else ""
+            for algo in self.algos.values():
+                for name, (column, bit) in algo.get_packed_flags().items():
+                    ret[(filt + name).lower()] = flagbits.decode_expression(filt + column, bit)
+
+        return ret
+
     def get_exported_fields(self, filter):
         """
         Get field data for the frontend view.
@@ -238,3 +500,11 @@ class DBTable_BandIndependent(DBTable):
             return DBTable.create(self, cursor, schemaName)
         finally:
             self.filters = filters
+
+    def get_flag_decoders(self):
+        filters = self.filters
+        self.filters = [""]
+        try:
+            return DBTable.get_flag_decoders(self)
+        finally:
+            self.filters = filters
@@ -0,0 +1,172 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Index of a two-level directory tree of data files
+(rootdir/<visit dir>/<raft dir>/<file>), such as that of forced sources.
+
+The whole tree is scanned by refresh() with os.scandir in parallel threads,
+and the index can be saved to a local file. When it is loaded again, the
+visit directories are listed, but only the raft directories whose mtime has
+changed (i.e. in which files have been added, removed or renamed) have
+their files listed and stat-ed again. Files rewritten in place do not
+change the mtime of their directory and are not noticed.
+
+Without refresh(), get_visit() scans visit directories one at a time
+as they are asked for.
+"""
+
+import concurrent.futures
+import json
+import os
+import re
+
+from . import misc
+
+# Version of the file format
+indexVersion = 1
+
+
+class DirectoryIndex(object):
+    """
+    Index mapping visit dir -> raft dir -> file name -> (size, mtime).
+    The saved index (if any) is loaded on construction;
+    call refresh() and save() to bring it up to date and keep it.
+    """
+
+    def __init__(self, rootdir, visitdir_re, raft_re, basename_re,
+                 path=None, nThreads=16):
+        """
+        @param rootdir (str)
+            Root directory of the tree.
+        @param visitdir_re, raft_re, basename_re (str)
+            Regular expressions (full match) of names of the visit
+            directories, raft directories, and files.
+        @param path (str)
+            File in which to persist the index. None not to persist it.
+        @param nThreads (int)
+            Number of threads with which to scan directories.
+        """
+        self.rootdir     = rootdir
+        self.visitdir_re = re.compile(visitdir_re)
+        self.raft_re     = re.compile(raft_re)
+        self.basename_re = re.compile(basename_re)
+        self.path        = path
+        self.nThreads    = nThreads
+
+        # visit dir name -> {"mtime": float, "rafts": {raft dir name ->
+        #     {"mtime": float, "files": {file name -> [size, mtime]}}}}
+        self.visits = {}
+
+        self.load()
+
+    def load(self):
+        """
+        Load the index saved in self.path, if any and if it is of the same tree.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            misc.warning("Ignored broken index {}: {}".format(self.path, e))
+            return
+
+        if saved.get("version") == indexVersion \
+        and saved.get("rootdir") == os.path.abspath(self.rootdir):
+            self.visits = saved["visits"]
+
+    def save(self):
+        """
+        Save the index in self.path (if not None).
+        """
+        if not self.path:
+            return
+        tmp = "{}.tmp{}".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({
+                "version": indexVersion,
+                "rootdir": os.path.abspath(self.rootdir),
+                "visits" : self.visits,
+            }, f)
+        os.replace(tmp, self.path)
+
+    def list_visits(self):
+        """
+        @return sorted list of the names of the visit directories
+        """
+        with os.scandir(self.rootdir) as it:
+            return sorted(
+                e.name for e in it
+                if self.visitdir_re.fullmatch(e.name) and e.is_dir()
+            )
+
+    def get_visit(self, name):
+        """
+        @return entry of self.visits for visit directory "name".
+            The directory is scanned if it is not in the index.
+        """
+        visit = self.visits.get(name)
+        if visit is None:
+            visit = self.visits[name] = self._scan_visit(name)
+        return visit
+
+    def refresh(self):
+        """
+        Scan the directories that have been modified since they were indexed.
+        """
+        names = self.list_visits()
+        for name in set(self.visits) - set(names):
+            del self.visits[name]
+
+        # Raft dirs are checked even in unchanged visit dirs,
+        # because files are added to existing raft dirs
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.nThreads) as executor:
+            for name, visit in zip(names, executor.map(self._scan_visit, names)):
+                self.visits[name] = visit
+
+    def _scan_visit(self, name):
+        """
+        @return entry of self.visits for visit directory "name"
+        """
+        old = self.visits.get(name, {"rafts": {}})
+        visitdir = os.path.join(self.rootdir, name)
+        mtime = os.stat(visitdir).st_mtime
+        rafts = {}
+        with os.scandir(visitdir) as it:
+            for e in it:
+                if not (self.raft_re.fullmatch(e.name) and e.is_dir()):
+                    continue
+                raftMtime = e.stat().st_mtime
+                raft = old["rafts"].get(e.name)
+                if raft is None or raft["mtime"] != raftMtime:
+                    raft = {"mtime": raftMtime, "files": self._scan_raft(e.path)}
+                rafts[e.name] = raft
+
+        return {"mtime": mtime, "rafts": rafts}
+
+    def _scan_raft(self, raftdir):
+        """
+        @return dict mapping file name -> [size, mtime]
+        """
+        files = {}
+        with os.scandir(raftdir) as it:
+            for e in it:
+                if self.basename_re.fullmatch(e.name):
+                    st = e.stat()
+                    files[e.name] = [st.st_size, st.st_mtime]
+        return files
@@ -75,12 +75,16 @@ class DpddView(object):
                            for err and flux are in native quantities
                            
                            Allowable values are 1,2 or 3
+    column_map             dict mapping native column name (lower case)
+                           to the SQL expression to be used instead,
+                           e.g. to decode flags packed into bitmasks
     """
     def __init__(self, dbschema, 
                  bands=['g','i','r','u','y','z'], 
                  yaml_path='native_to_dpdd.yaml', pixel_scale=0.2,
-                 yaml_override=None, dm_schema_version=3):
+                 yaml_override=None, dm_schema_version=3, column_map=None):
         self.dbschema = dbschema
+        self.column_map = column_map or {}
         self.yaml_path = yaml_path
         self.yaml_override = yaml_override
         self.dm_schema_version = dm_schema_version
@@ -224,9 +228,22 @@ class DpddView(object):
             for b in self.bands:
                 f = re.sub(r"\{BAND\}",b, asv)
                 #f = asv.format(b, b)
-                asvl += [f]
+                asvl += [self._map_columns(f)]
             return asvl
-        else: return [asv]        
+        else: return [self._map_columns(asv)]
+
+    def _map_columns(self, asv):
+        """
+        Replace native column names in "value AS name" according to
+        self.column_map.
+        """
+        if not self.column_map:
+            return asv
+        value, name = asv.rsplit(' AS ', 1)
+        value = re.sub(r'[A-Za-z_][A-Za-z0-9_]*',
+                       lambda m: self.column_map.get(m.group(0).lower(), m.group(0)),
+                       value)
+        return '{} AS {}'.format(value, name)
         
     def view_string(self):
         dbschema = self.dbschema
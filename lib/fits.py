@@ -27,7 +27,7 @@ import io
 import os
 import re
 
-def fits_open(path, headerOnly = False):
+def fits_open(path, headerOnly = False, rowRange = None):
     """
     Open a FITS file ignoring the 3rd HDU and the latter ignored.
     The primary HDU must be empty.
@@ -37,18 +37,16 @@ def fits_open(path, headerOnly = False):
         The prefix ".gz" will be added automatically by this function.
     @param headerOnly
         Read header only.
+    @param rowRange
+        (start, stop): read only these rows of the table in the 2nd HDU.
+        NAXIS2 in the returned header is modified accordingly.
     @return
         pyfits HDUList object.
     """
     header = b""
     dtype = numpy.dtype([("key", bytes, 8), ("value", bytes, 72)])
 
-    if os.path.exists(path):
-        fin = open(path, "rb")
-    elif os.path.exists(path + ".gz"):
-        fin = gzip.open(path + ".gz", "rb")
-    else:
-        raise RuntimeError("File inaccessible: " + path)
+    fin = _open_raw(path)
 
     # skip primary hdu (which is header-only)
     while True:
@@ -67,27 +65,130 @@ def fits_open(path, headerOnly = False):
             header += memoryview(arr).tobytes()
             if numpy.any(arr["key"] == b'END     '): break
     else:
-        bitpix = None
-        width = None
-        height = None
-        while True:
-            chunk = fin.read(2880)
-            arr = numpy.frombuffer(chunk, dtype=dtype)
-            header += chunk
-
-            arrBitpix = arr["value"][arr["key"] == b'BITPIX  ']
-            arrNaxis1 = arr["value"][arr["key"] == b'NAXIS1  ']
-            arrNaxis2 = arr["value"][arr["key"] == b'NAXIS2  ']
-            if len(arrBitpix) > 0:
-                bitpix = int(re.match(br"^= *(-?[0-9]+)", arrBitpix[-1]).group(1))
-            if len(arrNaxis1) > 0:
-                width  = int(re.match(br"^= *([0-9]+)", arrNaxis1[-1]).group(1))
-            if len(arrNaxis2) > 0:
-                height = int(re.match(br"^= *([0-9]+)", arrNaxis2[-1]).group(1))
+        extStart = len(header)
+        extHeader, rowBytes, height = _read_table_header(fin)
+        header += extHeader
 
-            if numpy.any(arr["key"] == b'END     '): break
+        if rowRange is None:
+            header += fin.read(((rowBytes*height + (2880-1))//2880)*2880)
+        else:
+            start = max(0, min(height, rowRange[0]))
+            stop  = max(start, min(height, rowRange[1]))
 
-        header += fin.read(((abs(bitpix)*width*height + (8*2880-1))//(8*2880))*2880)
+            arr = numpy.copy(numpy.frombuffer(header[extStart:], dtype=dtype))
+            arr["value"][arr["key"] == b'NAXIS2  '] = "= {:20d} / length of data axis 2".format(stop - start).ljust(72).encode()
+            header = header[:extStart] + memoryview(arr).tobytes()
+
+            if start > 0:
+                fin.seek(start * rowBytes, io.SEEK_CUR)
+            data = fin.read((stop - start) * rowBytes)
+            header += data + b"\0" * (-len(data) % 2880)
 
     fin.close()
     return pyfits.open(io.BytesIO(header), uint=True)
+
+
+def fits_open_raw(path, rowRange = None):
+    """
+    Read the header and the raw data of the table in the 2nd HDU
+    without parsing them. The primary HDU must be empty.
+    @param path
+        Path to a FITS file, as in fits_open().
+    @param rowRange
+        (start, stop): read only these rows.
+    @return (header, data, nRows)
+        "header" (bytes) is the header of the 2nd HDU as it is in the file
+        (NAXIS2 is not modified even if rowRange is given).
+        "data" (bytearray) is the big-endian rows, without padding.
+    """
+    with _open_raw(path) as fin:
+        _skip_header(fin)
+        header, rowBytes, height = _read_table_header(fin)
+
+        if rowRange is None:
+            start, stop = 0, height
+        else:
+            start = max(0, min(height, rowRange[0]))
+            stop  = max(start, min(height, rowRange[1]))
+
+        if start > 0:
+            fin.seek(start * rowBytes, io.SEEK_CUR)
+
+        data = bytearray((stop - start) * rowBytes)
+        view = memoryview(data)
+        pos = 0
+        while pos < len(data):
+            n = fin.readinto(view[pos:])
+            if not n:
+                raise RuntimeError("File truncated: " + path)
+            pos += n
+
+    return header, data, stop - start
+
+
+def fits_get_table_shape(path):
+    """
+    Get the shape of the table in the 2nd HDU of a FITS file
+    reading only the headers.
+    @param path
+        Path to a FITS file, as in fits_open().
+    @return
+        (NAXIS1, NAXIS2) = (bytes per row, number of rows).
+    """
+    with _open_raw(path) as fin:
+        _skip_header(fin)
+        header, width, height = _read_table_header(fin)
+
+    return width, height
+
+
+def _skip_header(fin):
+    """
+    Skip a header from the current position of "fin".
+    """
+    dtype = numpy.dtype([("key", bytes, 8), ("value", bytes, 72)])
+    while True:
+        arr = numpy.frombuffer(fin.read(2880), dtype=dtype)
+        if len(arr) == 0 or numpy.any(arr["key"] == b'END     '): break
+
+
+def _read_table_header(fin):
+    """
+    Read a header of a binary table from the current position of "fin".
+    @return (header: bytes, rowBytes: int, nRows: int)
+    """
+    header = b""
+    dtype = numpy.dtype([("key", bytes, 8), ("value", bytes, 72)])
+    bitpix = None
+    width = None
+    height = None
+    while True:
+        chunk = fin.read(2880)
+        arr = numpy.frombuffer(chunk, dtype=dtype)
+        header += chunk
+
+        arrBitpix = arr["value"][arr["key"] == b'BITPIX  ']
+        arrNaxis1 = arr["value"][arr["key"] == b'NAXIS1  ']
+        arrNaxis2 = arr["value"][arr["key"] == b'NAXIS2  ']
+        if len(arrBitpix) > 0:
+            bitpix = int(re.match(br"^= *(-?[0-9]+)", arrBitpix[-1]).group(1))
+        if len(arrNaxis1) > 0:
+            width  = int(re.match(br"^= *([0-9]+)", arrNaxis1[-1]).group(1))
+        if len(arrNaxis2) > 0:
+            height = int(re.match(br"^= *([0-9]+)", arrNaxis2[-1]).group(1))
+
+        if len(arr) == 0 or numpy.any(arr["key"] == b'END     '): break
+
+    return header, abs(bitpix)*width // 8, height
+
+
+def _open_raw(path):
+    """
+    Open "path" or "path.gz" for binary reading.
+    """
+    if os.path.exists(path):
+        return open(path, "rb")
+    elif os.path.exists(path + ".gz"):
+        return gzip.open(path + ".gz", "rb")
+    else:
+        raise RuntimeError("File inaccessible: " + path)
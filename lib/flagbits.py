@@ -0,0 +1,116 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Packing of Boolean flags into Bigint bitmasks (config.packFlags).
+The flags of an Algo (e.g. all base_PixelFlags_flag_*) are stored in
+columns "{family}_flagbits{k}", 63 flags per column, bit i of column k
+holding flag 63*k + i. Views decode them with decode_expression().
+"""
+
+import numpy
+
+from . import config
+from . import sourcetable
+
+# Bits per Bigint column. The sign bit is not used.
+bitsPerColumn = 63
+
+# Flags that are never packed, because they are used in indexes or WHERE clauses
+unpacked = ["detect_isprimary"]
+
+
+def get_column_name(family, k):
+    """
+    @param family (str)
+        Name of the flag family (the Algo name, e.g. "base_PixelFlags").
+    @param k (int)
+        Index of the column in the family.
+    @return (str)
+    """
+    return "{}_flagbits{}".format(family, k)
+
+
+def select_flags(fields):
+    """
+    @param fields
+        List of scalar Fields (exploded) of an Algo.
+    @return
+        List of names of the Fields to be packed. Empty if packing is
+        disabled or the family has fewer than config.packFlagsMin flags.
+    """
+    if not config.packFlags:
+        return []
+
+    names = [
+        f.name for f in fields
+        if f.data.dtype.name == 'bool' and f.name.lower() not in unpacked
+    ]
+    if len(names) < config.packFlagsMin:
+        return []
+    return names
+
+
+def pack(family, flags):
+    """
+    Pack flags into bitmask Fields.
+    @param family (str)
+        Name of the flag family.
+    @param flags
+        List of Fields whose data are numpy.array of bool.
+    @return
+        List of (Field of Bigint, [flag names in bit order]).
+    """
+    ret = []
+    for k in range(0, len(flags), bitsPerColumn):
+        chunk = flags[k:k+bitsPerColumn]
+        data = numpy.zeros(len(chunk[0].data), dtype=numpy.int64)
+        for i, f in enumerate(chunk):
+            data |= f.data.astype(numpy.int64) << i
+        names = [f.name for f in chunk]
+        field = sourcetable.Field(
+            get_column_name(family, k // bitsPerColumn), "Scalar", "", data,
+            "Bitmask of flags: " + ", ".join(names), None
+        )
+        ret.append((field, names))
+    return ret
+
+
+def get_bit_positions(family, names):
+    """
+    @param family (str)
+        Name of the flag family.
+    @param names
+        Names of the flags packed by pack(), in the same order.
+    @return
+        dict mapping flag name -> (column name, bit).
+    """
+    return dict(
+        (name, (get_column_name(family, i // bitsPerColumn), i % bitsPerColumn))
+        for i, name in enumerate(names)
+    )
+
+
+def decode_expression(column, bit):
+    """
+    SQL expression that extracts a flag as Boolean.
+    It is simple enough to be inlined by the planner.
+    @param column (str)
+        Name (possibly qualified) of the bitmask column.
+    @param bit (int)
+    @return (str)
+    """
+    return "(({} & {}::Bigint) <> 0)".format(column, 1 << bit)
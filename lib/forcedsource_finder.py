@@ -18,6 +18,7 @@ import re
 import os,sys
 
 from  .finderbase import Finder
+from .dir_index import DirectoryIndex
 
 class ForcedSourceFinder(Finder):
     """
@@ -34,7 +35,8 @@ class ForcedSourceFinder(Finder):
      
     """
 
-    def __init__(self, rootdir, min_len=46080, dm_version=""):
+    def __init__(self, rootdir, min_len=46080, dm_version="",
+                 index_path=None):
         """
         Parameters
         ----------
@@ -46,6 +48,9 @@ class ForcedSourceFinder(Finder):
         db_version : str
             Ignored for now.  Could be used to select form of file
             hierarchy and naming conventions appropriate to a data set
+        index_path : str
+            If not None, file in which to keep the index of the file
+            hierarchy (see lib/dir_index.py) between runs
         """
         self.rootdir = rootdir
         self.dm_version = ""
@@ -68,8 +73,69 @@ class ForcedSourceFinder(Finder):
         # Files of this length have no data
         self.min_len = min_len
 
-        # Convenience to avoid recalculating
-        self.__subdirs = []
+        self.index_path = index_path
+
+        # DirectoryIndex of the file hierarchy, and lookup tables derived
+        # from it. The visits are listed on first use. Without index_path,
+        # the files of each visit are listed when the visit is asked for.
+        self.__index = None
+        #   visit -> visit dir name
+        self.__visitdirs = None
+        #   visit -> [(path, size)] sorted by path
+        self.__visitfiles = {}
+        #   (visit, raft, sensor) -> path, e.g. (159479, 'R01', 'S20')
+        self.__files = {}
+        #   path -> size
+        self.__sizes = {}
+
+    def __list_visits(self):
+        """
+        Find the visit directories. With index_path, the whole index
+        is built (or refreshed) and saved.
+        """
+        if self.__visitdirs is not None:
+            return
+
+        index = DirectoryIndex(self.rootdir, self.visitdir_re, self.raft_re,
+                               self.basename_re, path=self.index_path)
+        if self.index_path:
+            index.refresh()
+            index.save()
+            names = sorted(index.visits)
+        else:
+            names = index.list_visits()
+
+        self.__index = index
+        self.__visitdirs = dict(
+            (int(re.fullmatch(self.visitdir_re, name).group(1)), name)
+            for name in names
+        )
+
+    def __load_visit(self, visit):
+        """
+        Fill the lookup tables with the files of a visit.
+        @return [(path, size)] sorted by path
+        """
+        self.__list_visits()
+        vfiles = self.__visitfiles.get(visit)
+        if vfiles is not None:
+            return vfiles
+
+        vfiles = []
+        visit_dir = self.__visitdirs.get(visit)
+        if visit_dir is not None:
+            entry = self.__index.get_visit(visit_dir)
+            for raft, raft_entry in entry["rafts"].items():
+                for f, (size, mtime) in raft_entry["files"].items():
+                    path = os.path.join(self.rootdir, visit_dir, raft, f)
+                    sensor = 'S' + re.fullmatch(self.basename_re, f).group(3)
+                    self.__files[(visit, raft, sensor)] = path
+                    self.__sizes[path] = size
+                    vfiles.append((path, size))
+        vfiles.sort()
+
+        self.__visitfiles[visit] = vfiles
+        return vfiles
 
     def get_determiners(self) :
         """
@@ -96,13 +162,11 @@ class ForcedSourceFinder(Finder):
             
         """
         fbase = os.path.basename(filepath)
-        print('get_determiner_dict:  basename ', fbase)
         m = re.fullmatch(self.basename_re, fbase)
         if m:
             d = {'visit' : m.group(1),
                  'raft' : m.group(2),
                  'sensor' : m.group(3)}
-            print('Found visit ', d['visit'])
             return d
         raise ValueError('get_determiner_dict: bad filepath argument ' + filepath)
 
@@ -128,14 +192,8 @@ class ForcedSourceFinder(Finder):
             if sensor is not None:
                 if re.fullmatch(self.ccd_re, sensor) is None:
                     raise ValueError("get_file_path: bad sensor argument: " + str(sensor))
-        visitstr = '{:08}'.format(visit)
-        if len(self.__subdirs) == 0:
-            self.__subdirs = os.listdir(self.rootdir)
-        visit_dir = None
-        for s in self.__subdirs:
-            if re.match(visitstr, s):
-                visit_dir = s
-                break
+        self.__list_visits()
+        visit_dir = self.__visitdirs.get(visit)
         if visit_dir is None: return None
         if raft is None:     # Only asked for visit directory
             return os.path.join(self.rootdir, visit_dir)
@@ -143,13 +201,8 @@ class ForcedSourceFinder(Finder):
         raft_dir = os.path.join(self.rootdir,visit_dir, raft)
         if sensor is None:
             return raft_dir
-        files = os.listdir(raft_dir)
-        for f in files:
-            starts_with = self.basename_fmt.format(visit_dir, raft, sensor)
-            if re.match(starts_with, f) and re.fullmatch(self.basename_re, f):
-                return os.path.join(raft_dir, f)
-
-        return None
+        self.__load_visit(visit)
+        return self.__files.get((visit, raft, sensor))
 
     def get_some_file(self) :
         """
@@ -160,24 +213,14 @@ class ForcedSourceFinder(Finder):
         tuple of full file path (str) and dict of determiners
         """
 
-        if len(self.__subdirs) == 0:
-            self.__subdirs = os.listdir(self.rootdir)
-        for v in self.__subdirs:
-            visit = v[:-2]    # strip off filter
-            visit_dir = os.path.join(self.rootdir, v)
-            rdirs = os.listdir(visit_dir)
-            for r in rdirs:
-                if re.fullmatch(self.raft_re, r):
-                    raft = r[1:]
-                    fs = os.listdir(os.path.join(visit_dir, r))
-                    for f in fs:
-                        #print('Found a file ', f)
-                        m = re.fullmatch(self.basename_re, f)
-                        if m:
-                            d = {'visit' : m.group(1),
-                                 'raft' : m.group(2),
-                                 'sensor' : m.group(3)}
-                            return os.path.join(visit_dir, r, f), d
+        self.__list_visits()
+        for visit in sorted(self.__visitdirs):
+            for path, size in self.__load_visit(visit):
+                m = re.fullmatch(self.basename_re, os.path.basename(path))
+                d = {'visit' : m.group(1),
+                     'raft' : m.group(2),
+                     'sensor' : m.group(3)}
+                return path, d
                 
         return None
 
@@ -197,22 +240,20 @@ class ForcedSourceFinder(Finder):
         -------
         list of full filepaths (strings)
         """
-        visitdir = self.get_file_path(visit)
-        if visitdir is None: 
-            return []
-        print('File path for visit ', visit, ' is: ', visitdir)
-        files = []
-        for d in os.listdir(visitdir):
-            if re.fullmatch(self.raft_re, d):
-                rdir = os.path.join(visitdir, d)
-                print('Found raft dir ',rdir)
-                for f in os.listdir(rdir):
-                    if re.fullmatch(self.basename_re, f):
-                        if nonempty:
-                            s = os.stat(os.path.join(rdir,f))
-                            if (s.st_size <= self.min_len) : continue
-                        files.append(os.path.join(rdir, f))
-        return files
+        return [
+            path for path, size in self.__load_visit(visit)
+            if not (nonempty and size <= self.min_len)
+        ]
+
+    def is_empty(self, filepath):
+        """
+        Return True if the file is of the minimum size set at
+        initialization (or smaller), which indicates it has no data.
+        """
+        size = self.__sizes.get(filepath)
+        if size is None:
+            size = os.stat(filepath).st_size
+        return size <= self.min_len
 
     def get_visits(self):
         """   
@@ -221,11 +262,5 @@ class ForcedSourceFinder(Finder):
         sorted list of ints, identifying visits
 
         """
-        if len(self.__subdirs) == 0:
-            self.__subdirs = os.listdir(self.rootdir)
-        visits = []
-        for v in self.__subdirs:
-            visits.append(int(v[:-2])) # strip off filter
-
-        visits.sort()
-        return visits
+        self.__list_visits()
+        return sorted(self.__visitdirs)
@@ -0,0 +1,185 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Build indexes in parallel over several DB connections.
+
+A job is (table, name, statements), where (name, statements) is an item
+returned by DBTable.get_index_jobs(). The first element of "statements"
+(the index build) is run concurrently with the other jobs, those on the
+largest tables first. It is a statement, or a list of statements run one
+after another in the same session (e.g. CLUSTER and then ANALYZE).
+The remaining statements (e.g. ALTER TABLE ADD PRIMARY KEY USING INDEX)
+are quick but lock the table exclusively, which would stall the other
+builds on the table; they are run after all builds have finished.
+The builds run in autocommit mode, so they may be CREATE INDEX CONCURRENTLY.
+"""
+
+import queue
+import threading
+import time
+
+import psycopg2
+
+from . import common
+from . import config
+
+
+def build_indexes(jobs, nConnections=None, memory=None, parallelWorkers=None, out=None):
+    """
+    Execute index jobs concurrently.
+    @param jobs
+        List of (table, name, statements).
+        "table" is '"schema"."table"' on which the index is built.
+        "statements[0]" (a statement or a list of statements) is run
+        concurrently, and "statements[1:]" serially afterwards.
+    @param nConnections (int)
+        Number of concurrent sessions. Default: config.indexJobs
+    @param memory (int)
+        Total bytes of maintenance_work_mem for all sessions.
+        Each session is given memory / nConnections.
+        Default: config.indexMemory (0 means the server's setting).
+    @param parallelWorkers (int)
+        max_parallel_maintenance_workers of each session (PostgreSQL >= 11).
+        Default: config.indexParallelWorkers (None means the server's setting).
+    @param out
+        File to which to print the durations. Default: stdout.
+    @return
+        List of (name, seconds) of the builds in the order of completion.
+    """
+    if nConnections is None: nConnections = config.indexJobs
+    if memory is None: memory = config.indexMemory
+    if parallelWorkers is None: parallelWorkers = config.indexParallelWorkers
+
+    nConnections = max(1, min(nConnections, len(jobs)))
+    settings = []
+    if memory:
+        settings.append("SET maintenance_work_mem = '{}kB'".format(max(1024, memory // nConnections // 1024)))
+    if parallelWorkers is not None:
+        settings.append("SET max_parallel_maintenance_workers = {}".format(int(parallelWorkers)))
+
+    jobs = sort_by_table_size(jobs)
+
+    todo = queue.Queue()
+    for job in jobs:
+        todo.put(job)
+
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        db = common.new_db_connection()
+        db.autocommit = True
+        try:
+            with db.cursor() as cursor:
+                for setting in settings:
+                    cursor.execute(setting)
+                db.commit()
+                while True:
+                    try:
+                        table, name, statements = todo.get_nowait()
+                    except queue.Empty:
+                        break
+                    start = time.perf_counter()
+                    try:
+                        for statement in _get_concurrent_statements(statements):
+                            cursor.execute(statement)
+                    except psycopg2.Error as e:
+                        db.rollback()
+                        with lock:
+                            errors.append((name, str(e).strip()))
+                        continue
+                    seconds = time.perf_counter() - start
+                    with lock:
+                        results.append((name, seconds))
+                        print("{:48} {:10.1f} sec {:>12}".format(
+                            name, seconds, "({}/{})".format(len(results), len(jobs))),
+                            file=out, flush=True)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=worker) for i in range(nConnections)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = set(name for name, error in errors)
+    db = common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            for table, name, statements in jobs:
+                if name in failed:
+                    continue
+                try:
+                    for statement in statements[1:]:
+                        cursor.execute(statement)
+                    db.commit()
+                except psycopg2.Error as e:
+                    db.rollback()
+                    errors.append((name, str(e).strip()))
+    finally:
+        db.close()
+
+    print("{:48} {:10.1f} sec ({} indexes, {} connections)".format(
+        "total", time.perf_counter() - start, len(results), nConnections), file=out)
+
+    if errors:
+        raise RuntimeError("Failed to create indexes:\n" + "\n".join(
+            "{}: {}".format(name, error) for name, error in errors))
+
+    return results
+
+
+def _get_concurrent_statements(statements):
+    """
+    @param statements
+        Statements of a job (see build_indexes()).
+    @return list of the statements to be run concurrently
+    """
+    if isinstance(statements[0], str):
+        return [statements[0]]
+    return list(statements[0])
+
+
+def sort_by_table_size(jobs):
+    """
+    Sort jobs by the size of their tables (largest first),
+    so that the longest builds do not start last.
+    @param jobs
+        List of (table, name, statements).
+    """
+    tables = sorted(set(table for table, name, statements in jobs))
+    sizes = {}
+    db = common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            for table in tables:
+                # Partitioned tables have their data in the children
+                cursor.execute("""
+                SELECT pg_total_relation_size(%(table)s::regclass) + COALESCE((
+                    SELECT sum(pg_total_relation_size(inhrelid))
+                    FROM pg_inherits WHERE inhparent = %(table)s::regclass
+                ), 0)
+                """, {"table": table}
+                )
+                sizes[table] = cursor.fetchone()[0]
+    finally:
+        db.close()
+
+    return sorted(jobs, key=lambda job: -sizes[job[0]])
@@ -0,0 +1,336 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compiled mapping from the columns of a catalog file to DBTables.
+
+Building DBTables from a catalog (SourceTable.from_hdu, cutout_subtable for
+every Algo, Algo.transform) derives the same column -> table mapping for every
+file with the same schema. IngestPlan derives it once, by running the builder
+on a table with no rows, and then applies it to the raw rows of each file:
+
+    header, data, nRows = fits.fits_open_raw(path)
+    plan = get_plan(path, header, build, algoclasses)
+    dbtables, columns = plan.execute(data, nRows, ["id"])
+
+An Algo is "static" if its fields are columns of the file moved unchanged
+into it and its transform() changes nothing but dtypes. A static Algo is
+constructed by Algo.from_static() from its own fields alone, which are sliced
+from the rows and converted to the dtypes recorded in the plan. Other Algos
+(e.g. ref_coord, which computes new fields) are constructed from the columns
+they saw at compile time.
+In both cases the resulting DBTables are equivalent to those of the builder,
+and DBTable.transform() must still be called on them.
+"""
+
+import re
+import threading
+
+import numpy
+
+from . import fits
+from . import sourcetable
+from .misc import PoppingOrderedDict
+
+# Header keywords that determine the layout of the rows
+_signatureKeys = re.compile(
+    br"^(TFIELDS |NAXIS1  |FLAGCOL |ALIAS   |AFW_TABLE_VERSION|T(TYPE|FORM|CCLS|FLAG|ZERO|SCAL|DIM)[0-9]+ *=)"
+)
+
+_formatToDtype = {
+    'L': 'i1',
+    'B': 'u1',
+    'I': '>i2',
+    'J': '>i4',
+    'K': '>i8',
+    'E': '>f4',
+    'D': '>f8',
+}
+
+_plans = {}
+_plansLock = threading.Lock()
+
+
+def get_signature(header):
+    """
+    @param header (bytes)
+        Header of the 2nd HDU, as returned by fits.fits_open_raw().
+    @return (bytes)
+        Cards of the header that determine the row layout and the fields.
+    """
+    return b"".join(
+        header[i:i+80] for i in range(0, len(header), 80)
+        if _signatureKeys.match(header[i:i+80])
+    )
+
+
+def get_plan(path, header, build, algoclasses):
+    """
+    Get the plan for a file, compiling it on the first call
+    for each signature. This function is thread-safe.
+    @param path (str)
+        Path to the file.
+    @param header (bytes)
+        Header of the 2nd HDU, as returned by fits.fits_open_raw().
+    @param build
+        Function (table: SourceTable, algoclasses, path: str)
+        -> PoppingOrderedDict of name -> DBTable,
+        which constructs algos by calling algoclasses[name](table).
+    @param algoclasses (PoppingOrderedDict)
+        Mapping from algo name to Algo class.
+    @return
+        IngestPlan, or None if the file is not supported
+        (and so must be read by SourceTable.from_hdu).
+    """
+    key = (build, id(algoclasses), get_signature(header))
+    with _plansLock:
+        if key not in _plans:
+            _plans[key] = IngestPlan.compile(path, build, algoclasses)
+        return _plans[key]
+
+
+class _Recorder(object):
+    """
+    Stand-in for an Algo class that records the fields it is given.
+    """
+
+    def __init__(self, algoclass):
+        self.algoclass = algoclass
+        self.available = None
+
+    def __call__(self, table):
+        self.available = list(table.fields.keys())
+        return self.algoclass(table)
+
+
+class IngestPlan(object):
+    """
+    Mapping from the columns of a catalog file to DBTables.
+    Use get_plan() to get an instance.
+    """
+
+    def __init__(self, dtype, sources, templates, tables, slots, fitsheader):
+        """
+        @param dtype (numpy.dtype)
+            Dtype of a row.
+        @param sources (dict)
+            Field key -> (column name, flag index or None).
+        @param templates (dict)
+            Field key -> Field with empty data, as made by from_hdu().
+        @param tables
+            List of (name, dbtable_class, algos) where "algos" is a list of
+            (algo name, algo class, entries, available).
+            For static algos, "entries" is a list of
+            (key, Field with empty data, dtype after transform);
+            "available" is a list of keys given to the constructor
+            of non-static algos.
+        @param slots
+        @param fitsheader
+            Those of the SourceTable used in the compilation.
+        """
+        self.dtype      = dtype
+        self.sources    = sources
+        self.templates  = templates
+        self.tables     = tables
+        self.slots      = slots
+        self.fitsheader = fitsheader
+
+    def dm_schema_version(self):
+        """
+        @return Value of 'AFW_TABLE_VERSION' keyword, or None
+        """
+        return self.fitsheader.get("AFW_TABLE_VERSION", None)
+
+    @staticmethod
+    def compile(path, build, algoclasses):
+        """
+        Compile a plan from the header of "path".
+        @return IngestPlan, or None if the file is not supported.
+        """
+        hdu = fits.fits_open(path, headerOnly=True)[1]
+        header = hdu.header
+
+        dtype, sources = _get_row_layout(header)
+        if dtype is None:
+            return None
+
+        table = sourcetable.SourceTable.from_hdu(hdu)
+        templates = dict(table.fields)
+
+        recorders = PoppingOrderedDict(
+            (name, _Recorder(algoclass)) for name, algoclass in algoclasses.items()
+        )
+        dbtables = build(table, recorders, path)
+
+        tables = []
+        for dbtable in dbtables.values():
+            algos = []
+            for name, algo in dbtable.algos.items():
+                entries = _get_static_entries(algo, templates, table)
+                algos.append((name, type(algo), entries, recorders[name].available))
+            tables.append((dbtable.name, type(dbtable), algos))
+
+        return IngestPlan(dtype, sources, templates, tables, table.slots, header)
+
+    def execute(self, data, nRows, keys=()):
+        """
+        Apply the plan to raw rows.
+        @param data (bytearray)
+            Rows as returned by fits.fits_open_raw().
+            It must be writable because some algos modify columns in place.
+        @param nRows (int)
+            Number of rows.
+        @param keys (list of str)
+            Keys of fields whose (unconverted) data are to be returned.
+        @return (dbtables, columns)
+            "dbtables" is PoppingOrderedDict mapping name -> DBTable.
+            "columns" is a list of numpy.array corresponding to "keys".
+        """
+        rows = numpy.frombuffer(data, dtype=self.dtype, count=nRows)
+        cache = {}
+
+        def column(key):
+            source = self.sources[key]
+            if source not in cache:
+                name, iFlag = source
+                if iFlag is None:
+                    arr = rows[name]
+                    if self.dtype[name].base == numpy.dtype('i1'):
+                        arr = (arr == ord('T'))
+                    cache[source] = arr
+                else:
+                    flags = cache.get((name, "bits"))
+                    if flags is None:
+                        flags = cache[(name, "bits")] = numpy.unpackbits(rows[name], axis=1).astype(bool)
+                    cache[source] = flags[:, iFlag]
+            return cache[source]
+
+        dbtables = PoppingOrderedDict()
+        for tableName, dbtable_class, algoDescs in self.tables:
+            algos = PoppingOrderedDict()
+            for name, algoclass, entries, available in algoDescs:
+                if entries is not None:
+                    fields = PoppingOrderedDict()
+                    for key, template, dtype in entries:
+                        arr = column(key)
+                        if arr.dtype.name != dtype.name:
+                            arr = arr.astype(dtype)
+                        fields[key] = template._replace(data=arr)
+                    algo = algoclass.from_static(sourcetable.SourceTable(fields, self.slots, self.fitsheader))
+                else:
+                    fields = PoppingOrderedDict(
+                        (key, self.templates[key]._replace(data=column(key)))
+                        for key in available
+                    )
+                    algo = algoclass(sourcetable.SourceTable(fields, self.slots, self.fitsheader))
+                algos[name] = algo
+            dbtables[tableName] = dbtable_class(tableName, algos)
+
+        return dbtables, [column(key) for key in keys]
+
+
+def _get_row_layout(header):
+    """
+    Get the dtype of a row, and where every field of SourceTable.from_hdu()
+    is in the row.
+    @return (dtype, sources)
+        "sources" maps field key -> (column name, flag index or None).
+        (None, None) if the layout is not supported.
+    """
+    for key in header.keys():
+        if re.match(r"^T(ZERO|SCAL|DIM)[0-9]+$", key):
+            return None, None
+
+    iFlag = header.get("FLAGCOL", None)
+    descr = []
+    sources = {}
+    for i in range(1, 1+header["TFIELDS"]):
+        name = header.get("TTYPE{}".format(i), "")
+        m = re.match(r"^([0-9]*)([A-Z])$", header["TFORM{}".format(i)])
+        if not m:
+            return None, None
+        repeat = int(m.group(1) or "1")
+        code = m.group(2)
+
+        if code == 'X':
+            descr.append((name, 'u1', ((repeat + 7) // 8,)))
+        elif code in _formatToDtype:
+            if repeat == 1:
+                descr.append((name, _formatToDtype[code]))
+            else:
+                descr.append((name, _formatToDtype[code], (repeat,)))
+        else:
+            return None, None
+
+        if i != iFlag:
+            sources[name] = (name, None)
+
+    if iFlag is not None:
+        flagName = header.get("TTYPE{}".format(iFlag), "")
+        nFlags = int(re.match(r'^([0-9]+)X$', header["TFORM{}".format(iFlag)]).group(1))
+        for i in range(1, 1+nFlags):
+            sources[header.get("TFLAG{}".format(i), "")] = (flagName, i-1)
+
+    for key, value in header.items():
+        if key == "ALIAS":
+            reference, referend = value.split(':')
+            if not reference.startswith("slot_"):
+                sources[reference] = sources[referend]
+
+    dtype = numpy.dtype(descr)
+    if dtype.itemsize != header["NAXIS1"]:
+        return None, None
+
+    return dtype, sources
+
+
+def _get_static_entries(algo, templates, table):
+    """
+    Examine an algo constructed at compile time.
+    @param table (SourceTable)
+        The table from which the algo was constructed.
+    @return
+        List of (key, Field, dtype after transform) if the algo is static,
+        otherwise None.
+    """
+    before = list(algo.sourceTable.fields.items())
+    for key, field in before:
+        if templates.get(key) is not field:
+            return None
+
+    try:
+        algo.transform(None, None, None, None, None)
+    except Exception:
+        return None
+
+    after = list(algo.sourceTable.fields.items())
+    if [key for key, _ in after] != [key for key, _ in before]:
+        return None
+
+    entries = []
+    for (key, f1), (_, f2) in zip(before, after):
+        if f1._replace(data=None) != f2._replace(data=None):
+            return None
+        entries.append((key, f1, f2.data.dtype))
+
+    # The algo must be constructed again from these fields alone
+    fields = PoppingOrderedDict((key, field) for key, field in before)
+    try:
+        type(algo).from_static(sourcetable.SourceTable(fields, table.slots, table.fitsheader))
+    except Exception:
+        return None
+
+    return entries
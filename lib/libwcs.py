@@ -17,6 +17,7 @@
 
 import numpy
 
+from . import config
 from . import misc
 from . import fits
 
@@ -132,10 +133,8 @@ class Wcs(object):
         @param dec
             dec of a galaxy (or galaxies)
         @return
-            WcsJacobian([
-              [ J11, J12 ],
-              [ J21, J22 ],
-            ])
+            WcsJacobian of an array J of shape ra.shape + (2, 2):
+            J[..., i, j] = d(sky_i) / d(x_j)
         """
         ra  = numpy.asarray(ra , dtype=float) * (numpy.pi / 180.0)
         dec = numpy.asarray(dec, dtype=float) * (numpy.pi / 180.0)
@@ -144,23 +143,16 @@ class Wcs(object):
 
         t_t0 = numpy.sum(t * t0, axis = -1)
 
-        J11 = t_t0 * numpy.sum(e1 * e10, axis = -1)
-        J12 = t_t0 * numpy.sum(e1 * e20, axis = -1)
-        J21 = t_t0 * numpy.sum(e2 * e10, axis = -1)
-        J22 = t_t0 * numpy.sum(e2 * e20, axis = -1)
+        J = numpy.empty(shape=t_t0.shape + (2, 2), dtype=float)
+        J[..., 0, 0] = t_t0 * numpy.sum(e1 * e10, axis = -1)
+        J[..., 0, 1] = t_t0 * numpy.sum(e1 * e20, axis = -1)
+        J[..., 1, 0] = t_t0 * numpy.sum(e2 * e10, axis = -1)
+        J[..., 1, 1] = t_t0 * numpy.sum(e2 * e20, axis = -1)
 
         # The above Jacobian is dSky / dIWC
         # but we need is dSky / dPix = (dSky/dIWC) * (dIWC/dPix)
 
-        Jp11 = J11*self.cd[0,0] + J12*self.cd[1,0]
-        Jp12 = J11*self.cd[0,1] + J12*self.cd[1,1]
-        Jp21 = J21*self.cd[0,0] + J22*self.cd[1,0]
-        Jp22 = J21*self.cd[0,1] + J22*self.cd[1,1]
-
-        return WcsJacobian([
-            [ Jp11, Jp12 ],
-            [ Jp21, Jp22 ],
-        ])
+        return WcsJacobian(numpy.matmul(J, self.cd))
 
     @staticmethod
     def pixeltosky_get_tangential_basis(ra, dec):
@@ -204,21 +196,105 @@ class Wcs(object):
 class WcsJacobian(object):
     def __init__(self, jacobian):
         """
-        @param jacobian: jacobian[i][j] = d(sky_i) / d(x_j)
+        @param jacobian: array of shape (..., 2, 2):
+            jacobian[..., i, j] = d(sky_i) / d(x_j)
             Here "sky" is the coord on the tangential plane.
-            For each i,j; jacobian[i][j] is a numpy array.
+            A nested list [[J11, J12], [J21, J22]] of arrays is also accepted.
+        """
+        if isinstance(jacobian, (list, tuple)):
+            jacobian = numpy.moveaxis(numpy.asarray(jacobian, dtype=float), (0, 1), (-2, -1))
+
+        self.J = numpy.asarray(jacobian, dtype=float)
+        self.shape = self.J.shape[:-2]
+
+        # The conversions are always computed in double precision:
+        # components such as the covariance of xx and xy cancel between
+        # terms, and single-precision arithmetic would make their relative
+        # errors as large as 1e-4. With config.wcsSinglePrecision,
+        # the results are rounded once to single precision as they are
+        # written, which is as precise as the Real columns they go to.
+        self.dtype = numpy.float32 if config.wcsSinglePrecision else numpy.float64
+
+        # outIsArcsec -> (j, m) (See __get_transform())
+        self.__transforms = {}
+
+    def __get_transform(self, outIsArcsec):
+        """
+        @return (j, m)
+            j[i, k] = J[..., i, k] (multiplied by arcsec/radian if outIsArcsec),
+            and m[i, k] is the matrix such that
+                (J T J^T)_i = sum_k m[i, k] T_k
+            for every symmetric tensor T whose components are
+            T_0 = T_xx, T_1 = T_yy, T_2 = T_xy.
+            They are contiguous float64 arrays of shape (2, 2) + self.shape
+            and (3, 3) + self.shape respectively.
+        """
+        transform = self.__transforms.get(outIsArcsec)
+        if transform is not None:
+            return transform
+
+        scale = 180.0*3600.0 / numpy.pi if outIsArcsec else 1.0
+
+        j = numpy.empty(shape=(2, 2) + self.shape, dtype=float)
+        for i in range(2):
+            for k in range(2):
+                numpy.multiply(self.J[..., i, k], scale, out=j[i, k, ...])
+
+        (a, b), (c, d) = j
+
+        # With J = [[a, b], [c, d]],
+        #   (J T J^T)_xx = a^2 T_xx + b^2 T_yy + 2ab T_xy
+        #   (J T J^T)_yy = c^2 T_xx + d^2 T_yy + 2cd T_xy
+        #   (J T J^T)_xy = ac  T_xx + bd  T_yy + (ad + bc) T_xy
+        m = numpy.empty(shape=(3, 3) + self.shape, dtype=float)
+        numpy.multiply(a, a, out=m[0, 0, ...])
+        numpy.multiply(b, b, out=m[0, 1, ...])
+        numpy.multiply(a, b, out=m[0, 2, ...])
+        m[0, 2, ...] *= 2.0
+        numpy.multiply(c, c, out=m[1, 0, ...])
+        numpy.multiply(d, d, out=m[1, 1, ...])
+        numpy.multiply(c, d, out=m[1, 2, ...])
+        m[1, 2, ...] *= 2.0
+        numpy.multiply(a, c, out=m[2, 0, ...])
+        numpy.multiply(b, d, out=m[2, 1, ...])
+        numpy.multiply(a, d, out=m[2, 2, ...])
+        m[2, 2, ...] += b * c
+
+        transform = self.__transforms[outIsArcsec] = (j, m)
+        return transform
+
+    def __empty(self, dtype=None):
+        return numpy.empty(shape=self.shape, dtype=dtype or self.dtype)
+
+    def __get_accumulator(self):
         """
-        self.J = jacobian
+        @return float64 work array in which to sum products when the
+            results are of lower precision (see _sum_of_products()),
+            or None to sum them in the results.
+        """
+        return None if self.dtype == numpy.float64 else self.__empty(float)
+
+    def __transform_tensor(self, t_xx, t_yy, t_xy, outIsArcsec, dtype=None):
+        """
+        Transform a symmetric tensor T to J T J^T
+        @param dtype
+            dtype of the results. Default: self.dtype
+        @return (xx, yy, xy) components of J T J^T
+        """
+        j, m = self.__get_transform(outIsArcsec)
+        t = [numpy.asarray(t_xx, dtype=float), numpy.asarray(t_yy, dtype=float), numpy.asarray(t_xy, dtype=float)]
+        tmp = self.__empty(float)
+        acc = None if dtype == float else self.__get_accumulator()
+
+        return tuple(_sum_of_products(self.__empty(dtype), tmp, m[i], t, acc) for i in range(3))
 
     def pixel_scale(self, outIsArcsec=True):
         """
         Get pixel size
         """
-        pixel_scale = numpy.sqrt(numpy.abs(self.J[0][0]*self.J[1][1] - self.J[0][1]*self.J[1][0]))
-        if outIsArcsec:
-            pixel_scale *= 180.0*3600.0 / numpy.pi
+        (a, b), (c, d) = self.__get_transform(outIsArcsec)[0]
 
-        return pixel_scale
+        return numpy.sqrt(numpy.abs(a*d - b*c)).astype(self.dtype, copy=False)
 
     def pixeltosky_err(self, err_xx, err_xy, err_yy, outIsArcsec=True):
         """
@@ -230,27 +306,7 @@ class WcsJacobian(object):
         # err = average of x x^T
         # ret = average of s s^T = average of (Jx) (x^T J^T) = J err J^T
 
-        J = self.J
-
-        err00 = err_xx
-        err01 = err_xy
-        err10 = err_xy
-        err11 = err_yy
-
-        je00 = J[0][0] * err00 + J[0][1] * err10
-        je01 = J[0][0] * err01 + J[0][1] * err11
-        je10 = J[1][0] * err00 + J[1][1] * err10
-        je11 = J[1][0] * err01 + J[1][1] * err11
-
-        err00 = je00 * J[0][0] + je01 * J[0][1]
-        err01 = je00 * J[1][0] + je01 * J[1][1]
-        err11 = je10 * J[1][0] + je11 * J[1][1]
-
-        if outIsArcsec:
-            toArcsec = (180.0*3600.0 / numpy.pi)**2
-            err00 *= toArcsec
-            err01 *= toArcsec
-            err11 *= toArcsec
+        err00, err11, err01 = self.__transform_tensor(err_xx, err_yy, err_xy, outIsArcsec)
 
         return err00, err01, err11
 
@@ -259,33 +315,13 @@ class WcsJacobian(object):
         Convert positional error (covariance).
         Only its diagonal parts are considered.
         """
-        # \vec{x}: pixel coord
-        # \vec{s}: sky coord
-        #
-        # err = average of x x^T
-        # ret = average of s s^T = average of (Jx) (x^T J^T) = J err J^T
-
-        J = self.J
-
-        err00 = err_xx
-        #err01 = err_xy
-        #err10 = err_xy
-        err11 = err_yy
+        j, m = self.__get_transform(outIsArcsec)
+        t = [numpy.asarray(err_xx, dtype=float), numpy.asarray(err_yy, dtype=float)]
+        tmp = self.__empty(float)
+        acc = self.__get_accumulator()
 
-        je00 = J[0][0] * err00
-        je01 =                   J[0][1] * err11
-        je10 = J[1][0] * err00
-        je11 =                   J[1][1] * err11
-
-        err00 = je00 * J[0][0] + je01 * J[0][1]
-        #err01 = je00 * J[1][0] + je01 * J[1][1]
-        err11 = je10 * J[1][0] + je11 * J[1][1]
-
-        if outIsArcsec:
-            toArcsec = (180.0*3600.0 / numpy.pi)**2
-            err00 *= toArcsec
-            #err01 *= toArcsec
-            err11 *= toArcsec
+        err00 = _sum_of_products(self.__empty(), tmp, m[0, :2], t, acc)
+        err11 = _sum_of_products(self.__empty(), tmp, m[1, :2], t, acc)
 
         return err00, err11
 
@@ -298,92 +334,51 @@ class WcsJacobian(object):
         #  = \int I(p) J p p^T J^T det(J) d^2p / \int I(p) det(J) d^2p
         #  = J I J^T
 
-        J = self.J
-
-        i00 = shape_xx
-        i01 = shape_xy
-        i10 = shape_xy
-        i11 = shape_yy
-
-        # JI = J * I
-        ji00 = J[0][0] * i00  + J[0][1] * i10
-        ji01 = J[0][0] * i01  + J[0][1] * i11
-        ji10 = J[1][0] * i00  + J[1][1] * i10
-        ji11 = J[1][0] * i01  + J[1][1] * i11
-
-        # JIJ = JI * J^T
-        jij00 = ji00 * J[0][0]  + ji01 * J[0][1]
-        jij01 = ji00 * J[1][0]  + ji01 * J[1][1]
-        jij11 = ji10 * J[1][0]  + ji11 * J[1][1]
-
-        if outIsArcsec:
-            toArcsec = (180.0*3600.0 / numpy.pi)**2
-            jij00 *= toArcsec
-            jij01 *= toArcsec
-            jij11 *= toArcsec
-
-        return jij00, jij11, jij01
+        return self.__transform_tensor(shape_xx, shape_yy, shape_xy, outIsArcsec)
 
     def pixeltosky_shape_err(self, err_xx_xx, err_xx_yy, err_yy_yy, err_xx_xy, err_yy_xy, err_xy_xy, outIsArcsec=True):
         """
         Convert covariance of quadrupole moments.
         """
-        J = self.J
-
-        # C[i][j][k][l] = Cov(I[i][j], I[k][l])
-        c0000 = err_xx_xx
-        c0001 = err_xx_xy
-        c0010 = c0001
-        c0011 = err_xx_yy
-        c0100 = c0001
-        c0101 = err_xy_xy
-        c0110 = c0101
-        c0111 = err_yy_xy
-        c1000 = c0001
-        c1001 = c0101
-        c1010 = c0101
-        c1011 = c0111
-        c1100 = c0011
-        c1101 = c0111
-        c1110 = c0111
-        c1111 = err_yy_yy
-
-        # C'[i][j][k][l] = J[i][m] J[j][n] J[k][o] J[l][p] C[m][n][o][p]
-        def Cprime(i,j,k,m):
-            return (
-                J[i][0] * J[j][0] * J[k][0] * J[m][0] * c0000
-            +   J[i][0] * J[j][0] * J[k][0] * J[m][1] * c0001
-            +   J[i][0] * J[j][0] * J[k][1] * J[m][0] * c0010
-            +   J[i][0] * J[j][0] * J[k][1] * J[m][1] * c0011
-            +   J[i][0] * J[j][1] * J[k][0] * J[m][0] * c0100
-            +   J[i][0] * J[j][1] * J[k][0] * J[m][1] * c0101
-            +   J[i][0] * J[j][1] * J[k][1] * J[m][0] * c0110
-            +   J[i][0] * J[j][1] * J[k][1] * J[m][1] * c0111
-            +   J[i][1] * J[j][0] * J[k][0] * J[m][0] * c1000
-            +   J[i][1] * J[j][0] * J[k][0] * J[m][1] * c1001
-            +   J[i][1] * J[j][0] * J[k][1] * J[m][0] * c1010
-            +   J[i][1] * J[j][0] * J[k][1] * J[m][1] * c1011
-            +   J[i][1] * J[j][1] * J[k][0] * J[m][0] * c1100
-            +   J[i][1] * J[j][1] * J[k][0] * J[m][1] * c1101
-            +   J[i][1] * J[j][1] * J[k][1] * J[m][0] * c1110
-            +   J[i][1] * J[j][1] * J[k][1] * J[m][1] * c1111
-            )
-
-        err_xx_xx = Cprime(0,0,0,0)
-        err_xx_yy = Cprime(0,0,1,1)
-        err_yy_yy = Cprime(1,1,1,1)
-        err_xx_xy = Cprime(0,0,0,1)
-        err_yy_xy = Cprime(0,1,1,1)
-        err_xy_xy = Cprime(0,1,0,1)
-
-        if outIsArcsec:
-            toArcsec = (180.0*3600.0 / numpy.pi)**4
-            err_xx_xx *= toArcsec
-            err_xx_yy *= toArcsec
-            err_yy_yy *= toArcsec
-            err_xx_xy *= toArcsec
-            err_yy_xy *= toArcsec
-            err_xy_xy *= toArcsec
+        # The moments (xx, yy, xy) are transformed by I' = m I
+        # (See __get_transform()), hence their covariance by C' = m C m^T.
+        # This is C'[i][j][k][l] = J[i][m] J[j][n] J[k][o] J[l][p] C[m][n][o][p]
+        # with the symmetries of C[m][n][o][p] taken into account.
+
+        j, m = self.__get_transform(outIsArcsec)
+
+        xx_xx = numpy.asarray(err_xx_xx, dtype=float)
+        xx_yy = numpy.asarray(err_xx_yy, dtype=float)
+        yy_yy = numpy.asarray(err_yy_yy, dtype=float)
+        xx_xy = numpy.asarray(err_xx_xy, dtype=float)
+        yy_xy = numpy.asarray(err_yy_xy, dtype=float)
+        xy_xy = numpy.asarray(err_xy_xy, dtype=float)
+
+        C = [
+            [ xx_xx, xx_yy, xx_xy ],
+            [ xx_yy, yy_yy, yy_xy ],
+            [ xx_xy, yy_xy, xy_xy ],
+        ]
+
+        tmp = self.__empty(float)
+        acc = self.__get_accumulator()
+
+        # mC = m C
+        mC = numpy.empty(shape=(3, 3) + self.shape, dtype=float)
+        for i in range(3):
+            for k in range(3):
+                _sum_of_products(mC[i, k, ...], tmp, m[i], [C[0][k], C[1][k], C[2][k]])
+
+        # C' = mC m^T, which is symmetric
+        def Cprime(i, l):
+            return _sum_of_products(self.__empty(), tmp, mC[i], m[l], acc)
+
+        err_xx_xx = Cprime(0, 0)
+        err_xx_yy = Cprime(0, 1)
+        err_yy_yy = Cprime(1, 1)
+        err_xx_xy = Cprime(0, 2)
+        err_yy_xy = Cprime(1, 2)
+        err_xy_xy = Cprime(2, 2)
 
         return err_xx_xx, err_xx_yy, err_yy_yy, err_xx_xy, err_yy_xy, err_xy_xy
 
@@ -391,46 +386,21 @@ class WcsJacobian(object):
         """
         Convert covariance of quadrupole moments. Only its diagonal parts are considered.
         """
-        J = self.J
-
-        # C[i][j][k][l] = Cov(I[i][j], I[k][l])
-        c0000 = err_xx_xx
-        c0101 = err_xy_xy
-        c0110 = c0101
-        c1001 = c0101
-        c1010 = c0101
-        c1111 = err_yy_yy
-
-        # C'[i][j][k][l] = J[i][m] J[j][n] J[k][o] J[l][p] C[m][n][o][p]
-        def Cprime(i,j,k,m):
-            return (
-                J[i][0] * J[j][0] * J[k][0] * J[m][0] * c0000
-            # +   J[i][0] * J[j][0] * J[k][0] * J[m][1] * c0001
-            # +   J[i][0] * J[j][0] * J[k][1] * J[m][0] * c0010
-            # +   J[i][0] * J[j][0] * J[k][1] * J[m][1] * c0011
-            # +   J[i][0] * J[j][1] * J[k][0] * J[m][0] * c0100
-            +   J[i][0] * J[j][1] * J[k][0] * J[m][1] * c0101
-            +   J[i][0] * J[j][1] * J[k][1] * J[m][0] * c0110
-            # +   J[i][0] * J[j][1] * J[k][1] * J[m][1] * c0111
-            # +   J[i][1] * J[j][0] * J[k][0] * J[m][0] * c1000
-            +   J[i][1] * J[j][0] * J[k][0] * J[m][1] * c1001
-            +   J[i][1] * J[j][0] * J[k][1] * J[m][0] * c1010
-            # +   J[i][1] * J[j][0] * J[k][1] * J[m][1] * c1011
-            # +   J[i][1] * J[j][1] * J[k][0] * J[m][0] * c1100
-            # +   J[i][1] * J[j][1] * J[k][0] * J[m][1] * c1101
-            # +   J[i][1] * J[j][1] * J[k][1] * J[m][0] * c1110
-            +   J[i][1] * J[j][1] * J[k][1] * J[m][1] * c1111
-            )
-
-        err_xx_xx = Cprime(0,0,0,0)
-        err_yy_yy = Cprime(1,1,1,1)
-        err_xy_xy = Cprime(0,1,0,1)
-
-        if outIsArcsec:
-            toArcsec = (180.0*3600.0 / numpy.pi)**4
-            err_xx_xx *= toArcsec
-            err_yy_yy *= toArcsec
-            err_xy_xy *= toArcsec
+        # C' = m C m^T with C diagonal: C'[i][i] = sum_k m[i][k]^2 C[k][k]
+
+        j, m = self.__get_transform(outIsArcsec)
+        C = [numpy.asarray(err_xx_xx, dtype=float), numpy.asarray(err_yy_yy, dtype=float), numpy.asarray(err_xy_xy, dtype=float)]
+        tmp = self.__empty(float)
+        acc = self.__get_accumulator()
+        m2 = numpy.empty(shape=(3,) + self.shape, dtype=float)
+
+        def Cprime(i):
+            numpy.multiply(m[i], m[i], out=m2)
+            return _sum_of_products(self.__empty(), tmp, m2, C, acc)
+
+        err_xx_xx = Cprime(0)
+        err_yy_yy = Cprime(1)
+        err_xy_xy = Cprime(2)
 
         return err_xx_xx, err_yy_yy, err_xy_xy
 
@@ -440,13 +410,18 @@ class WcsJacobian(object):
             e = (a^2 - b^2) / (a^2 + b^2),
             e1 = e cos(2theta), e2 = e sin(2theta)
         """
+        e1 = numpy.asarray(e1, dtype=float)
         shape_xx = 1.0 + e1
         shape_yy = 1.0 - e1
         shape_xy = e2
 
-        shape_xx, shape_yy, shape_xy = self.pixeltosky_shape(shape_xx, shape_yy, shape_xy, outIsArcsec=False)
+        # The unit does not matter to the ratios below, and the arcsec
+        # version of the transform is usually there already.
+        # (xx - yy) cancels, and is computed in double precision.
+        shape_xx, shape_yy, shape_xy = self.__transform_tensor(shape_xx, shape_yy, shape_xy, outIsArcsec=True, dtype=float)
 
-        denom = 1.0 / (shape_xx + shape_yy)
+        denom = shape_xx + shape_yy
+        numpy.reciprocal(denom, out=denom)
 
         shape_xx -= shape_yy
         shape_xy *= 2.0
@@ -454,4 +429,33 @@ class WcsJacobian(object):
         shape_xx *= denom
         shape_xy *= denom
 
-        return shape_xx, shape_xy # = (e1, e2)
+        return shape_xx.astype(self.dtype, copy=False), shape_xy.astype(self.dtype, copy=False) # = (e1, e2)
+
+
+def _sum_of_products(out, tmp, xs, ys, acc=None):
+    """
+    Compute out = sum(x * y for x, y in zip(xs, ys))
+    without allocating temporary arrays.
+    @param out (numpy.ndarray)
+        Output array.
+    @param tmp (numpy.ndarray)
+        Work array of the same shape as out, of the dtype of the products.
+    @param acc (numpy.ndarray)
+        Work array like "tmp" in which to sum the products if "out" is of
+        lower precision: the sum is then rounded to "out" only once.
+        None to sum them in "out".
+    @return out
+    """
+    xs = list(xs)
+    ys = list(ys)
+    if acc is None:
+        acc = out
+
+    numpy.multiply(xs[0], ys[0], out=acc)
+    for x, y in zip(xs[1:-1], ys[1:-1]):
+        numpy.multiply(x, y, out=tmp)
+        acc += tmp
+    numpy.multiply(xs[-1], ys[-1], out=tmp)
+    numpy.add(acc, tmp, out=out)
+
+    return out
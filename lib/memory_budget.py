@@ -0,0 +1,147 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Memory budget for ingest.
+The footprint of a unit of work (a patch, a sensor file) is estimated
+from NAXIS1*NAXIS2 in the FITS headers. Units that do not fit in the budget
+are processed in row slices, and concurrent units are admitted
+only while the sum of their estimates fits in the budget.
+
+Admission relies on the estimates alone. The resident memory of the
+process, shared by all worker threads, cannot be attributed to units;
+it is only sampled after each unit to report its peak.
+"""
+
+import contextlib
+import os
+import re
+import threading
+
+from . import config
+from . import fits
+from . import misc
+
+# Peak memory of reading, transforming and encoding a table
+# relative to its size on disk (measured: ~3 for from_hdu alone)
+footprintFactor = 4
+
+_units = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(text):
+    """
+    @param text (str)
+        Size such as "64G", "512M", "1.5T" or "1000000" (bytes).
+    @return (int) number of bytes.
+    """
+    m = re.match(r"^\s*([0-9.]+)\s*([KMGT]?)i?B?\s*$", text, re.IGNORECASE)
+    if not m:
+        raise ValueError("Invalid size: " + text)
+    return int(float(m.group(1)) * _units[m.group(2).upper()])
+
+
+def resident_memory():
+    """
+    @return (int) resident set size of this process in bytes, or 0 if unknown.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def estimate_footprint(paths):
+    """
+    Estimate the memory needed to process the tables in FITS files together.
+    @param paths
+        List of paths to FITS files.
+    @return (footprint, nRows)
+        footprint in bytes, and the number of rows of the largest table.
+    """
+    footprint = 0
+    nRows = 0
+    for path in paths:
+        width, height = fits.fits_get_table_shape(path)
+        footprint += footprintFactor * width * height
+        nRows = max(nRows, height)
+    return footprint, nRows
+
+
+def get_row_ranges(paths):
+    """
+    Split the rows of tables (which must have the same number of rows, or
+    be processed row-by-row in parallel) into slices that fit the budget.
+    @param paths
+        List of paths to FITS files to be processed together.
+    @return
+        List of (start, stop). [None] if no slicing is necessary.
+    """
+    budget = config.memoryBudget
+    if not budget:
+        return [None]
+
+    footprint, nRows = estimate_footprint(paths)
+    if footprint <= budget or nRows <= 1:
+        return [None]
+
+    sliceRows = max(1, nRows * budget // footprint)
+    misc.warning("Footprint {} bytes exceeds --memory-budget: processing {} rows at a time: {}".format(
+        footprint, sliceRows, paths[0]))
+    return [(start, min(nRows, start + sliceRows)) for start in range(0, nRows, sliceRows)]
+
+
+class MemoryBudget(object):
+    """
+    Admission control of concurrent units of work.
+
+    Usage:
+        budget = MemoryBudget(lib.config.memoryBudget)
+        with budget.reserve(footprint):
+            process(unit)
+    """
+
+    def __init__(self, total):
+        """
+        @param total (int)
+            Budget in bytes. 0 for unlimited.
+        """
+        self.total     = total
+        self.reserved  = 0
+        self.peak      = 0
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, footprint):
+        """
+        Block until "footprint" bytes fit in the budget, and hold them
+        while the enclosed block runs. A footprint larger than the budget
+        is admitted alone (the caller should have sliced it).
+        """
+        if self.total:
+            footprint = min(footprint, self.total)
+        with self.condition:
+            while self.total and self.reserved > 0 and self.reserved + footprint > self.total:
+                self.condition.wait()
+            self.reserved += footprint
+        try:
+            yield
+        finally:
+            self.peak = max(self.peak, resident_memory())
+            with self.condition:
+                self.reserved -= footprint
+                self.condition.notify_all()
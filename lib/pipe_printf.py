@@ -22,13 +22,23 @@ import sys
 
 
 def open(format, *columns):
+    return open_chunks([(format, columns)])
+
+
+def open_chunks(chunks):
+    """
+    Like open(), but the output is the concatenation of several
+    tables of the same columns, each printed with its own format.
+    @param chunks
+        List of (format, columns).
+    """
     desc_in, desc_out = os.pipe()
     pid = os.fork()
     if pid == 0:
         with contextlib.suppress(BaseException):
             os.close(desc_in)
         try:
-            __open_child(desc_out, format, *columns)
+            __open_child(desc_out, chunks)
             os._exit(0)
         except BaseException as e:
             with contextlib.suppress(BaseException):
@@ -44,7 +54,7 @@ def open(format, *columns):
         return PipeReadEnd(pid, desc_in)
 
 
-def __open_child(desc_out, format, *columns):
+def __open_child(desc_out, chunks):
     try:
         fout = io.open(desc_out, "wb")
     except:
@@ -53,8 +63,9 @@ def __open_child(desc_out, format, *columns):
         raise
 
     with fout:
-        for tpl in zip(*columns):
-            fout.write(format % tpl)
+        for format, columns in chunks:
+            for tpl in zip(*columns):
+                fout.write(format % tpl)
 
 
 class PipeReadEnd(io.FileIO):
@@ -94,7 +94,7 @@ class SourceTable(object):
                 fields[name] = Field(name, type, unit, data[name], 
                                      to_safe_doc(doc), None)
         if iFlag is not None:
-            data = data["flags"]
+            data = data[header.get("TTYPE{}".format(iFlag), "flags")]
             nFlags = int(re.match(r'^([0-9]+)X$', header["TFORM{}".format(iFlag)]).group(1))
             for i in range(1, 1+nFlags):
                 name = header.get("TFLAG{}".format(i), "")
@@ -284,6 +284,36 @@ class Field_earth(Field):
         return "(%.16e,%.16e,%.16e)"
 
 
+class Field_constant(Field):
+    """
+    Field whose value is the same in all rows, e.g. a column computed
+    from the visit and sensor of an input file.
+    "data" is a 0-dimensional numpy.array holding the value.
+    The value is written in the print format rather than in a column,
+    so that no array is allocated and the value is formatted only once.
+    """
+
+    @staticmethod
+    def from_value(name, value, dtype, doc="", compute=None, type="Scalar"):
+        """
+        @param name (str)
+        @param value
+            The value of all rows.
+        @param dtype
+            numpy dtype of the column.
+        @param type (str)
+            "Scalar" or "Angle" (other types are not of a single value).
+        """
+        return Field_constant(name, type, "", numpy.array(value, dtype=dtype), doc, compute)
+
+    def get_print_format(self):
+        fmt = Field.get_print_format(self)
+        return (fmt % self.data.item()).replace("%", "%%")
+
+    def get_columns(self):
+        return []
+
+
 def to_safe_doc(doc):
     """
     Convert a document string so it will be safe in HTML
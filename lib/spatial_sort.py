@@ -0,0 +1,95 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Spatial ordering of rows.
+Rows are sorted along a Hilbert curve drawn over the bounding box of
+the rows (e.g. a patch) so that objects close on the sky are close in
+the table, which improves the locality of spatial indexes and searches.
+"""
+
+import numpy
+
+# Number of bits per axis of the Hilbert curve
+hilbertOrder = 16
+
+
+def hilbert_key(x, y, order=hilbertOrder):
+    """
+    Distance along the Hilbert curve of cells (x, y).
+    @param x, y (numpy.array of int)
+        Cell coordinates in [0, 2**order).
+    @param order (int)
+        Number of bits per axis.
+    @return numpy.array of int64
+    """
+    x = numpy.array(x, dtype=numpy.int64)
+    y = numpy.array(y, dtype=numpy.int64)
+    n = numpy.int64(1) << order
+    d = numpy.zeros(x.shape, dtype=numpy.int64)
+
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx.astype(numpy.int64)) ^ ry.astype(numpy.int64))
+
+        # Rotate the quadrant so that the curve within it has the standard orientation
+        flip = ~ry & rx
+        x = numpy.where(flip, n - 1 - x, x)
+        y = numpy.where(flip, n - 1 - y, y)
+        swap = ~ry
+        x, y = numpy.where(swap, y, x), numpy.where(swap, x, y)
+        s >>= 1
+
+    return d
+
+
+def get_order(ra, dec, order=hilbertOrder):
+    """
+    Get the permutation that sorts points along a Hilbert curve.
+    @param ra, dec (numpy.array)
+        Coordinates in degrees. Rows whose coordinates are not finite
+        are put at the end, in their original order.
+    @return numpy.array of indices
+    """
+    ra = numpy.asarray(ra, dtype=numpy.float64)
+    dec = numpy.asarray(dec, dtype=numpy.float64)
+    valid = numpy.isfinite(ra) & numpy.isfinite(dec)
+    key = numpy.full(len(ra), numpy.iinfo(numpy.int64).max, dtype=numpy.int64)
+    if not numpy.any(valid):
+        return numpy.arange(len(ra))
+
+    # Local coordinates with RA unwrapped around the median
+    # and scaled so that cells are square on the sky
+    ra0 = numpy.median(ra[valid])
+    x = (ra[valid] - ra0 + 180.0) % 360.0 - 180.0
+    x *= numpy.cos(numpy.radians(numpy.median(dec[valid])))
+    y = dec[valid]
+
+    x = x - x.min()
+    y = y - y.min()
+    scale = max(x.max(), y.max())
+    ncells = 1 << order
+    if scale > 0:
+        x = numpy.minimum((x * (ncells / scale)).astype(numpy.int64), ncells - 1)
+        y = numpy.minimum((y * (ncells / scale)).astype(numpy.int64), ncells - 1)
+    else:
+        x = numpy.zeros(len(x), dtype=numpy.int64)
+        y = x
+
+    key[valid] = hilbert_key(x, y, order)
+    return numpy.argsort(key, kind="stable")
@@ -0,0 +1,631 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generate synthetic catalog files shaped like DC2 DM output.
+
+The files follow the afw table FITS conventions read by
+SourceTable.from_hdu (TCCLS, TDOC, FLAGCOL/TFLAG, ALIAS and
+AFW_TABLE_VERSION header keywords) and are laid out in the directory
+structure expected by ingest-object-catalog.py and ForcedSourceFinder,
+so that the ingest scripts can be exercised without the real reruns.
+"""
+
+import collections
+import itertools
+import os
+
+import numpy
+
+from . import misc
+
+# Bit layout of object_id; see tractSearch() in objcatalog.sql.in
+#   object_id = (tract << 42) | (patch_x << 37) | (patch_y << 32) | (counter)
+TRACT_SHIFT   = 42
+PATCH_X_SHIFT = 37
+PATCH_Y_SHIFT = 32
+
+# Science rafts of the LSST focal plane, in detector order
+RAFTS = [
+    "R01", "R02", "R03",
+    "R10", "R11", "R12", "R13", "R14",
+    "R20", "R21", "R22", "R23", "R24",
+    "R30", "R31", "R32", "R33", "R34",
+    "R41", "R42", "R43",
+]
+
+SENSORS = ["S00", "S01", "S02", "S10", "S11", "S12", "S20", "S21", "S22"]
+
+FILTERS = ["u", "g", "r", "i", "z", "y"]
+
+
+class Column(collections.namedtuple("Column_",
+                                    ["name", "format", "cls", "unit", "doc"])):
+    """
+    Description of a (non-flag) column in a synthetic catalog:
+      * name  : TTYPE
+      * format: TFORM ('K', 'J', 'D', 'E')
+      * cls   : TCCLS ('Scalar', 'Angle', ...)
+      * unit  : TUNIT
+      * doc   : TDOC
+    """
+    __slots__ = []
+
+
+class Schema(object):
+    """
+    Columns, flags and aliases of one kind of catalog file.
+    """
+    __slots__ = ["columns", "flags", "aliases"]
+
+    def __init__(self):
+        self.columns = []
+        self.flags   = []
+        self.aliases = []
+
+    def column(self, name, format="D", cls="Scalar", unit="", doc=""):
+        self.columns.append(Column(name, format, cls, unit, doc or name))
+
+    def flag(self, name, doc=""):
+        self.flags.append((name, doc or name))
+
+    def centroid(self, prefix, errors=True):
+        self.column(prefix + "_x", "D", unit="pixel")
+        self.column(prefix + "_y", "D", unit="pixel")
+        if errors:
+            self.column(prefix + "_xErr", "E", unit="pixel")
+            self.column(prefix + "_yErr", "E", unit="pixel")
+        self.flag(prefix + "_flag")
+
+    def shape(self, prefix, errors=True):
+        for m in ["xx", "yy", "xy"]:
+            self.column(prefix + "_" + m, "D", unit="pixel^2")
+        if errors:
+            for m in ["xx", "yy", "xy"]:
+                self.column(prefix + "_" + m + "Err", "E", unit="pixel^2")
+
+    def flux(self, prefix, flags=()):
+        self.column(prefix + "_instFlux", "D", unit="count")
+        self.column(prefix + "_instFluxErr", "D", unit="count")
+        self.flag(prefix + "_flag")
+        for f in flags:
+            self.flag(prefix + "_flag_" + f)
+
+
+_pixelFlags = [
+    "offimage", "edge", "interpolated", "saturated", "cr", "bad", "suspect",
+    "interpolatedCenter", "saturatedCenter", "crCenter", "suspectCenter",
+    "clipped", "sensor_edge", "sensor_edgeCenter", "inexact_psf",
+    "inexact_psfCenter", "bright_object", "bright_objectCenter",
+]
+
+_apertures = ["3_0", "4_5", "6_0", "9_0", "12_0", "17_0", "25_0", "35_0",
+              "50_0", "70_0"]
+
+_convolvedApertures = ["3_3", "4_5", "6_0", "kron"]
+
+
+def _add_coord(schema):
+    schema.column("coord_ra" , "D", "Angle", "rad", "position in ra/dec")
+    schema.column("coord_dec", "D", "Angle", "rad", "position in ra/dec")
+    schema.column("parent", "K", doc="unique ID of parent source")
+    schema.column("deblend_nChild", "J", doc="Number of children this object has")
+
+
+def _add_pixel_flags(schema):
+    schema.flag("base_PixelFlags_flag")
+    for f in _pixelFlags:
+        schema.flag("base_PixelFlags_flag_" + f)
+
+
+def _add_common_measurements(schema, prefix=""):
+    """
+    Measurements present in ref, forced and (partly) forced-source catalogs.
+    """
+    for a in _apertures:
+        schema.flux(prefix + "base_CircularApertureFlux_" + a,
+                    ["apertureTruncated", "sincCoeffsTruncated"])
+    schema.flux(prefix + "base_PsfFlux", ["noGoodPixels", "edge"])
+    schema.column(prefix + "base_PsfFlux_area", "E", unit="pixel")
+    schema.flux(prefix + "ext_photometryKron_KronFlux",
+                ["edge", "bad_shape", "bad_radius", "small_radius",
+                 "used_psf_radius", "used_minimum_radius"])
+    schema.column(prefix + "ext_photometryKron_KronFlux_radius", "E")
+    schema.column(prefix + "ext_photometryKron_KronFlux_radius_for_radius", "E")
+    schema.column(prefix + "ext_photometryKron_KronFlux_psf_radius", "E")
+    schema.column(prefix + "ext_convolved_ConvolvedFlux_seeing", "D")
+    for seeing, size in itertools.product(range(4), _convolvedApertures):
+        schema.flux("{}ext_convolved_ConvolvedFlux_{}_{}".format(prefix, seeing, size))
+    schema.flag(prefix + "ext_convolved_ConvolvedFlux_flag")
+
+
+def _add_band_measurements(schema):
+    """
+    Measurements common to ref and forced catalogs.
+    """
+    schema.centroid("base_SdssCentroid")
+    schema.flag("base_SdssCentroid_flag_edge")
+    schema.flag("base_SdssCentroid_flag_badError")
+    schema.column("base_ClassificationExtendedness_value", "D")
+    schema.flag("base_ClassificationExtendedness_flag")
+    schema.centroid("base_SdssShape", errors=False)
+    schema.shape("base_SdssShape")
+    schema.column("base_SdssShape_instFlux", "D", unit="count")
+    schema.column("base_SdssShape_instFluxErr", "D", unit="count")
+    schema.column("base_SdssShape_psf_xx", "D", unit="pixel^2")
+    schema.column("base_SdssShape_psf_yy", "D", unit="pixel^2")
+    schema.column("base_SdssShape_psf_xy", "D", unit="pixel^2")
+    for m in ["xx", "yy", "xy"]:
+        schema.column("base_SdssShape_instFlux_" + m + "_Cov", "E")
+    for f in ["unweightedBad", "unweighted", "shift", "maxIter", "psf"]:
+        schema.flag("base_SdssShape_flag_" + f)
+    schema.flux("base_GaussianFlux")
+    schema.column("base_InputCount_value", "J")
+    schema.flag("base_InputCount_flag")
+    schema.flag("base_InputCount_flag_noInputs")
+    schema.flux("base_LocalBackground", ["noGoodPixels", "noPsf"])
+    schema.column("base_Variance_value", "D")
+    schema.flag("base_Variance_flag")
+    schema.flag("base_Variance_flag_emptyFootprint")
+    _add_pixel_flags(schema)
+    for infix in ["", "_initial", "_exp", "_dev"]:
+        schema.flux("modelfit_CModel" + infix, ["badCentroid"])
+        schema.column("modelfit_CModel{}_objective".format(infix), "D")
+    schema.column("modelfit_CModel_fracDev", "D")
+    schema.flag("modelfit_CModel_flag_region_maxArea")
+    schema.flag("modelfit_CModel_flag_noShape")
+    for i in range(2):
+        p = "modelfit_DoubleShapeletPsfApprox_{}".format(i)
+        schema.column(p + "_x", "D", unit="pixel")
+        schema.column(p + "_y", "D", unit="pixel")
+        schema.shape(p, errors=False)
+        schema.column(p + "_0", "D")
+    schema.flag("modelfit_DoubleShapeletPsfApprox_flag")
+    _add_common_measurements(schema)
+
+
+def ref_schema():
+    """
+    Schema of "ref-{tract}-{x},{y}.fits"
+    """
+    schema = Schema()
+    schema.column("id", "K", doc="unique ID")
+    _add_coord(schema)
+    schema.flag("detect_isPrimary", "true if source has no children and is in the inner region of a coadd patch and is in the inner region of a coadd tract and is not a sky source")
+    schema.flag("detect_isPatchInner")
+    schema.flag("detect_isTractInner")
+    for band in FILTERS:
+        schema.flag("merge_footprint_" + band)
+        schema.flag("merge_peak_" + band)
+        schema.flag("merge_measurement_" + band)
+    schema.flag("merge_footprint_sky")
+    schema.flag("merge_peak_sky")
+    _add_band_measurements(schema)
+    for infix, suffix in itertools.product(["raw", "abs"], ["child", "parent"]):
+        schema.column("base_Blendedness_{}_instFlux_{}".format(infix, suffix), "D")
+        for m in ["xx", "yy", "xy"]:
+            schema.column("base_Blendedness_{}_{}_{}".format(infix, suffix, m), "D")
+    schema.column("base_Blendedness_old", "D")
+    schema.column("base_Blendedness_raw", "D")
+    schema.column("base_Blendedness_abs", "D")
+    schema.flag("base_Blendedness_flag")
+    schema.flag("base_Blendedness_flag_noCentroid")
+    schema.flag("base_Blendedness_flag_noShape")
+    for infix in ["HsmPsfMoments", "HsmSourceMoments", "HsmSourceMomentsRound"]:
+        schema.centroid("ext_shapeHSM_" + infix, errors=False)
+        schema.shape("ext_shapeHSM_" + infix, errors=False)
+    for c in ["e1", "e2", "sigma", "resolution"]:
+        schema.column("ext_shapeHSM_HsmShapeRegauss_" + c, "D")
+    schema.flag("ext_shapeHSM_HsmShapeRegauss_flag")
+    schema.flag("ext_shapeHSM_HsmShapeRegauss_flag_galsim")
+    schema.centroid("base_GaussianCentroid", errors=False)
+    schema.centroid("base_NaiveCentroid", errors=False)
+    schema.column("base_FootprintArea_value", "J", unit="pixel")
+    for f in ["psf_candidate", "psf_used", "psf_reserved", "astrometry_used",
+              "photometry_used", "photometry_reserved"]:
+        schema.flag("calib_" + f)
+    for f in ["deblendedAsPsf", "tooManyPeaks", "parentTooBig", "masked",
+              "skipped", "rampedTemplate", "patchedTemplate", "hasStrayFlux"]:
+        schema.flag("deblend_" + f)
+    schema.column("deblend_psfCenter_x", "D", unit="pixel")
+    schema.column("deblend_psfCenter_y", "D", unit="pixel")
+    schema.column("deblend_psf_instFlux", "D", unit="count")
+    schema.column("footprint", "J", doc="index of footprint")
+    schema.aliases = [
+        "slot_Centroid:base_SdssCentroid",
+        "slot_Shape:base_SdssShape",
+        "slot_PsfFlux:base_PsfFlux",
+        "slot_ModelFlux:modelfit_CModel",
+        "slot_ApFlux:base_CircularApertureFlux_12_0",
+        "slot_GaussianFlux:base_GaussianFlux",
+        "slot_CalibFlux:base_CircularApertureFlux_12_0",
+    ]
+    return schema
+
+
+def forced_schema():
+    """
+    Schema of "forced-{filter}-{tract}-{x},{y}.fits"
+    """
+    schema = Schema()
+    schema.column("id", "K", doc="unique ID")
+    _add_coord(schema)
+    _add_band_measurements(schema)
+    schema.centroid("base_TransformedCentroid", errors=False)
+    schema.shape("base_TransformedShape", errors=False)
+    schema.flag("base_TransformedShape_flag")
+    _add_common_measurements(schema, prefix="undeblended_")
+    schema.column("modelfit_GeneralShapeletPsfApprox_Full_0_0", "D")
+    schema.flag("modelfit_GeneralShapeletPsfApprox_flag")
+    schema.aliases = [
+        "slot_Centroid:base_TransformedCentroid",
+        "slot_Shape:base_TransformedShape",
+        "slot_PsfFlux:base_PsfFlux",
+        "slot_ModelFlux:modelfit_CModel",
+        "slot_ApFlux:base_CircularApertureFlux_12_0",
+        "slot_CalibFlux:base_CircularApertureFlux_12_0",
+    ]
+    return schema
+
+
+def forcedsource_schema():
+    """
+    Schema of "forced_{visit}-{filter}-Rxx-Sxx-detNNN.fits".
+    The header must fit in the 46080 bytes that
+    ForcedSourceFinder assumes for files with no rows.
+    """
+    schema = Schema()
+    schema.column("id", "K", doc="unique ID")
+    _add_coord(schema)
+    schema.column("objectId", "K", doc="Unique ID of reference source")
+    schema.column("base_PsfFlux_instFlux", "D", unit="count")
+    schema.column("base_PsfFlux_instFluxErr", "D", unit="count")
+    schema.column("base_PsfFlux_area", "E", unit="pixel")
+    schema.column("base_PsfFlux_apCorr", "D")
+    schema.column("base_PsfFlux_apCorrErr", "D")
+    schema.flag("base_PsfFlux_flag")
+    schema.flag("base_PsfFlux_flag_noGoodPixels")
+    schema.flag("base_PsfFlux_flag_edge")
+    schema.flag("base_PsfFlux_flag_apCorr")
+    _add_pixel_flags(schema)
+    schema.centroid("base_TransformedCentroid", errors=False)
+    schema.shape("base_TransformedShape", errors=False)
+    schema.centroid("base_SdssCentroid")
+    schema.centroid("base_SdssShape", errors=False)
+    schema.shape("base_SdssShape")
+    schema.column("base_SdssShape_psf_xx", "D", unit="pixel^2")
+    schema.column("base_SdssShape_psf_yy", "D", unit="pixel^2")
+    schema.column("base_SdssShape_psf_xy", "D", unit="pixel^2")
+    for a in _apertures[:6]:
+        schema.flux("base_CircularApertureFlux_" + a)
+    schema.flux("base_GaussianFlux")
+    schema.flux("base_LocalBackground")
+    schema.flux("ext_photometryKron_KronFlux")
+    schema.aliases = [
+        "slot_Centroid:base_TransformedCentroid",
+        "slot_Shape:base_TransformedShape",
+        "slot_PsfFlux:base_PsfFlux",
+    ]
+    return schema
+
+
+def make_object_id(tract, patch, counter):
+    """
+    @param tract (int)
+    @param patch (int) x*100 + y
+    @param counter (numpy.array)
+    @return numpy.array of int64 object_id
+    """
+    x, y = patch // 100, patch % 100
+    base = (tract << TRACT_SHIFT) | (x << PATCH_X_SHIFT) | (y << PATCH_Y_SHIFT)
+    return numpy.int64(base) + numpy.asarray(counter, dtype=numpy.int64)
+
+
+def patch_center(tract, patch, nPatch, patchSize=0.25):
+    """
+    Center (ra, dec) in degrees of a patch on a simple rectilinear skymap
+    covering roughly the DC2 footprint.
+    """
+    x, y = patch // 100, patch % 100
+    tractSize = nPatch * patchSize
+    ra0  = 50.0 + (tract % 16) * tractSize
+    dec0 = -45.0 + (tract // 16) * tractSize
+    return ra0 + (x + 0.5) * patchSize, dec0 + (y + 0.5) * patchSize
+
+
+def _column_data(col, nRows, rng):
+    """
+    Generate plausible values for a column, chosen by its name and format.
+    """
+    name = col.name
+    if col.format in ("K", "J"):
+        dtype = numpy.int64 if col.format == "K" else numpy.int32
+        return rng.integers(0, 100, size=nRows).astype(dtype)
+
+    dtype = numpy.float64 if col.format == "D" else numpy.float32
+    if name.endswith("_x") or name.endswith("_y"):
+        data = rng.uniform(0.0, 4200.0, size=nRows)
+    elif name.endswith("Err") or name.endswith("_area") or name.endswith("radius"):
+        data = rng.lognormal(0.0, 0.5, size=nRows)
+    elif "instFlux" in name:
+        data = rng.lognormal(6.0, 1.5, size=nRows)
+    elif name.endswith("_xx") or name.endswith("_yy"):
+        data = rng.lognormal(1.5, 0.3, size=nRows)
+    else:
+        data = rng.normal(0.0, 1.0, size=nRows)
+
+    data = data.astype(dtype)
+    # a few NaN's as in the real data
+    data[rng.random(nRows) < 0.01] = numpy.nan
+    return data
+
+
+_formatToDtype = {
+    "K": ">i8",
+    "J": ">i4",
+    "D": ">f8",
+    "E": ">f4",
+}
+
+
+def _card(key, value):
+    """
+    Format an 80-byte FITS header card.
+    """
+    if isinstance(value, str):
+        value = "'{:8}'".format(value.replace("'", "''")[:66])
+        card = "{:8}= {}".format(key, value)
+    elif isinstance(value, bool):
+        card = "{:8}= {:>20}".format(key, "T" if value else "F")
+    else:
+        card = "{:8}= {:>20}".format(key, value)
+    return "{:80}".format(card[:80]).encode("ascii")
+
+
+def _pad(buf, fill):
+    return buf + fill * (-len(buf) % 2880)
+
+
+@misc.cached
+def _header_cards(schema, afwTableVersion):
+    """
+    Header cards of the binary table HDU, except the leading
+    XTENSION..NAXIS2 cards which depend on the number of rows
+    and the trailing END card.
+    @return (bytes, numpy.dtype of a row)
+    """
+    cards = []
+    nFlags = len(schema.flags)
+    dtype = numpy.dtype(
+        [(col.name, _formatToDtype[col.format]) for col in schema.columns]
+        + [("flags", "u1", ((nFlags + 7) // 8,))]
+    )
+
+    cards.append(_card("PCOUNT", 0))
+    cards.append(_card("GCOUNT", 1))
+    cards.append(_card("TFIELDS", len(schema.columns) + 1))
+    for i, col in enumerate(schema.columns, 1):
+        cards.append(_card("TTYPE{}".format(i), col.name))
+        cards.append(_card("TFORM{}".format(i), "1" + col.format))
+        if col.unit:
+            cards.append(_card("TUNIT{}".format(i), col.unit))
+        cards.append(_card("TCCLS{}".format(i), col.cls))
+        cards.append(_card("TDOC{}".format(i), col.doc))
+
+    iFlag = len(schema.columns) + 1
+    cards.append(_card("TTYPE{}".format(iFlag), "flags"))
+    cards.append(_card("TFORM{}".format(iFlag), "{}X".format(nFlags)))
+    cards.append(_card("TCCLS{}".format(iFlag), "Scalar"))
+    cards.append(_card("FLAGCOL", iFlag))
+    for i, (name, doc) in enumerate(schema.flags, 1):
+        cards.append(_card("TFLAG{}".format(i), name))
+        cards.append(_card("TFDOC{}".format(i), doc))
+
+    for alias in schema.aliases:
+        cards.append(_card("ALIAS", alias))
+    cards.append("{:80}".format("HIERARCH AFW_TABLE_VERSION = {}".format(afwTableVersion)).encode("ascii"))
+
+    return b"".join(cards), dtype
+
+
+_primaryHeader = _pad(b"".join([
+    _card("SIMPLE", True),
+    _card("BITPIX", 8),
+    _card("NAXIS", 0),
+    _card("EXTEND", True),
+    "{:80}".format("END").encode("ascii"),
+]), b" ")
+
+
+def write_catalog(path, schema, nRows, rng, fixed=None, afwTableVersion=3,
+                  emptySize=None):
+    """
+    Write a catalog file of the given schema.
+    The file is written directly rather than through pyfits,
+    whose header handling would dominate the run time.
+    @param path (str)
+        Output path. Parent directories are created.
+    @param schema (Schema)
+    @param nRows (int)
+    @param rng (numpy.random.Generator)
+    @param fixed (dict)
+        Map from column name to numpy.array overriding the random values.
+    @param afwTableVersion (int)
+        Value of AFW_TABLE_VERSION
+    @param emptySize (int)
+        If given, the header is padded with blank cards so that
+        a file with no rows is exactly this many bytes long.
+    """
+    fixed = fixed or {}
+    cards, dtype = _header_cards(schema, afwTableVersion)
+
+    data = numpy.empty(nRows, dtype=dtype)
+    for col in schema.columns:
+        values = fixed.get(col.name)
+        if values is None:
+            values = _column_data(col, nRows, rng)
+        data[col.name] = values
+
+    flags = rng.random((nRows, len(schema.flags))) < 0.05
+    for i, (name, doc) in enumerate(schema.flags):
+        if name in fixed:
+            flags[:, i] = fixed[name]
+    data["flags"] = numpy.packbits(flags, axis=1)
+
+    header = b"".join([
+        _card("XTENSION", "BINTABLE"),
+        _card("BITPIX", 8),
+        _card("NAXIS", 2),
+        _card("NAXIS1", dtype.itemsize),
+        _card("NAXIS2", nRows),
+        cards,
+    ])
+    if emptySize is not None:
+        nBlank = (emptySize - len(_primaryHeader)) // 80 - len(header) // 80 - 1
+        header += b" " * (80 * max(nBlank, 0))
+    header += "{:80}".format("END").encode("ascii")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fout:
+        fout.write(_primaryHeader)
+        fout.write(_pad(header, b" "))
+        fout.write(_pad(data.tobytes(), b"\0"))
+
+
+def generate_object_catalog(rerunDir, tracts, nPatch=7, filters=FILTERS,
+                            nObjects=1000, seed=0, afwTableVersion=3):
+    """
+    Write ref and forced catalogs for every (tract, patch, filter).
+    Layout is that of get_ref_path/get_catalog_path in ingest-object-catalog.py
+    (schema names of Run1.1 style, i.e. "forced-*.fits"):
+        {rerunDir}/deepCoadd-results/merged/{tract}/{x},{y}/ref-{tract}-{x},{y}.fits
+        {rerunDir}/deepCoadd-results/{filter}/{tract}/{x},{y}/forced-{filter}-{tract}-{x},{y}.fits
+
+    @param tracts (list of int)
+    @param nPatch (int)
+        Patches per side of a tract. Each tract has nPatch x nPatch patches.
+    @param nObjects (int)
+        Number of objects per patch.
+    @return list of (tract, patch) generated.
+    """
+    refSchema    = ref_schema()
+    forcedSchema = forced_schema()
+    generated = []
+
+    for tract in tracts:
+        for x, y in itertools.product(range(nPatch), range(nPatch)):
+            patch = x*100 + y
+            rng = numpy.random.default_rng((seed, tract, patch))
+            fixed = _object_columns(tract, patch, nPatch, nObjects, rng)
+
+            path = "{rerunDir}/deepCoadd-results/merged/{tract}/{x},{y}/ref-{tract}-{x},{y}.fits".format(**locals())
+            write_catalog(path, refSchema, nObjects, rng, fixed, afwTableVersion)
+
+            for filter in filters:
+                path = "{rerunDir}/deepCoadd-results/{filter}/{tract}/{x},{y}/forced-{filter}-{tract}-{x},{y}.fits".format(**locals())
+                write_catalog(path, forcedSchema, nObjects, rng, fixed, afwTableVersion)
+
+            generated.append((tract, patch))
+
+    return generated
+
+
+def _object_columns(tract, patch, nPatch, nObjects, rng):
+    """
+    Columns whose values must be consistent among ref and forced files.
+    """
+    object_id = make_object_id(tract, patch, numpy.arange(1, nObjects+1))
+    ra, dec = patch_center(tract, patch, nPatch)
+    ra  = ra  + rng.uniform(-0.125, 0.125, size=nObjects)
+    dec = dec + rng.uniform(-0.125, 0.125, size=nObjects)
+
+    # About one object in ten is a deblended child of an earlier one
+    parent = numpy.zeros(nObjects, dtype=numpy.int64)
+    isChild = rng.random(nObjects) < 0.1
+    isChild[0] = False
+    parentIndex = (rng.random(nObjects) * numpy.arange(nObjects)).astype(numpy.int64)
+    parent[isChild] = object_id[parentIndex[isChild]]
+    nChild = numpy.bincount(parentIndex[isChild], minlength=nObjects).astype(numpy.int32)
+
+    return {
+        "id"              : object_id,
+        "coord_ra"        : numpy.radians(ra),
+        "coord_dec"       : numpy.radians(dec),
+        "parent"          : parent,
+        "deblend_nChild"  : nChild,
+        "detect_isPrimary": (nChild == 0) & (rng.random(nObjects) < 0.9),
+    }
+
+
+def forcedsource_path(forcedDir, visit, filter, raft, sensor):
+    """
+    Path of a forced-source file as ForcedSourceFinder expects it.
+    """
+    det = RAFTS.index(raft) * len(SENSORS) + SENSORS.index(sensor)
+    visitDir = "{:08}-{}".format(visit, filter)
+    basename = "forced_{}-{}-{}-det{:03}.fits".format(visitDir, raft, sensor, det)
+    return os.path.join(forcedDir, visitDir, raft, basename)
+
+
+def generate_forcedsource(forcedDir, visits, tracts, nPatch=7, nObjects=1000,
+                          nRafts=len(RAFTS), nSources=500, emptyFraction=0.1,
+                          filters=FILTERS, seed=0, afwTableVersion=3,
+                          minLen=46080):
+    """
+    Write forced-source files for every (visit, raft, sensor).
+    The objectId's point to objects generate_object_catalog() would make
+    for the same (tracts, nPatch, nObjects).
+
+    @param visits (list of int)
+    @param nRafts (int)
+        Number of rafts per visit (at most 21).
+    @param nSources (int)
+        Number of rows in each non-empty sensor file.
+    @param emptyFraction (float)
+        Fraction of sensor files that have no rows.
+    @param minLen (int)
+        Size of files with no rows; see ForcedSourceFinder.
+    @return list of paths generated.
+    """
+    schema = forcedsource_schema()
+    generated = []
+
+    for i, visit in enumerate(visits):
+        filter = filters[i % len(filters)]
+        for raft, sensor in itertools.product(RAFTS[:nRafts], SENSORS):
+            rng = numpy.random.default_rng((seed, visit, RAFTS.index(raft), SENSORS.index(sensor)))
+            nRows = 0 if rng.random() < emptyFraction else min(nSources, nObjects)
+
+            tract = rng.choice(tracts)
+            patch = int(rng.integers(nPatch))*100 + int(rng.integers(nPatch))
+            # (objectId, ccdVisitId) is the primary key: no duplicates
+            counter = rng.choice(numpy.arange(1, nObjects+1), size=nRows, replace=False)
+            objectId = make_object_id(tract, patch, counter)
+            ra, dec = patch_center(tract, patch, nPatch)
+
+            fixed = {
+                "id"       : numpy.arange(nRows, dtype=numpy.int64) + (visit << 20),
+                "objectId" : objectId,
+                "parent"   : numpy.zeros(nRows, dtype=numpy.int64),
+                "coord_ra" : numpy.radians(ra  + rng.uniform(-0.125, 0.125, size=nRows)),
+                "coord_dec": numpy.radians(dec + rng.uniform(-0.125, 0.125, size=nRows)),
+            }
+            path = forcedsource_path(forcedDir, visit, filter, raft, sensor)
+            write_catalog(path, schema, nRows, rng, fixed, afwTableVersion,
+                          emptySize=minLen)
+            generated.append(path)
+
+    return generated
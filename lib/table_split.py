@@ -0,0 +1,239 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Row widths of DB tables, and split of algos into DB tables by row width.
+The width of a row is computed as PostgreSQL lays out a heap tuple:
+a 23-byte header and a null bitmap, padded to 8 bytes, followed by
+the columns, each aligned to its type's alignment.
+"""
+
+from . import config
+from . import misc
+
+# Size and alignment of SQL types in a heap tuple.
+# An Earth (cube of 3 dimensions) is a varlena of 4 + 4 + 3*8 bytes.
+typeWidths = {
+    "Boolean"         : (1, 1),
+    "Smallint"        : (2, 2),
+    "Integer"         : (4, 4),
+    "Bigint"          : (8, 8),
+    "Real"            : (4, 4),
+    "Double precision": (8, 8),
+    "Earth"           : (32, 8),
+}
+
+# Variable-length types, put after fixed-length ones by align_columns()
+variableWidthTypes = set(["Earth"])
+
+# Size of HeapTupleHeaderData
+tupleHeaderSize = 23
+# Maximum number of columns of a table
+maxColumns = 1600
+
+
+def align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def get_row_width(sqltypes):
+    """
+    Get the size of a heap tuple with the given columns, all not null.
+    @param sqltypes
+        List of SQL types of the columns in order.
+    @return (int) bytes
+    """
+    # The null bitmap is counted because NULLs appear in most rows
+    offset = 0
+    for sqltype in sqltypes:
+        width, alignment = typeWidths.get(sqltype, (8, 8))
+        offset = align(offset, alignment) + width
+
+    header = align(tupleHeaderSize + (len(sqltypes) + 7) // 8, 8)
+    return align(header + offset, 8)
+
+
+def get_alignment_class(sqltype):
+    """
+    @return (int)
+        Key by which to sort columns: 8-byte types first,
+        then 4, 2, 1-byte types, and variable-length types last.
+    """
+    if sqltype in variableWidthTypes:
+        return 1
+    width, alignment = typeWidths.get(sqltype, (8, 8))
+    return -alignment
+
+
+def align_columns(columns):
+    """
+    Order columns so that no bytes are wasted in alignment padding
+    (if config.alignColumns).
+    The order among columns of the same alignment is kept.
+    @param columns
+        List of (name, sqltype).
+    @return (columns, saved)
+        "columns" is the list of (name, sqltype) in the physical order.
+        "saved" is the number of bytes per row saved by the reordering.
+    """
+    if not config.alignColumns:
+        return list(columns), 0
+
+    ordered = sorted(columns, key=lambda column: get_alignment_class(column[1]))
+    saved = (get_row_width([sqltype for name, sqltype in columns])
+           - get_row_width([sqltype for name, sqltype in ordered]))
+    return ordered, saved
+
+
+def get_stored_width(sqltypes):
+    """
+    Same as get_row_width(), but the columns are in the order
+    in which they are created (see align_columns()).
+    """
+    if config.alignColumns:
+        sqltypes = sorted(sqltypes, key=get_alignment_class)
+    return get_row_width(sqltypes)
+
+
+def get_algo_sqltypes(algo):
+    """
+    @return
+        List of SQL types of the backend columns of an algo for one band,
+        as they will be after transform().
+    """
+    return [sqltype for name, sqltype in algo.predict_backend_fields("")]
+
+
+def get_table_sqltypes(algos, nBands):
+    """
+    @param algos
+        List of Algo in the order of columns.
+    @param nBands
+        Number of bands (1 for band-independent tables).
+    @return
+        List of SQL types of the columns of the table, including object_id.
+    """
+    sqltypes = ["Bigint"]
+    for i in range(nBands):
+        for algo in algos:
+            sqltypes.extend(get_algo_sqltypes(algo))
+    return sqltypes
+
+
+def split(algos, pinned, get_name, nBands, maxTupleSize=None):
+    """
+    Assign algos to tables.
+    The "pinned" tables (those referenced by the DPDD view) are kept
+    as given. The other algos are packed, widest first, into as few tables
+    as possible whose rows are at most maxTupleSize bytes.
+    An algo wider than maxTupleSize is given a table of its own.
+    @param algos
+        PoppingOrderedDict mapping algo name -> Algo.
+    @param pinned
+        List of (table name, [algo names]).
+        Algos in this list but not in "algos" are ignored.
+    @param get_name
+        Function mapping k = 0, 1, ... to the name of the k-th table
+        of unpinned algos.
+    @param nBands
+        Number of bands of the tables (1 for band-independent tables).
+    @param maxTupleSize
+        Maximum size (bytes) of a row. Default: config.maxTupleSize
+    @return
+        List of (table name, [algo names]).
+        The algo names in each table are in the order in "algos".
+    """
+    if maxTupleSize is None: maxTupleSize = config.maxTupleSize
+
+    order = dict((name, i) for i, name in enumerate(algos))
+    sqltypes = dict((name, get_algo_sqltypes(algo)) for name, algo in algos.items())
+
+    def get_columns(names):
+        columns = ["Bigint"]
+        for i in range(nBands):
+            for name in names:
+                columns.extend(sqltypes[name])
+        return columns
+
+    def get_width(names):
+        return get_stored_width(get_columns(names))
+
+    def fits(names):
+        return (get_width(names) <= maxTupleSize
+            and len(get_columns(names)) <= maxColumns)
+
+    layout = []
+    pinnedNames = set()
+    for tableName, names in pinned:
+        names = [name for name in names if name in algos]
+        pinnedNames.update(names)
+        if not fits(names):
+            misc.warning("Table {} is wider than {} bytes: {} bytes".format(
+                tableName, maxTupleSize, get_width(names)))
+        layout.append((tableName, names))
+
+    rest = [name for name in algos if name not in pinnedNames]
+    rest.sort(key=lambda name: (-get_width([name]), order[name]))
+
+    bins = []
+    for name in rest:
+        for names in bins:
+            candidate = sorted(names + [name], key=order.get)
+            if fits(candidate):
+                names[:] = candidate
+                break
+        else:
+            if not fits([name]):
+                misc.warning("Algo {} is wider than {} bytes: {} bytes".format(
+                    name, maxTupleSize, get_width([name])))
+            bins.append([name])
+
+    # Keep the tables in the order of their first algos
+    bins.sort(key=lambda names: order[names[0]])
+    layout.extend((get_name(k), names) for k, names in enumerate(bins))
+
+    return layout
+
+
+def describe(dbtables, nBands):
+    """
+    Describe the layout of tables for review.
+    @param dbtables
+        PoppingOrderedDict mapping name -> DBTable.
+    @param nBands
+        Number of bands of the tables (1 for band-independent tables).
+    @return
+        List of dicts that can be dumped as YAML.
+    """
+    ret = []
+    for name, table in dbtables.items():
+        sqltypes = get_table_sqltypes(list(table.algos.values()), nBands)
+        ret.append({
+            "table": name,
+            "bands": nBands,
+            "columns": len(sqltypes),
+            "row_bytes": get_stored_width(sqltypes),
+            "algos": [
+                {
+                    "name": algoName,
+                    "columns": len(get_algo_sqltypes(algo)),
+                    "bytes_per_band": sum(typeWidths.get(sqltype, (8, 8))[0]
+                                          for sqltype in get_algo_sqltypes(algo)),
+                }
+                for algoName, algo in table.algos.items()
+            ],
+        })
+    return ret
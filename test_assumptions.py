@@ -14,9 +14,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import io
+import os
+import shutil
+import tempfile
 import unittest
 
+import lib.dbimage
+import lib.fits
+import lib.synthetic
 from lib.assumptions import Assumptions
+from lib.forcedsource_finder import ForcedSourceFinder
+from lib.sourcetable import SourceTable
 
 class testAssumptions(unittest.TestCase):
 
@@ -30,6 +40,153 @@ class testAssumptions(unittest.TestCase):
         for t in tables:
             print(t)
 
+    def read_raw(self):
+        """
+        @return (SourceTable, determiners) of a synthetic forced-source file
+        """
+        outdir = tempfile.mkdtemp()
+        try:
+            lib.synthetic.generate_forcedsource(outdir, [100], [4850], nPatch=1,
+                                                nObjects=20, nRafts=1,
+                                                nSources=10, emptyFraction=0)
+            finder = ForcedSourceFinder(outdir)
+            f = finder.get_visit_files(100)[0]
+            raw = SourceTable.from_hdu(lib.fits.fits_open(f)[1])
+        finally:
+            shutil.rmtree(outdir)
+        return raw, finder.get_determiner_dict(f)
+
+    def test_apply(self):
+        raw, dets = self.read_raw()
+        assump = Assumptions(self.yaml_file)
+        for i in range(2):
+            tables = assump.apply(raw, 'schema', **dets)
+        self.assertEqual(len(assump._plans), 1)
+
+        fields = tables['forcedsourcenative'].fields
+        self.assertIn('objectId', fields)
+        self.assertIn('base_PsfFlux_instFlux', fields)
+        self.assertNotIn('coord_ra', fields)
+        ccdVisitId = int(dets['raft'] + dets['sensor'] + dets['visit'])
+        self.assertEqual(fields['ccdVisitId'].get_columns(), [])
+        self.assertEqual(fields['ccdVisitId'].get_print_format(), str(ccdVisitId))
+        self.assertEqual(fields['ccdVisitId'].get_sqltype(), 'Bigint')
+
+    def test_constant_field(self):
+        raw, dets = self.read_raw()
+        ccdVisitId = int(dets['raft'] + dets['sensor'] + dets['visit'])
+
+        # The column is of the dtype in the yaml file
+        assump = Assumptions(self.yaml_file)
+        assump.parse()
+        for d in assump.parsed['tables']['forcedsourcenative']['columns']:
+            if d.get('name') == 'ccdVisitId':
+                d['dtype'] = 'float32'
+        dbimage = assump.apply(raw, 'schema', **dets)['forcedsourcenative']
+        dbimage.transform()
+        self.assertIn(('ccdVisitId', 'Real'), dbimage._get_backend_fields(''))
+
+        assump = Assumptions(self.yaml_file)
+        dbimage = assump.apply(raw, 'schema', **dets)['forcedsourcenative']
+        dbimage.transform()
+        backend_fields = dbimage._get_backend_fields('')
+        self.assertIn(('objectId', 'Bigint'), backend_fields)
+        self.assertIn(('ccdVisitId', 'Bigint'), backend_fields)
+
+        # Its value is in the format, and it has no column
+        data = dbimage.get_backend_field_data('')
+        self.assertEqual([name for name, fmt, cols in data],
+                         [name for name, sqltype in backend_fields])
+        self.assertIn(('ccdVisitId', str(ccdVisitId), []), data)
+
+        # TSV as written by insert_bits() in ingest-forcedsource.py
+        fmt = '\t'.join(fmt for name, fmt, cols in data) + '\n'
+        columns = [col for name, fmt, cols in data for col in cols]
+        lines = ''.join(fmt % tpl for tpl in zip(*columns)).splitlines()
+        self.assertEqual(len(lines), len(raw.fields['objectId'].data))
+        iCol = [name for name, fmt, cols in data].index('ccdVisitId')
+        iObject = [name for name, fmt, cols in data].index('objectId')
+        for line, objectId in zip(lines, raw.fields['objectId'].data):
+            values = line.split('\t')
+            self.assertEqual(len(values), len(data))
+            self.assertEqual(values[iCol], str(ccdVisitId))
+            self.assertEqual(values[iObject], str(objectId))
+
+        # A computed column is a single value
+        assump = Assumptions(self.yaml_file)
+        assump.parse()
+        for d in assump.parsed['tables']['forcedsourcenative']['columns']:
+            if d.get('name') == 'ccdVisitId':
+                d['type'] = 'Array'
+        with self.assertRaises(ValueError):
+            assump.apply(raw, 'schema', **dets)
+
+
+    def test_partition(self):
+        assump = Assumptions(self.yaml_file)
+        assump.parse()
+        assump.parsed['tables']['forcedsourcenative']['partition'] = {
+            'method': 'range', 'key': '(ccdVisitId % 100000000)',
+            'value': '{visit}', 'width': 10000, 'name': 'visit'}
+        partition = assump.get_partition('forcedsourcenative')
+
+        dets = {'visit': '00159479', 'raft': '01', 'sensor': '20'}
+        self.assertEqual(lib.dbimage.get_partition_bound(partition, dets),
+                         ('visit150000', 'FOR VALUES FROM (150000) TO (160000)'))
+
+        partition = dict(partition, method='list', value='{raft}', name='raft')
+        self.assertEqual(lib.dbimage.get_partition_bound(partition, dets),
+                         ('raft01', 'FOR VALUES IN (1)'))
+
+    def test_primary_index_statements(self):
+        raw, dets = self.read_raw()
+        assump = Assumptions(self.yaml_file)
+        dbimage = assump.apply(raw, 'schema', **dets)['forcedsourcenative']
+
+        # The index is built without blocking writers
+        create, alter = [' '.join(statement.split())
+                         for statement in dbimage.get_primary_index_statements()]
+        self.assertEqual(create,
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "forcedsourcenative_pkey" '
+            'ON "schema"."forcedsourcenative" (objectid,ccdVisitId)')
+        self.assertEqual(alter,
+            'ALTER TABLE "schema"."forcedsourcenative" ADD CONSTRAINT "forcedsourcenative_pkey" '
+            'PRIMARY KEY USING INDEX "forcedsourcenative_pkey"')
+
+    def test_partitioned_statements(self):
+        raw, dets = self.read_raw()
+        assump = Assumptions(self.yaml_file)
+        assump.parse()
+        assump.parsed['tables']['forcedsourcenative']['partition'] = {
+            'method': 'range', 'key': '(ccdVisitId % 100000000)',
+            'value': '{visit}', 'width': 10000, 'name': 'visit'}
+        dbimage = assump.apply(raw, 'schema', **dets)['forcedsourcenative']
+        dbimage.transform()
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            dbimage.create(None, 'schema')
+        self.assertIn('PARTITION BY RANGE ((ccdVisitId % 100000000))', out.getvalue())
+        self.assertNotIn('PRIMARY KEY', out.getvalue())
+
+        # Keys are not created on the partitioned table, whose primary key
+        # would have to include the partition key
+        with self.assertRaises(ValueError):
+            dbimage.get_primary_index_statements()
+        with self.assertRaises(ValueError):
+            dbimage.get_foreign_statements()
+        with self.assertRaises(ValueError):
+            dbimage.get_cluster_statements()
+
+        # but on each partition
+        table = 'forcedsourcenative_visit0'
+        statements = dbimage.get_primary_index_statements(table)
+        self.assertEqual(len(statements), 2)
+        self.assertIn('ON "schema"."{}" (objectid,ccdVisitId)'.format(table), statements[0])
+        self.assertIn('ALTER TABLE "schema"."{}" ADD CONSTRAINT "{}_pkey"'.format(table, table), statements[1])
+        for statement in dbimage.get_foreign_statements(table):
+            self.assertIn('ALTER TABLE "schema"."{}"'.format(table), statement)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,58 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import lib.config
+from lib.dbtable import DBTable_BandIndependent
+from lib.misc import PoppingOrderedDict
+
+class Cursor(object):
+    """
+    Cursor of a db in which no table is partitioned
+    """
+    def execute(self, query):
+        pass
+
+    def fetchone(self):
+        return None
+
+class DBTable_Referenced(DBTable_BandIndependent):
+    isReferenced = True
+
+class testDBTable(unittest.TestCase):
+
+    def tearDown(self):
+        lib.config.indexStrategy = "btree"
+
+    def get_index_names(self, table):
+        return [name for name, statements in table.get_index_jobs(Cursor(), "s")]
+
+    def test_brin_index_jobs(self):
+        lib.config.indexStrategy = "brin"
+
+        names = self.get_index_names(DBTable_BandIndependent("forced2", PoppingOrderedDict()))
+        self.assertEqual(names, ["forced2_object_id_brin"])
+
+        # Foreign keys need a unique index on the referenced table
+        table = DBTable_Referenced("position", PoppingOrderedDict())
+        jobs = dict(table.get_index_jobs(Cursor(), "s"))
+        self.assertIn("position_pkey", jobs)
+        self.assertIn("CREATE UNIQUE INDEX", jobs["position_pkey"][0])
+        self.assertIn("PRIMARY KEY", jobs["position_pkey"][1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.dir_index import DirectoryIndex
+
+class testDirectoryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.rootdir = os.path.join(self.outdir, "root")
+        self.path = os.path.join(self.outdir, "index.json")
+        for visit in ["v1", "v2"]:
+            for raft in ["r1", "r2"]:
+                self.write(visit, raft, "f1", 1)
+        # Not indexed
+        self.write("v1", "other", "f1", 1)
+        self.write("v1", "r1", "other", 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+
+    def write(self, visit, raft, name, size):
+        raftdir = os.path.join(self.rootdir, visit, raft)
+        os.makedirs(raftdir, exist_ok=True)
+        with open(os.path.join(raftdir, name), "wb") as f:
+            f.write(b"x" * size)
+
+    def set_mtime(self, *names):
+        # The resolution of mtime may be coarse
+        os.utime(os.path.join(self.rootdir, *names), (0, 0))
+
+    def new_index(self):
+        return DirectoryIndex(self.rootdir, "v[0-9]", "r[0-9]", "f[0-9]", path=self.path, nThreads=2)
+
+    def get_files(self, index):
+        return dict(
+            ((visit, raft, name), size)
+            for visit, entry in index.visits.items()
+            for raft, raftEntry in entry["rafts"].items()
+            for name, (size, mtime) in raftEntry["files"].items()
+        )
+
+    def test_refresh(self):
+        index = self.new_index()
+        self.assertEqual(index.visits, {})
+        index.refresh()
+        index.save()
+        self.assertEqual(sorted(self.get_files(index)), [
+            ("v1", "r1", "f1"), ("v1", "r2", "f1"), ("v2", "r1", "f1"), ("v2", "r2", "f1"),
+        ])
+
+        # New visit, file removed, file added, and a file rewritten
+        # in place (which is not noticed in a raft dir of unchanged mtime)
+        self.write("v3", "r1", "f1", 1)
+        os.remove(os.path.join(self.rootdir, "v1", "r2", "f1"))
+        self.set_mtime("v1", "r2")
+        self.write("v2", "r1", "f2", 2)
+        self.set_mtime("v2", "r1")
+        mtime = os.stat(os.path.join(self.rootdir, "v2", "r2")).st_mtime
+        self.write("v2", "r2", "f1", 3)
+        os.utime(os.path.join(self.rootdir, "v2", "r2"), (mtime, mtime))
+
+        index = self.new_index()
+        index.refresh()
+        self.assertEqual(self.get_files(index), {
+            ("v1", "r1", "f1"): 1,
+            ("v2", "r1", "f1"): 1,
+            ("v2", "r1", "f2"): 2,
+            ("v2", "r2", "f1"): 1,
+            ("v3", "r1", "f1"): 1,
+        })
+
+        # A removed visit
+        shutil.rmtree(os.path.join(self.rootdir, "v3"))
+        index.refresh()
+        self.assertEqual(sorted(index.visits), ["v1", "v2"])
+
+    def test_save_load(self):
+        index = self.new_index()
+        index.refresh()
+        index.save()
+
+        loaded = self.new_index()
+        self.assertEqual(loaded.visits, index.visits)
+
+        # The index of another tree is not loaded
+        other = DirectoryIndex(self.outdir, "v[0-9]", "r[0-9]", "f[0-9]", path=self.path)
+        self.assertEqual(other.visits, {})
+
+    def test_get_visit(self):
+        # Without refresh(), visits are scanned one at a time
+        index = DirectoryIndex(self.rootdir, "v[0-9]", "r[0-9]", "f[0-9]")
+        self.assertEqual(index.list_visits(), ["v1", "v2"])
+        self.assertEqual(sorted(index.get_visit("v2")["rafts"]), ["r1", "r2"])
+        self.assertEqual(list(index.visits), ["v2"])
+        self.assertFalse(os.path.exists(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
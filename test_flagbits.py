@@ -0,0 +1,61 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy
+
+import lib.config
+import lib.flagbits
+from lib.sourcetable import Field
+
+class testFlagBits(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(1)
+        self.flags = [
+            Field("flag_{}".format(i), "Scalar", "", rng.rand(50) < 0.5, "", None)
+            for i in range(70)
+        ]
+
+    def tearDown(self):
+        lib.config.packFlags = False
+
+    def test_select_flags(self):
+        fields = self.flags[:3] + [Field("detect_isPrimary", "Scalar", "", numpy.ones(50, dtype=bool), "", None)]
+        self.assertEqual(lib.flagbits.select_flags(fields), [])
+        lib.config.packFlags = True
+        self.assertEqual(lib.flagbits.select_flags(fields), [])
+        self.assertEqual(len(lib.flagbits.select_flags(self.flags + fields)), 73)
+
+    def test_pack(self):
+        packed = lib.flagbits.pack("algo", self.flags)
+        self.assertEqual([field.name for field, names in packed], ["algo_flagbits0", "algo_flagbits1"])
+        self.assertEqual([len(names) for field, names in packed], [63, 7])
+
+        columns = dict((field.name, field.data) for field, names in packed)
+        positions = lib.flagbits.get_bit_positions("algo", [f.name for f in self.flags])
+        for f in self.flags:
+            column, bit = positions[f.name]
+            decoded = (columns[column] & (1 << bit)) != 0
+            self.assertTrue(numpy.array_equal(decoded, f.data))
+
+    def test_decode_expression(self):
+        self.assertEqual(lib.flagbits.decode_expression("algo_flagbits1", 3),
+                         "((algo_flagbits1 & 8::Bigint) <> 0)")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import threading
+import unittest
+
+import lib.common
+import lib.index_builder
+
+class Connection(object):
+    """
+    Fake DB connection that logs the statements executed in it
+    """
+    def __init__(self, log, lock):
+        self.log = log
+        self.lock = lock
+        self.autocommit = False
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+class Cursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        with self.connection.lock:
+            self.connection.log.append((self.connection, query))
+
+    def fetchone(self):
+        # Size of a table
+        return (0,)
+
+class testIndexBuilder(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        lock = threading.Lock()
+        new_db_connection = lib.common.new_db_connection
+        self.addCleanup(setattr, lib.common, "new_db_connection", new_db_connection)
+        lib.common.new_db_connection = lambda: Connection(self.log, lock)
+
+    def test_concurrent_statements(self):
+        jobs = [
+            ('"s"."a"', "a", [["CLUSTER a", "ANALYZE a"]]),
+            ('"s"."b"', "b", ["CREATE INDEX b", "ALTER TABLE b"]),
+        ]
+        lib.index_builder.build_indexes(jobs, 2, out=io.StringIO())
+        log = [(connection, query) for connection, query in self.log
+               if query in ["CLUSTER a", "ANALYZE a", "CREATE INDEX b", "ALTER TABLE b"]]
+        queries = [query for connection, query in log]
+        self.assertEqual(sorted(queries), ["ALTER TABLE b", "ANALYZE a", "CLUSTER a", "CREATE INDEX b"])
+
+        # CLUSTER and ANALYZE are separate statements, in order,
+        # in the same autocommit session
+        connections = dict((query, connection) for connection, query in log)
+        self.assertLess(queries.index("CLUSTER a"), queries.index("ANALYZE a"))
+        self.assertIs(connections["CLUSTER a"], connections["ANALYZE a"])
+        self.assertTrue(connections["CLUSTER a"].autocommit)
+        self.assertTrue(connections["CREATE INDEX b"].autocommit)
+
+        # The other statements are run after all concurrent ones
+        self.assertEqual(queries[-1], "ALTER TABLE b")
+        self.assertFalse(connections["ALTER TABLE b"].autocommit)
+
+if __name__ == '__main__':
+    unittest.main()
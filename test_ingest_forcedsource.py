@@ -0,0 +1,213 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+
+import lib.benchmark
+import lib.common
+
+ingest = lib.benchmark.load_script("ingest-forcedsource")
+
+class Database(object):
+    """
+    Fake database. A unit inserts its label into the data tables
+    and into "_temp:forced_bit" in the transaction of its connection.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Committed rows
+        self.data = []
+        self.bits = []
+        # Labels in the order they are read, and COPYed
+        self.reads = []
+        self.copies = []
+
+class Connection(object):
+    def __init__(self, database):
+        self.database = database
+        self.staged = []
+        self.data = []
+        self.bits = []
+        self.savepoint = None
+        self.broken = False
+
+    def cursor(self):
+        return Cursor(self)
+
+    def check(self):
+        if self.broken:
+            raise RuntimeError("server closed the connection unexpectedly")
+
+    def commit(self):
+        self.check()
+        with self.database.lock:
+            self.database.data.extend(self.data)
+            self.database.bits.extend(self.bits)
+        self.data, self.bits = [], []
+
+    def rollback(self):
+        self.check()
+        self.staged, self.data, self.bits = [], [], []
+
+    def close(self):
+        pass
+
+class Cursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query):
+        c = self.connection
+        c.check()
+        if query == "SAVEPOINT unit":
+            c.savepoint = (len(c.staged), len(c.data), len(c.bits))
+        elif query == "RELEASE SAVEPOINT unit":
+            c.savepoint = None
+        elif query == "ROLLBACK TO SAVEPOINT unit":
+            nStaged, nData, nBits = c.savepoint
+            del c.staged[nStaged:], c.data[nData:], c.bits[nBits:]
+
+class Assumptions(object):
+    def get_tables(self):
+        return ["forcedsource"]
+
+class testInsertVisitsParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database()
+        self.labels = ["u{}".format(i) for i in range(6)]
+        # label -> seconds to read the unit
+        self.delays = {}
+        # Labels of units that fail after their COPY
+        self.failures = set()
+        # Labels of units during whose COPY the session dies
+        self.deaths = set()
+
+        self.patch(lib.common, "new_db_connection", lambda: Connection(self.database))
+        self.patch(ingest, "get_units", lambda *args: [(label, [label]) for label in self.labels])
+        self.patch(ingest, "create_bit_table", lambda *args: None)
+        self.patch(ingest, "create_staging_tables", lambda *args: None)
+        self.patch(ingest, "insert_files", self.insert_files)
+        self.patch(ingest, "move_staged_rows", self.move_staged_rows)
+
+    def patch(self, obj, name, value):
+        self.addCleanup(setattr, obj, name, getattr(obj, name))
+        setattr(obj, name, value)
+
+    def insert_files(self, cursor, schema, finder, assumptions, files, wait=None, copy_schema=None):
+        label, = files
+        time.sleep(self.delays.get(label, 0))
+        with self.database.lock:
+            self.database.reads.append(label)
+        if wait is not None:
+            wait()
+
+        c = cursor.connection
+        c.check()
+        with self.database.lock:
+            self.database.copies.append(label)
+        (c.staged if copy_schema == "pg_temp" else c.data).append(label)
+        c.bits.append(label)
+        if label in self.deaths:
+            c.broken = True
+            c.check()
+        if label in self.failures:
+            raise RuntimeError("COPY failed")
+
+    def move_staged_rows(self, cursor, schema, assumptions, tableNames):
+        c = cursor.connection
+        c.check()
+        c.data.extend(c.staged)
+        del c.staged[:]
+
+    def run_insert(self, nJobs, **kwargs):
+        thread = threading.Thread(target=self.insert, args=(nJobs,), kwargs=kwargs)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        return self.error
+
+    def insert(self, nJobs, **kwargs):
+        self.error = None
+        try:
+            ingest.insert_visits_parallel("s", None, Assumptions(), [], nJobs, **kwargs)
+        except RuntimeError as e:
+            self.error = str(e)
+
+    def test_ordered(self):
+        # Later units are read first, but inserted in order
+        self.delays = {"u0": 0.3, "u1": 0.2}
+        self.assertIsNone(self.run_insert(3, ordered=True))
+        self.assertNotEqual(self.database.reads, self.labels)
+        self.assertEqual(self.database.copies, self.labels)
+        self.assertEqual(self.database.data, self.labels)
+        self.assertEqual(self.database.bits, self.labels)
+
+    def test_savepoint(self):
+        # Only the failed unit is rolled back; the units staged before it are kept
+        self.failures = {"u1", "u4"}
+        error = self.run_insert(1, stage=10)
+        self.assertIn("u1: COPY failed", error)
+        self.assertIn("u4: COPY failed", error)
+        expected = ["u0", "u2", "u3", "u5"]
+        self.assertEqual(self.database.data, expected)
+        self.assertEqual(self.database.bits, expected)
+
+    def get_errors(self, error):
+        """
+        @return dict mapping label -> message of the failed units
+        """
+        lines = error.splitlines()[1:]
+        errors = dict(line.split(": ", 1) for line in lines)
+        self.assertEqual(len(errors), len(lines))
+        return errors
+
+    def test_lost_session(self):
+        # Units staged in a session that dies are reported,
+        # and the bookkeeping agrees with the data
+        self.labels = ["u{}".format(i) for i in range(7)]
+        self.deaths = {"u4"}
+        errors = self.get_errors(self.run_insert(1, stage=3))
+        self.assertEqual(errors, {
+            "u3": "lost with the session: server closed the connection unexpectedly",
+            "u4": "server closed the connection unexpectedly",
+            "u5": "not processed",
+            "u6": "not processed",
+        })
+        self.assertEqual(self.database.data, ["u0", "u1", "u2"])
+        self.assertEqual(self.database.bits, ["u0", "u1", "u2"])
+
+    def test_lost_session_parallel(self):
+        # The other workers go on with the rest
+        self.labels = ["u{}".format(i) for i in range(12)]
+        self.deaths = {"u3"}
+        self.delays = dict((label, 0.01) for label in self.labels)
+        errors = self.get_errors(self.run_insert(2, stage=2))
+        self.assertIn("u3", errors)
+        self.assertEqual(sorted(self.database.data), sorted(self.database.bits))
+        self.assertEqual(sorted(self.database.data + list(errors)), sorted(self.labels))
+        self.assertGreater(len(self.database.data), 6)
+
+if __name__ == '__main__':
+    unittest.main()
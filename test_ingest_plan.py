@@ -0,0 +1,134 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import lib.fits
+import lib.ingest_plan
+import lib.synthetic
+from lib.algo.base_PixelFlags import Algo_base_PixelFlags
+from lib.algo.base_PsfFlux import Algo_base_PsfFlux
+from lib.algo.base_TransformedCentroid import Algo_base_TransformedCentroid
+from lib.dbtable import DBTable
+from lib.misc import PoppingOrderedDict
+from lib.sourcetable import SourceTable
+
+algoclasses = PoppingOrderedDict([
+    ("base_PsfFlux", Algo_base_PsfFlux),
+    ("base_PixelFlags", Algo_base_PixelFlags),
+    ("base_TransformedCentroid", Algo_base_TransformedCentroid),
+])
+
+def build(table, algoclasses, path):
+    table.cutout_subtable("id")
+    algos = PoppingOrderedDict(
+        (name, algoclass(table)) for name, algoclass in algoclasses.items()
+    )
+    return PoppingOrderedDict([("forced", DBTable("forced", algos))])
+
+class testIngestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        lib.synthetic.generate_object_catalog(self.outdir, [4850], nPatch=1,
+                                              nObjects=30, filters=["r"])
+        self.path = os.path.join(self.outdir,
+            'deepCoadd-results/r/4850/0,0/forced-r-4850-0,0.fits')
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+
+    def get_field_data(self, dbtables):
+        table = dbtables["forced"]
+        table.transform(self.outdir, 4850, 0, "r", None)
+        return table.get_backend_field_data("r")
+
+    def test_execute(self):
+        table = SourceTable.from_hdu(lib.fits.fits_open(self.path)[1])
+        expected = self.get_field_data(build(table, algoclasses, self.path))
+
+        header, data, nRows = lib.fits.fits_open_raw(self.path)
+        plan = lib.ingest_plan.get_plan(self.path, header, build, algoclasses)
+        self.assertIsNotNone(plan)
+        self.assertIs(plan, lib.ingest_plan.get_plan(self.path, header, build, algoclasses))
+        self.assertEqual(plan.dm_schema_version(), 3)
+
+        dbtables, (object_id,) = plan.execute(data, nRows, ["id"])
+        self.assertEqual(len(object_id), 30)
+        actual = self.get_field_data(dbtables)
+
+        self.assertEqual([m[:2] for m in actual], [m[:2] for m in expected])
+        self.assertColumnsEqual(actual, expected)
+
+    def test_flag_column_name(self):
+        # The flag column is found by FLAGCOL and its TTYPE, whatever its name
+        with open(self.path, "rb") as f:
+            content = f.read()
+        self.assertEqual(content.count(b"= 'flags   '"), 1)
+        with open(self.path, "wb") as f:
+            f.write(content.replace(b"= 'flags   '", b"= 'flagset '"))
+
+        table = SourceTable.from_hdu(lib.fits.fits_open(self.path)[1])
+        expected = self.get_field_data(build(table, algoclasses, self.path))
+
+        header, data, nRows = lib.fits.fits_open_raw(self.path)
+        plan = lib.ingest_plan.get_plan(self.path, header, build, algoclasses)
+        self.assertIsNotNone(plan)
+        dbtables, _ = plan.execute(data, nRows, ["id"])
+        self.assertColumnsEqual(self.get_field_data(dbtables), expected)
+
+    def test_signature_change(self):
+        # A file with another header signature gets a plan of its own
+        path = os.path.join(self.outdir, "renamed.fits")
+        with open(self.path, "rb") as f:
+            content = f.read()
+        self.assertEqual(content.count(b"TTYPE80 = 'base_PsfFlux_area'"), 1)
+        with open(path, "wb") as f:
+            f.write(content.replace(b"TTYPE80 = 'base_PsfFlux_area'", b"TTYPE80 = 'base_PsfFlux_arex'"))
+
+        header1, data1, nRows1 = lib.fits.fits_open_raw(self.path)
+        header2, data2, nRows2 = lib.fits.fits_open_raw(path)
+        plan1 = lib.ingest_plan.get_plan(self.path, header1, build, algoclasses)
+        plan2 = lib.ingest_plan.get_plan(path, header2, build, algoclasses)
+        self.assertIsNotNone(plan2)
+        self.assertIsNot(plan1, plan2)
+
+        for p, plan, data, nRows, key in [
+            (self.path, plan1, data1, nRows1, "base_PsfFlux_area"),
+            (path, plan2, data2, nRows2, "base_PsfFlux_arex"),
+        ]:
+            table = SourceTable.from_hdu(lib.fits.fits_open(p)[1])
+            expected = self.get_field_data(build(table, algoclasses, p))
+            dbtables, _ = plan.execute(data, nRows, ["id"])
+            algo = dbtables["forced"].algos["base_PsfFlux"]
+            self.assertIsInstance(algo, Algo_base_PsfFlux)
+            self.assertIn(key, algo.sourceTable.fields)
+            self.assertColumnsEqual(self.get_field_data(dbtables), expected)
+
+    def assertColumnsEqual(self, actual, expected):
+        self.assertEqual([m[:2] for m in actual], [m[:2] for m in expected])
+        for (_, _, cols1), (_, _, cols2) in zip(actual, expected):
+            for c1, c2 in zip(cols1, cols2):
+                self.assertEqual(c1.dtype, c2.dtype)
+                self.assertTrue(numpy.array_equal(c1, c2, equal_nan=True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy
+
+import lib.config
+from lib.libwcs import WcsJacobian
+
+class testWcsJacobian(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        # Jacobians of a WCS of 0.2 arcsec/pixel, slightly rotated
+        # and distorted, as those of real images
+        scale = 0.2 / 3600.0 * (numpy.pi / 180.0)
+        theta = rng.uniform(-1e-2, 1e-2, size=100)
+        self.J = numpy.empty(shape=(100, 2, 2))
+        self.J[:, 0, 0] = -scale * numpy.cos(theta)
+        self.J[:, 0, 1] =  scale * numpy.sin(theta)
+        self.J[:, 1, 0] =  scale * numpy.sin(theta)
+        self.J[:, 1, 1] =  scale * numpy.cos(theta)
+        self.J *= rng.uniform(0.99, 1.01, size=(100, 2, 2))
+
+        # Random symmetric tensors I[n, i, j] and
+        # covariances C[n, i, j, k, l] = Cov(I[n, i, j], I[n, k, l])
+        a = rng.normal(size=(100, 2, 2))
+        self.I = a + a.transpose(0, 2, 1)
+        b = rng.normal(size=(100, 10, 2, 2))
+        b = b + b.transpose(0, 1, 3, 2)
+        self.C = numpy.einsum("zsij,zskl->zijkl", b, b)
+
+        self.toArcsec = 180.0*3600.0 / numpy.pi
+
+    def tearDown(self):
+        lib.config.wcsSinglePrecision = False
+
+    def check(self, rtol):
+        J, I, C = self.J, self.I, self.C
+        jacobian = WcsJacobian(J)
+
+        Iprime = numpy.einsum("zim,zjn,zmn->zij", J, J, I) * self.toArcsec**2
+        xx, yy, xy = jacobian.pixeltosky_shape(I[:, 0, 0], I[:, 1, 1], I[:, 0, 1])
+        numpy.testing.assert_allclose(xx, Iprime[:, 0, 0], rtol=rtol)
+        numpy.testing.assert_allclose(yy, Iprime[:, 1, 1], rtol=rtol)
+        numpy.testing.assert_allclose(xy, Iprime[:, 0, 1], rtol=rtol)
+
+        Cprime = numpy.einsum("zim,zjn,zko,zlp,zmnop->zijkl", J, J, J, J, C) * self.toArcsec**4
+        indices = [(0,0,0,0), (0,0,1,1), (1,1,1,1), (0,0,0,1), (0,1,1,1), (0,1,0,1)]
+        result = jacobian.pixeltosky_shape_err(*(C[(slice(None),) + index] for index in indices))
+        for index, err in zip(indices, result):
+            expected = Cprime[(slice(None),) + index]
+            self.assertEqual(err.dtype, jacobian.dtype)
+            numpy.testing.assert_allclose(err, expected, rtol=rtol)
+
+        # Nested lists are accepted
+        jacobian = WcsJacobian([[J[:, 0, 0], J[:, 0, 1]], [J[:, 1, 0], J[:, 1, 1]]])
+        numpy.testing.assert_array_equal(jacobian.J, J)
+
+    def test_double(self):
+        self.check(1e-12)
+
+    def test_single(self):
+        # Only the results are rounded to single precision
+        lib.config.wcsSinglePrecision = True
+        self.check(1e-7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+import numpy
+
+import lib.config
+import lib.fits
+import lib.memory_budget
+import lib.synthetic
+from lib.sourcetable import SourceTable
+
+class testMemoryBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        lib.synthetic.generate_object_catalog(self.outdir, [4850], nPatch=1,
+                                              nObjects=100, filters=['r'])
+        self.path = os.path.join(self.outdir,
+            'deepCoadd-results/merged/4850/0,0/ref-4850-0,0.fits')
+
+    def tearDown(self):
+        lib.config.memoryBudget = 0
+        shutil.rmtree(self.outdir)
+
+    def test_parse_size(self):
+        self.assertEqual(lib.memory_budget.parse_size('64G'), 64 << 30)
+        self.assertEqual(lib.memory_budget.parse_size('1.5k'), 1536)
+        self.assertEqual(lib.memory_budget.parse_size('1000'), 1000)
+        self.assertRaises(ValueError, lib.memory_budget.parse_size, '1X')
+
+    def test_row_ranges(self):
+        self.assertEqual(lib.memory_budget.get_row_ranges([self.path]), [None])
+
+        width, height = lib.fits.fits_get_table_shape(self.path)
+        self.assertEqual(height, 100)
+        lib.config.memoryBudget = width * height
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            ranges = lib.memory_budget.get_row_ranges([self.path])
+        self.assertGreater(len(ranges), 1)
+
+        full = SourceTable.from_hdu(lib.fits.fits_open(self.path)[1])
+        parts = [SourceTable.from_hdu(lib.fits.fits_open(self.path, rowRange=r)[1])
+                 for r in ranges]
+        for name in ['id', 'coord_ra', 'detect_isPrimary']:
+            self.assertTrue(numpy.array_equal(
+                full.fields[name].data,
+                numpy.concatenate([p.fields[name].data for p in parts])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy
+
+import lib.spatial_sort
+
+class testSpatialSort(unittest.TestCase):
+
+    def test_hilbert_key(self):
+        x, y = numpy.meshgrid(numpy.arange(8), numpy.arange(8))
+        key = lib.spatial_sort.hilbert_key(x.ravel(), y.ravel(), 3)
+        self.assertEqual(sorted(key), list(range(64)))
+
+        # consecutive cells along the curve are adjacent
+        order = numpy.argsort(key)
+        steps = numpy.abs(numpy.diff(x.ravel()[order])) + numpy.abs(numpy.diff(y.ravel()[order]))
+        self.assertTrue(numpy.all(steps == 1))
+
+    def test_get_order(self):
+        rng = numpy.random.RandomState(1)
+        ra = rng.uniform(359.9, 360.1, 1000) % 360.0
+        dec = rng.uniform(-30.0, -29.8, 1000)
+        ra[5] = numpy.nan
+
+        order = lib.spatial_sort.get_order(ra, dec)
+        self.assertEqual(sorted(order), list(range(1000)))
+        self.assertEqual(order[-1], 5)
+
+        def step(index):
+            dra = ((numpy.diff(ra[index]) + 180.0) % 360.0 - 180.0) * numpy.cos(numpy.radians(30.0))
+            return numpy.median(numpy.hypot(dra, numpy.diff(dec[index])))
+
+        self.assertLess(step(order[:-1]), step(numpy.delete(numpy.arange(1000), 5)) / 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import lib.common
+import lib.fits
+import lib.synthetic
+from lib.sourcetable import SourceTable
+from lib.forcedsource_finder import ForcedSourceFinder
+
+class testSynthetic(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.rerun = os.path.join(self.outdir, 'rerun')
+        self.forced = os.path.join(self.outdir, 'forced')
+        lib.synthetic.generate_object_catalog(self.rerun, [4850], nPatch=2,
+                                              nObjects=50)
+        lib.synthetic.generate_forcedsource(self.forced, [100, 101], [4850],
+                                            nPatch=2, nObjects=50, nRafts=1,
+                                            nSources=20, emptyFraction=0.3)
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+
+    def test_layout(self):
+        self.assertEqual(lib.common.get_existing_tracts(self.rerun), [4850])
+        self.assertEqual(lib.common.get_existing_filters(self.rerun),
+                         sorted(lib.synthetic.FILTERS))
+
+    def test_object_catalog(self):
+        d = os.path.join(self.rerun, 'deepCoadd-results')
+        ref = SourceTable.from_hdu(lib.fits.fits_open(
+            os.path.join(d, 'merged/4850/1,0/ref-4850-1,0.fits'))[1])
+        forced = SourceTable.from_hdu(lib.fits.fits_open(
+            os.path.join(d, 'r/4850/1,0/forced-r-4850-1,0.fits'))[1])
+
+        self.assertEqual(ref.dm_schema_version(), 3)
+        self.assertEqual(ref.slots['PsfFlux'], 'base_PsfFlux')
+        self.assertEqual(ref.fields['coord_ra'].type, 'Angle')
+        self.assertEqual(ref.fields['detect_isPrimary'].data.dtype.name, 'bool')
+        self.assertTrue(numpy.all(ref.fields['id'].data
+                                  == forced.fields['id'].data))
+        skymap = (ref.fields['id'].data >> 32) % (1 << 10)
+        self.assertTrue(numpy.all(skymap == (1 << 5) + 0))
+
+    def test_forcedsource(self):
+        finder = ForcedSourceFinder(self.forced)
+        self.assertEqual(finder.get_visits(), [100, 101])
+        for f in finder.get_visit_files(100, nonempty=False):
+            table = SourceTable.from_hdu(lib.fits.fits_open(f)[1])
+            nonempty = os.stat(f).st_size > finder.min_len
+            self.assertEqual(len(table.fields['objectId'].data) > 0, nonempty)
+
+    def test_finder_index(self):
+        index = os.path.join(self.outdir, 'index.json')
+        files = ForcedSourceFinder(self.forced).get_visit_files(100, nonempty=False)
+        last = files[-1]
+        moved = os.path.join(self.outdir, 'moved.fits')
+        os.rename(last, moved)
+
+        finder = ForcedSourceFinder(self.forced, index_path=index)
+        self.assertEqual(finder.get_visit_files(100, nonempty=False), files[:-1])
+        self.assertTrue(os.path.exists(index))
+
+        # A file added after the index was saved is found by the next finder.
+        # (Set the mtime of the directory because its resolution may be coarse)
+        os.rename(moved, last)
+        os.utime(os.path.dirname(last), (0, 0))
+        finder = ForcedSourceFinder(self.forced, index_path=index)
+        self.assertEqual(finder.get_visit_files(100, nonempty=False), files)
+        self.assertEqual(finder.get_file_path(100, 'R01', 'S22'), last)
+
+if __name__ == '__main__':
+    unittest.main()
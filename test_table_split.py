@@ -0,0 +1,69 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import lib.table_split
+from lib.misc import PoppingOrderedDict
+
+class ColumnsAlgo(object):
+    def __init__(self, sqltypes):
+        self.sqltypes = sqltypes
+
+    def predict_backend_fields(self, prefix):
+        return [(prefix + "c{}".format(i), t) for i, t in enumerate(self.sqltypes)]
+
+class testTableSplit(unittest.TestCase):
+
+    def test_row_width(self):
+        # header 23 + 1 byte of null bitmap -> 24
+        self.assertEqual(lib.table_split.get_row_width(["Bigint"]), 32)
+        # Boolean at 0, Bigint aligned to 8
+        self.assertEqual(lib.table_split.get_row_width(["Boolean", "Bigint"]), 40)
+        self.assertEqual(lib.table_split.get_row_width(["Bigint", "Boolean", "Real"]), 40)
+        # 9 columns need 2 bytes of null bitmap -> header 32
+        self.assertEqual(lib.table_split.get_row_width(["Boolean"] * 9), 48)
+
+    def test_align_columns(self):
+        columns = [("a", "Boolean"), ("b", "Double precision"), ("c", "Earth"),
+                   ("d", "Smallint"), ("e", "Real"), ("f", "Bigint")]
+        ordered, saved = lib.table_split.align_columns(columns)
+        self.assertEqual([name for name, sqltype in ordered], ["b", "f", "e", "d", "a", "c"])
+        # Columns take 64 bytes with padding in the given order, 56 in the new order
+        self.assertEqual(saved, 8)
+
+    def test_split(self):
+        algos = PoppingOrderedDict([
+            ("hot" , ColumnsAlgo(["Double precision"] * 10)),
+            ("a"   , ColumnsAlgo(["Real"] * 20)),
+            ("b"   , ColumnsAlgo(["Real"] * 20)),
+            ("c"   , ColumnsAlgo(["Real"] * 40)),
+            ("d"   , ColumnsAlgo(["Boolean"] * 8)),
+        ])
+        layout = lib.table_split.split(algos, [("dpdd", ["hot", "missing"])],
+            lambda k: "t{}".format(k), nBands=2, maxTupleSize=400)
+
+        self.assertEqual(layout[0], ("dpdd", ["hot"]))
+        self.assertEqual(sorted(sum((names for name, names in layout), [])),
+                         ["a", "b", "c", "d", "hot"])
+        for name, names in layout[1:]:
+            sqltypes = lib.table_split.get_table_sqltypes([algos[n] for n in names], 2)
+            self.assertLessEqual(lib.table_split.get_row_width(sqltypes), 400)
+        # c (2 x 160 bytes) and d fit together; a and b together
+        self.assertEqual(layout[1:], [("t0", ["a", "b"]), ("t1", ["c", "d"])])
+
+if __name__ == '__main__':
+    unittest.main()